@@ -0,0 +1,66 @@
+"""
+BENCHMARK OF THE ARRAY DAILY AGGREGATION AGAINST THE DATAFRAME GROUPBY
+
+Usage:
+    python -m benchmarks.bench_aggregation --latitudes 20 --longitudes 20 --days 31
+
+Times the conversion and daily aggregation of a synthetic month of hourly data, from the dataset to the
+daily rows, with ``aggregate_daily_arrays`` and with the hourly dataframe of ``convert_hourly`` and
+``aggregate_daily``, and checks that the results are identical.
+"""
+import argparse
+import time
+
+import pandas as pd
+import xarray as xr
+from benchmarks.bench_derived import synthetic_hourly_df
+from src.ingestion.transform import (
+    aggregate_daily,
+    aggregate_daily_arrays,
+    convert_hourly,
+)
+
+
+def dataframe_aggregation(ds: xr.Dataset) -> pd.DataFrame:
+    df = ds.to_dataframe()
+    df.dropna(inplace=True)
+    return aggregate_daily(convert_hourly(df)).reset_index()
+
+
+def timed(function, ds: xr.Dataset, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        result = function(ds)
+        best = min(best, time.perf_counter() - tic)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=31)
+    parser.add_argument("--latitudes", type=int, default=20)
+    parser.add_argument("--longitudes", type=int, default=20)
+    parser.add_argument("--dtype", choices=["float32", "float64"], default="float64")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    ds = synthetic_hourly_df(
+        args.days, args.latitudes, args.longitudes, args.dtype
+    ).to_xarray()
+    print(
+        f"{ds.sizes['time']} hours of {ds.sizes['latitude']}x{ds.sizes['longitude']} grid points of {args.dtype}"
+    )
+
+    expected, dataframe_time = timed(dataframe_aggregation, ds, args.repeat)
+    result, array_time = timed(aggregate_daily_arrays, ds, args.repeat)
+    pd.testing.assert_frame_equal(result, expected, check_exact=True)
+
+    print(
+        f"dataframe {dataframe_time:0.4f} s, arrays {array_time:0.4f} s, {dataframe_time / array_time:0.1f}x"
+    )
+    print("results are identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+BENCHMARK OF THE NEAREST GRID POINT OF MANY LOCATIONS
+
+Compares a KNN query per location (``get_closest_point``), a single LATERAL KNN query for all
+locations and snapping to the in memory grid index (``get_closest_points``).
+
+Usage:
+    python -m benchmarks.bench_closest_points postgresql://localhost/era5 --locations 50000
+
+The database should contain ingested data, the locations are drawn within its bounding box.
+"""
+import argparse
+import time
+
+import numpy as np
+from sqlalchemy import create_engine
+from src.postgis_era5.psql import PSQLInterface
+from src.postgis_era5.table import Era5Layout
+from src.postgis_era5.types import WGS84Point
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("database_url")
+    parser.add_argument("--table", default="era5_ecuador")
+    parser.add_argument("--normalized", action="store_true")
+    parser.add_argument("--locations", type=int, default=50_000)
+    parser.add_argument(
+        "--single",
+        type=int,
+        default=1_000,
+        help="number of locations resolved one by one, the time is extrapolated to all locations",
+    )
+    args = parser.parse_args()
+
+    db = PSQLInterface(
+        create_engine(args.database_url),
+        layout=Era5Layout(table=args.table, normalized=args.normalized),
+    )
+
+    tic = time.perf_counter()
+    index = db.grid_index()
+    index_seconds = time.perf_counter() - tic
+
+    rng = np.random.default_rng(42)
+    locations = np.column_stack(
+        [
+            rng.uniform(index.latitude.min(), index.latitude.max(), args.locations),
+            rng.uniform(index.longitude.min(), index.longitude.max(), args.locations),
+        ]
+    )
+
+    single = min(args.single, args.locations)
+    tic = time.perf_counter()
+    for latitude, longitude in locations[:single]:
+        db.get_closest_point(WGS84Point(latitude=latitude, longitude=longitude))
+    single_seconds = (time.perf_counter() - tic) * args.locations / single
+
+    tic = time.perf_counter()
+    in_database = db.get_closest_points(locations)
+    database_seconds = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    in_memory = db.get_closest_points(locations, in_memory=True)
+    memory_seconds = time.perf_counter() - tic
+
+    agree = np.mean([a == b for a, b in zip(in_database, in_memory)])
+    print(f"grid index of {len(index)} points loaded in {index_seconds:0.4f} seconds")
+    print(
+        f"get_closest_point:             {single_seconds:0.4f} seconds (extrapolated from {single} locations)"
+    )
+    print(f"get_closest_points:            {database_seconds:0.4f} seconds")
+    print(f"get_closest_points(in_memory): {memory_seconds:0.4f} seconds")
+    print(f"same grid point for {agree:0.2%} of the locations, the rest are ties")
+
+
+if __name__ == "__main__":
+    main()
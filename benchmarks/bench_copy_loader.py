@@ -0,0 +1,74 @@
+"""
+BENCHMARK OF THE BINARY COPY LOADER AGAINST GeoDataFrame.to_postgis
+
+Usage:
+    python -m benchmarks.bench_copy_loader postgresql://localhost/era5_bench --rows 200000
+
+The database needs the postgis extension, the benchmark tables are dropped afterwards.
+"""
+import argparse
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from src.ingestion.loader import copy_to_postgis
+from src.postgis_era5.table import DAILY_VALUE_COLUMNS
+
+
+def synthetic_daily_gdf(rows: int, seed: int = 42) -> gpd.GeoDataFrame:
+    rng = np.random.default_rng(seed)
+    points = max(rows // 365, 1)
+    df = pd.DataFrame(
+        {
+            "time": np.tile(
+                pd.date_range(
+                    "2018-01-01", periods=365, freq=pd.Timedelta(days=1)
+                ).values,
+                points + 1,
+            )[:rows]
+        }
+    )
+    for column in DAILY_VALUE_COLUMNS:
+        df[column] = rng.normal(size=rows)
+    longitude = np.round(rng.uniform(-81, -75, points + 1), 1).repeat(365)[:rows]
+    latitude = np.round(rng.uniform(-5, 1.5, points + 1), 1).repeat(365)[:rows]
+    return gpd.GeoDataFrame(
+        df, geometry=gpd.points_from_xy(longitude, latitude), crs="EPSG:4326"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("database_url")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--batch-size", type=int, default=100_000)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    gdf = synthetic_daily_gdf(args.rows)
+
+    try:
+        tic = time.perf_counter()
+        gdf.to_postgis(name="bench_to_postgis", con=engine, if_exists="append")
+        to_postgis_seconds = time.perf_counter() - tic
+
+        tic = time.perf_counter()
+        copy_to_postgis(gdf, name="bench_copy", con=engine, batch_size=args.batch_size)
+        copy_seconds = time.perf_counter() - tic
+    finally:
+        with engine.begin() as conn:
+            conn.execute("DROP TABLE IF EXISTS bench_to_postgis, bench_copy;")
+
+    print(
+        f"to_postgis:      {to_postgis_seconds:0.4f} seconds, {args.rows / to_postgis_seconds:0.0f} rows/s"
+    )
+    print(
+        f"copy_to_postgis: {copy_seconds:0.4f} seconds, {args.rows / copy_seconds:0.0f} rows/s"
+    )
+    print(f"speedup:         {to_postgis_seconds / copy_seconds:0.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+BENCHMARK OF THE DERIVED VARIABLE GRAPH AGAINST THE PANDAS CONVERSIONS
+
+Usage:
+    python -m benchmarks.bench_derived --latitudes 20 --longitudes 20 --days 365
+
+Times ``convert_hourly`` and ``add_daily_derived`` against the column by column pandas computation with
+the functions of ``src.ingestion.conversions`` they replaced, on a synthetic year of hourly data, and
+checks that the results are identical.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from src.ingestion.conversions import (
+    actual_vapour_pressure,
+    calculate_pet,
+    daily_gdd,
+    kelvin_to_celcius,
+    meters_to_mm,
+    net_radation,
+    relative_humidity,
+    saturated_vapour_pressure,
+    wind_speed_10m_2m,
+    wind_speed_from_u_v,
+)
+from src.ingestion.derived import DAYLIGHT_HOURS
+from src.ingestion.transform import add_daily_derived, aggregate_daily, convert_hourly
+
+
+def synthetic_hourly_df(
+    days: int, latitudes: int, longitudes: int, dtype: str, seed: int = 42
+) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_product(
+        [
+            pd.date_range("2018-01-01", periods=days * 24, freq=pd.Timedelta(hours=1)),
+            np.round(np.linspace(0.0, -0.1 * (latitudes - 1), latitudes), 1),
+            np.round(np.linspace(-78.0, -78.0 + 0.1 * (longitudes - 1), longitudes), 1),
+        ],
+        names=["time", "latitude", "longitude"],
+    )
+    bounds = {
+        "u10": (-5, 5),
+        "v10": (-5, 5),
+        "d2m": (280, 295),
+        "t2m": (285, 305),
+        "stl1": (285, 305),
+        "ssr": (0, 2e7),
+        "str": (-6e6, 0),
+        "sp": (8e4, 1e5),
+        "tp": (0, 0.01),
+    }
+    return pd.DataFrame(
+        {
+            name: rng.uniform(low, high, len(index)).astype(dtype)
+            for name, (low, high) in bounds.items()
+        },
+        index=index,
+    )
+
+
+def pandas_convert_hourly(df: pd.DataFrame) -> pd.DataFrame:
+    df["d2m"] = kelvin_to_celcius(df.d2m)
+    df["t2m"] = kelvin_to_celcius(df.t2m)
+    df["tp"] = meters_to_mm(df.tp)
+    df["ws_10m"] = wind_speed_from_u_v(df.u10, df.v10)
+    df["ws_2m"] = wind_speed_10m_2m(df.ws_10m)
+    df["nr"] = net_radation(df.ssr, df.str)
+    df["rh"] = relative_humidity(
+        actual_vapour_pressure(df.d2m), saturated_vapour_pressure(df.t2m)
+    )
+    df["G"] = np.where(
+        np.isin(df.index.get_level_values("time").hour, DAYLIGHT_HOURS),
+        df.nr * 0.1,
+        df.nr * 0.5,
+    )
+    return df
+
+
+def pandas_add_daily_derived(agg_df: pd.DataFrame) -> pd.DataFrame:
+    agg_df["nr"] = agg_df.ssr_max + agg_df.str_min
+    agg_df["gdd"] = daily_gdd(agg_df.t2m_max, agg_df.t2m_min)
+    agg_df["daily_pet_mean"] = calculate_pet(
+        surface_pressure_KPa=agg_df.sp_mean / 1000,
+        temperature2m_C=agg_df.t2m_mean,
+        dewpoint2m_C=agg_df.d2m_mean,
+        windspeed2m_m_s=agg_df.ws_2m_mean,
+        net_radiation_MJ_m2=agg_df.nr / 1000000,
+        soil_hf=agg_df.G_mean / 1000000,
+        pet_time="daily",
+    )
+    return agg_df
+
+
+def timed(function, df: pd.DataFrame):
+    tic = time.perf_counter()
+    result = function(df)
+    return result, time.perf_counter() - tic
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--latitudes", type=int, default=20)
+    parser.add_argument("--longitudes", type=int, default=20)
+    parser.add_argument("--dtype", choices=["float32", "float64"], default="float64")
+    args = parser.parse_args()
+
+    df = synthetic_hourly_df(args.days, args.latitudes, args.longitudes, args.dtype)
+    print(f"{len(df)} hourly rows of {args.dtype}")
+
+    expected, pandas_hourly = timed(pandas_convert_hourly, df.copy())
+    hourly, graph_hourly = timed(convert_hourly, df.copy())
+    pd.testing.assert_frame_equal(hourly, expected, check_exact=True)
+
+    daily = aggregate_daily(hourly)
+    expected, pandas_daily = timed(pandas_add_daily_derived, daily.copy())
+    daily, graph_daily = timed(add_daily_derived, daily.copy())
+    pd.testing.assert_frame_equal(daily, expected, check_exact=True)
+
+    print(
+        f"hourly: pandas {pandas_hourly:0.4f} s, graph {graph_hourly:0.4f} s, {pandas_hourly / graph_hourly:0.1f}x"
+    )
+    print(
+        f"daily:  pandas {pandas_daily:0.4f} s, graph {graph_daily:0.4f} s, {pandas_daily / graph_daily:0.1f}x"
+    )
+    print("results are identical")
+
+
+if __name__ == "__main__":
+    main()
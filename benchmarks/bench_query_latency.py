@@ -0,0 +1,72 @@
+"""
+BENCHMARK OF THE LATENCY OF THE HOT PSQLInterface QUERIES WITH AND WITHOUT PREPARED STATEMENTS
+
+Usage:
+    python -m benchmarks.bench_query_latency postgresql://localhost/era5 --queries 500
+
+The database should contain ingested data, the locations are drawn within its bounding box.
+"""
+import argparse
+import time
+from typing import Callable, List
+
+import numpy as np
+from src.postgis_era5.engine import create_era5_engine
+from src.postgis_era5.psql import PSQLInterface
+from src.postgis_era5.table import Era5Layout
+from src.postgis_era5.types import WGS84Point
+
+
+def latencies(
+    query: Callable[[WGS84Point], object], locations: List[WGS84Point]
+) -> np.ndarray:
+    seconds = []
+    for location in locations:
+        tic = time.perf_counter()
+        query(location)
+        seconds.append(time.perf_counter() - tic)
+    return np.array(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("database_url")
+    parser.add_argument("--table", default="era5_ecuador")
+    parser.add_argument("--normalized", action="store_true")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--month", type=int, default=5)
+    parser.add_argument("--year", type=int, default=2018)
+    args = parser.parse_args()
+
+    engine = create_era5_engine(args.database_url, pool_size=1)
+    layout = Era5Layout(table=args.table, normalized=args.normalized)
+    index = PSQLInterface(engine, layout=layout).grid_index()
+    rng = np.random.default_rng(42)
+    locations = [
+        WGS84Point(latitude=latitude, longitude=longitude)
+        for latitude, longitude in zip(
+            rng.uniform(index.latitude.min(), index.latitude.max(), args.queries),
+            rng.uniform(index.longitude.min(), index.longitude.max(), args.queries),
+        )
+    ]
+
+    for prepared in (False, True):
+        db = PSQLInterface(engine, layout=layout, prepared=prepared)
+        queries = {
+            "get_closest_point": db.get_closest_point,
+            "retrieve_monthly_historical_observations": lambda location: db.retrieve_monthly_historical_observations(
+                month=args.month, year=args.year, location=location
+            ),
+        }
+        for name, query in queries.items():
+            # warm up the connection and, when prepared, the statement
+            query(locations[0])
+            seconds = latencies(query, locations) * 1000
+            print(
+                f"{name:<42} prepared={prepared!s:<5} "
+                f"p50 {np.percentile(seconds, 50):0.2f} ms, p99 {np.percentile(seconds, 99):0.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,602 @@
+"""
+BENCHMARK SUITE OF THE INGESTION AND THE QUERIES
+
+Usage:
+    python -m benchmarks.suite run --size small
+    python -m benchmarks.suite run --size medium --database-url postgresql://localhost/era5_bench
+    python -m benchmarks.suite run --size small --start-postgres --pg-bin /usr/lib/postgresql/14/bin
+    python -m benchmarks.suite compare benchmarks/results/0.1.0-small.json results.json
+
+Times the conversions, the daily aggregation, the derived variables, the whole transformation of a .nc
+file, the parsing of query results and, when the extras are installed, the DuckDB backend, on a synthetic
+ERA5-Land file of ``benchmarks.synthetic``. With a database the file is also ingested and the queries of
+``PSQLInterface`` are timed; the database should be empty and have the postgis extension, or it is
+started in a temporary directory with ``--start-postgres``.
+
+The results are written to ``benchmarks/results/<version>-<size>.json`` with the environment they were
+measured in. ``compare`` prints the ratio of the median times of two result files and exits with 1 when
+a case got slower than the threshold, so a regression between versions shows up in review or CI.
+"""
+
+import argparse
+import contextlib
+import dataclasses as dc
+import datetime
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from benchmarks.bench_derived import pandas_add_daily_derived, pandas_convert_hourly
+from benchmarks.synthetic import synthetic_era5_land, write_netcdf
+from sqlalchemy import text
+from src.ingestion.ingest import IngestOptions, create_tables, ingest_file
+from src.ingestion.transform import (
+    add_daily_derived,
+    aggregate_daily,
+    aggregate_daily_arrays,
+    convert_hourly,
+    transform_dataset,
+)
+from src.postgis_era5 import __version__
+from src.postgis_era5.engine import create_era5_engine
+from src.postgis_era5.parsing import (
+    DAILY_WEATHER_NORM_COLUMNS,
+    daily_weather_frame,
+    parse_daily_weather,
+    parse_daily_weather_norm,
+)
+from src.postgis_era5.psql import PSQLInterface
+from src.postgis_era5.queries import HISTORICAL_COLUMNS
+from src.postgis_era5.types import WGS84Point
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), "results")
+
+# latitudes, longitudes and days of the synthetic file
+SIZES = {
+    "small": (20, 20, 31),
+    "medium": (60, 60, 31),
+    "large": (100, 100, 365),
+}
+
+# number of locations of the batch nearest grid point query
+BATCH_LOCATIONS = 1_000
+
+
+@dc.dataclass
+class CaseResult:
+    """
+    The times of a benchmark case.
+
+    Parameters:
+        name: name of the case, ``<group>.<function>``
+        seconds: the time of every repetition
+        rows: the number of rows of the result
+        error: the error when the case failed
+    """
+
+    name: str
+    seconds: List[float] = dc.field(default_factory=list)
+    rows: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def best(self) -> Optional[float]:
+        return min(self.seconds) if self.seconds else None
+
+    @property
+    def median(self) -> Optional[float]:
+        return statistics.median(self.seconds) if self.seconds else None
+
+
+def _rows(value: Any) -> Optional[int]:
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+def run_case(
+    name: str,
+    function: Callable[[Any], Any],
+    setup: Callable[[], Any] = lambda: None,
+    repeat: int = 5,
+    warmup: bool = True,
+) -> CaseResult:
+    """
+    Time a function, a failure is reported in the result instead of raised.
+
+    Parameters:
+        name: name of the case
+        function: the timed function, called with the value of ``setup``
+        setup: prepares the input of every repetition outside of the timing, e.g. a copy of a dataframe
+            that the function modifies in place
+        repeat: number of timed repetitions
+        warmup: call the function once before the timed repetitions
+    """
+    result = CaseResult(name=name)
+    try:
+        if warmup:
+            function(setup())
+        for _ in range(repeat):
+            value = setup()
+            tic = time.perf_counter()
+            output = function(value)
+            result.seconds.append(time.perf_counter() - tic)
+        result.rows = _rows(output)
+    except Exception as e:
+        result.error = traceback.format_exception_only(type(e), e)[0].strip()
+    status = (
+        f"median {result.median:0.4f} s, best {result.best:0.4f} s"
+        if result.ok
+        else f"failed: {result.error}"
+    )
+    print(f"{name:<58} {status}", flush=True)
+    return result
+
+
+def _historical_rows(gdf: pd.DataFrame) -> List[Dict[str, object]]:
+    # the rows of a historical observations query of the daily values
+    df = pd.DataFrame(gdf.drop(columns="geometry"))
+    df["geometry"] = [f"POINT({point.x} {point.y})" for point in gdf.geometry]
+    df["time"] = df.time.dt.to_pydatetime()
+    return df[HISTORICAL_COLUMNS + ["geometry"]].to_dict("records")
+
+
+def _norm_rows(
+    historical: List[Dict[str, object]], seed: int = 42
+) -> List[Dict[str, object]]:
+    rng = np.random.default_rng(seed)
+    rows = []
+    for row in historical:
+        norm = {
+            column: float(value)
+            for column, value in zip(
+                DAILY_WEATHER_NORM_COLUMNS,
+                rng.normal(size=len(DAILY_WEATHER_NORM_COLUMNS)),
+            )
+        }
+        norm.update(
+            month=row["time"].month, day=row["time"].day, geometry=row["geometry"]
+        )
+        rows.append(norm)
+    return rows
+
+
+def computation_cases(path: str, repeat: int) -> List[CaseResult]:
+    """
+    The cases that only need the .nc file.
+    """
+    with xr.open_dataset(path) as ds:
+        ds = ds.load()
+    hourly = ds.to_dataframe().dropna()
+    converted = convert_hourly(hourly.copy())
+    daily = aggregate_daily(converted)
+
+    results = [
+        run_case(
+            "conversions.pandas_convert_hourly",
+            pandas_convert_hourly,
+            hourly.copy,
+            repeat,
+        ),
+        run_case("conversions.convert_hourly", convert_hourly, hourly.copy, repeat),
+        run_case(
+            "aggregation.aggregate_daily", aggregate_daily, lambda: converted, repeat
+        ),
+        run_case(
+            "aggregation.aggregate_daily_arrays",
+            aggregate_daily_arrays,
+            lambda: ds,
+            repeat,
+        ),
+        run_case(
+            "derived.pandas_add_daily_derived",
+            pandas_add_daily_derived,
+            daily.copy,
+            repeat,
+        ),
+        run_case("derived.add_daily_derived", add_daily_derived, daily.copy, repeat),
+    ]
+
+    def transform(path: str) -> pd.DataFrame:
+        with xr.open_dataset(path) as ds:
+            return pd.concat(list(transform_dataset(ds)))
+
+    results.append(
+        run_case("transform.transform_dataset", transform, lambda: path, repeat)
+    )
+
+    historical = _historical_rows(transform(path))
+    norms = _norm_rows(historical)
+    columns = HISTORICAL_COLUMNS + ["geometry"]
+    records = [tuple(row[column] for column in columns) for row in historical]
+    results += [
+        run_case(
+            "parsing.parse_daily_weather",
+            parse_daily_weather,
+            lambda: historical,
+            repeat,
+        ),
+        run_case(
+            "parsing.parse_daily_weather_norm",
+            parse_daily_weather_norm,
+            lambda: norms,
+            repeat,
+        ),
+        run_case(
+            "parsing.daily_weather_frame",
+            lambda rows: daily_weather_frame(rows, columns),
+            lambda: records,
+            repeat,
+        ),
+    ]
+    return results
+
+
+def _locations(
+    latitude: np.ndarray, longitude: np.ndarray, size: int, seed: int = 42
+) -> List[WGS84Point]:
+    rng = np.random.default_rng(seed)
+    return [
+        WGS84Point(latitude=lat, longitude=lon)
+        for lat, lon in zip(
+            rng.uniform(latitude.min(), latitude.max(), size),
+            rng.uniform(longitude.min(), longitude.max(), size),
+        )
+    ]
+
+
+def _query_cases(
+    group: str, db: Any, month: int, year: int, repeat: int
+) -> List[CaseResult]:
+    """
+    The queries of the ``PSQLInterface`` API, every repetition at another location.
+    """
+    index = db.grid_index()
+    locations = _locations(index.latitude, index.longitude, repeat + 1)
+    batch = np.column_stack([index.latitude, index.longitude])
+    batch = batch[np.random.default_rng(42).integers(0, len(batch), BATCH_LOCATIONS)]
+    cases = {
+        "get_closest_point": db.get_closest_point,
+        "get_closest_points": lambda _: db.get_closest_points(batch),
+        "retrieve_monthly_historical_observations": lambda location: db.retrieve_monthly_historical_observations(
+            month=month, year=year, location=location
+        ),
+        "retrieve_monthly_historical_observations.radius": lambda location: db.retrieve_monthly_historical_observations(
+            month=month, year=year, location=location, radius=25_000.0
+        ),
+        "retrieve_monthly_historical_observations.columnar": lambda _: db.retrieve_monthly_historical_observations(
+            month=month, year=year, columnar=True
+        ),
+        "retrieve_monthly_norm": lambda location: db.retrieve_monthly_norm(
+            month=month, location=location
+        ),
+        "retrieve_monthly_norm.columnar": lambda _: db.retrieve_monthly_norm(
+            month=month, columnar=True
+        ),
+    }
+    results = []
+    for name, query in cases.items():
+        queue = iter(locations)
+        results.append(run_case(f"{group}.{name}", query, lambda: next(queue), repeat))
+    return results
+
+
+def parquet_cases(
+    path: str, directory: str, month: int, year: int, repeat: int
+) -> List[CaseResult]:
+    """
+    The cases of the GeoParquet dataset and its DuckDB backend, when the extras are installed.
+    """
+    try:
+        from src.ingestion.parquet import transform_to_parquet
+        from src.postgis_era5.parquet_interface import ParquetInterface
+    except ImportError as e:
+        print(f"parquet cases skipped: {e}")
+        return []
+    root = os.path.join(directory, "parquet")
+    results = [
+        run_case(
+            "parquet.transform_to_parquet",
+            lambda path: transform_to_parquet(path, root, "synthetic"),
+            lambda: path,
+            1,
+            warmup=False,
+        )
+    ]
+    if results[0].ok:
+        results += _query_cases("duckdb", ParquetInterface(root), month, year, repeat)
+    return results
+
+
+def postgis_cases(
+    path: str, database_url: str, month: int, year: int, repeat: int
+) -> List[CaseResult]:
+    """
+    The ingestion of the .nc file and the queries of ``PSQLInterface``, the tables of the benchmark are
+    dropped afterwards.
+    """
+    engine = create_era5_engine(database_url, statement_timeout=None)
+    options = IngestOptions()
+    try:
+        create_tables(engine, options)
+        results = [
+            run_case(
+                "postgis.ingest_file",
+                lambda path: ingest_file(path, engine, options),
+                lambda: path,
+                1,
+                warmup=False,
+            )
+        ]
+        if results[0].ok:
+            with engine.begin() as conn:
+                conn.execute(text(f'ANALYZE "{options.layout.table}";'))
+            results += _query_cases(
+                "postgis",
+                PSQLInterface(engine, layout=options.layout),
+                month,
+                year,
+                repeat,
+            )
+        return results
+    except Exception as e:
+        return [
+            CaseResult(
+                name="postgis.create_tables",
+                error=traceback.format_exception_only(type(e), e)[0].strip(),
+            )
+        ]
+    finally:
+        with engine.begin() as conn:
+            tables = (
+                conn.execute(
+                    text(
+                        "SELECT tablename FROM pg_tables WHERE schemaname = current_schema();"
+                    )
+                )
+                .scalars()
+                .all()
+            )
+            for table in tables:
+                conn.execute(text(f'DROP TABLE IF EXISTS "{table}" CASCADE;'))
+        engine.dispose()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def local_postgres(bin_directory: Optional[str] = None) -> Iterator[str]:
+    """
+    A PostgreSQL server in a temporary directory, stopped and removed afterwards.
+
+    Parameters:
+        bin_directory: directory of ``initdb`` and ``pg_ctl``, ``None`` looks them up on the PATH
+    Returns:
+        the url of a database with the postgis extension
+    Raises:
+        RuntimeError: If the binaries are not found.
+    """
+    initdb = shutil.which("initdb", path=bin_directory)
+    pg_ctl = shutil.which("pg_ctl", path=bin_directory)
+    if initdb is None or pg_ctl is None:
+        raise RuntimeError(
+            "initdb and pg_ctl are not found, pass the directory of the binaries with --pg-bin"
+        )
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        data = os.path.join(directory, "data")
+        subprocess.run(
+            [initdb, "-D", data, "-U", "postgres", "-A", "trust"],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        subprocess.run(
+            [
+                pg_ctl,
+                "-D",
+                data,
+                "-l",
+                os.path.join(directory, "log"),
+                "-w",
+                "start",
+                "-o",
+                f"-p {port} -k {directory} -c listen_addresses=localhost",
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            url = f"postgresql://postgres@localhost:{port}/postgres"
+            engine = create_era5_engine(url, statement_timeout=None)
+            with engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS postgis;"))
+            engine.dispose()
+            yield url
+        finally:
+            subprocess.run(
+                [pg_ctl, "-D", data, "-m", "fast", "-w", "stop"],
+                check=False,
+                stdout=subprocess.DEVNULL,
+            )
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(__file__),
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict[str, object]:
+    """
+    The versions and the machine a run was measured on.
+    """
+    return {
+        "version": __version__,
+        "commit": _git_commit(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(
+            timespec="seconds"
+        ),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "xarray": xr.__version__,
+    }
+
+
+def run(args: argparse.Namespace) -> int:
+    latitudes, longitudes, days = SIZES[args.size]
+    start = pd.Timestamp(args.start)
+    with contextlib.ExitStack() as stack:
+        directory = stack.enter_context(tempfile.TemporaryDirectory())
+        path = os.path.join(directory, "era5_synthetic.nc")
+        write_netcdf(synthetic_era5_land(latitudes, longitudes, days, args.start), path)
+        print(
+            f"{days * 24} hours of {latitudes}x{longitudes} grid points of a synthetic ERA5-Land file"
+        )
+
+        results = computation_cases(path, args.repeat)
+        results += parquet_cases(path, directory, start.month, start.year, args.repeat)
+        database_url = args.database_url
+        if args.start_postgres:
+            try:
+                database_url = stack.enter_context(local_postgres(args.pg_bin))
+            except (RuntimeError, subprocess.CalledProcessError) as e:
+                results.append(CaseResult(name="postgis.start", error=str(e)))
+                print(f"postgis cases skipped: {e}")
+        if database_url is not None:
+            results += postgis_cases(
+                path, database_url, start.month, start.year, args.repeat
+            )
+
+    report = {
+        "environment": environment(),
+        "size": {
+            "name": args.size,
+            "latitudes": latitudes,
+            "longitudes": longitudes,
+            "days": days,
+        },
+        "repeat": args.repeat,
+        "cases": {result.name: dc.asdict(result) for result in results},
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIRECTORY, f"{__version__}-{args.size}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+    print(f"results wrote to {output}")
+    return 0 if all(result.ok for result in results) else 1
+
+
+def _medians(path: str) -> Dict[str, float]:
+    with open(path) as f:
+        cases = json.load(f)["cases"]
+    return {
+        name: statistics.median(case["seconds"])
+        for name, case in cases.items()
+        if case["error"] is None and case["seconds"]
+    }
+
+
+def compare(args: argparse.Namespace) -> int:
+    """
+    Print the ratio of the median times of the cases of two result files.
+
+    Returns:
+        1 when a case is slower than the threshold, else 0
+    """
+    before, after = _medians(args.before), _medians(args.after)
+    regressions = 0
+    for name in sorted(before.keys() | after.keys()):
+        if name not in before or name not in after:
+            print(f"{name:<58} only in {args.before if name in before else args.after}")
+            continue
+        ratio = after[name] / before[name]
+        regressed = ratio > args.threshold
+        regressions += regressed
+        print(
+            f"{name:<58} {before[name]:0.4f} s -> {after[name]:0.4f} s, {ratio:0.2f}x"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    print(f"{regressions} of the cases are more than {args.threshold:0.2f}x slower")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser(
+        "run", help="run the benchmarks and write the results"
+    )
+    run_parser.add_argument("--size", choices=sorted(SIZES), default="small")
+    run_parser.add_argument(
+        "--start", default="2018-01-01", help="the first day of the synthetic file"
+    )
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument(
+        "--database-url", help="an empty database with the postgis extension"
+    )
+    run_parser.add_argument(
+        "--start-postgres",
+        action="store_true",
+        help="start a server in a temporary directory",
+    )
+    run_parser.add_argument(
+        "--pg-bin", help="directory of initdb and pg_ctl for --start-postgres"
+    )
+    run_parser.add_argument(
+        "--output",
+        help="path of the results, benchmarks/results/<version>-<size>.json by default",
+    )
+    run_parser.set_defaults(function=run)
+
+    compare_parser = commands.add_parser(
+        "compare", help="compare the results of two runs"
+    )
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=1.2, help="the ratio of a regression"
+    )
+    compare_parser.set_defaults(function=compare)
+
+    args = parser.parse_args()
+    sys.exit(args.function(args))
+
+
+if __name__ == "__main__":
+    main()
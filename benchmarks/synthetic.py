@@ -0,0 +1,199 @@
+"""
+SYNTHETIC ERA5-LAND NETCDF FILES
+
+Usage:
+    python -m benchmarks.synthetic era5_synthetic.nc --latitudes 60 --longitudes 60 --days 31
+
+Writes hourly files shaped like the downloads of ``src.ingestion.implementation.CdsAPI``: the variables
+of ``constants.VARIABLES`` under their short names, latitudes in descending order on the 0.1 degree grid,
+the radiation and precipitation accumulated from 00 UTC, the sea as NaN and, like the Climate Data Store,
+the values packed as 16 bit integers with a scale factor and an offset. The values follow a daily cycle
+with noise, so the derived variables and the daily aggregates have realistic ranges.
+"""
+
+import argparse
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from src.ingestion.constants import VARIABLES
+
+# the short name of every variable of ``constants.VARIABLES`` in the .nc files
+SHORT_NAMES = {
+    "10m_u_component_of_wind": "u10",
+    "10m_v_component_of_wind": "v10",
+    "2m_dewpoint_temperature": "d2m",
+    "2m_temperature": "t2m",
+    "soil_temperature_level_1": "stl1",
+    "surface_net_solar_radiation": "ssr",
+    "surface_net_thermal_radiation": "str",
+    "surface_pressure": "sp",
+    "total_precipitation": "tp",
+}
+
+UNITS = {
+    "u10": "m s**-1",
+    "v10": "m s**-1",
+    "d2m": "K",
+    "t2m": "K",
+    "stl1": "K",
+    "ssr": "J m**-2",
+    "str": "J m**-2",
+    "sp": "Pa",
+    "tp": "m",
+}
+
+
+def _daily_cycle(hours: np.ndarray, peak: int = 14) -> np.ndarray:
+    # 1 at the peak hour and -1 twelve hours later
+    return np.cos((hours - peak) * np.pi / 12)
+
+
+def _accumulated(increments: np.ndarray, hours: np.ndarray) -> np.ndarray:
+    """
+    Accumulate hourly increments like ERA5-Land: the value at hour h is the sum since 00 UTC, and the
+    value at 00 UTC is the sum of the whole previous day.
+    """
+    # the accumulation periods start at 01 UTC
+    period = np.cumsum(hours == 1)
+    period -= period[0]
+    starts = np.searchsorted(period, np.arange(period[-1] + 1))
+    totals = np.cumsum(increments, axis=0)
+    before = np.concatenate([np.zeros_like(totals[:1]), totals[starts[1:] - 1]])
+    return totals - before[period]
+
+
+def synthetic_era5_land(
+    latitudes: int = 20,
+    longitudes: int = 20,
+    days: int = 31,
+    start: str = "2018-01-01",
+    north: float = 1.5,
+    west: float = -81.0,
+    sea_fraction: float = 0.2,
+    seed: int = 42,
+) -> xr.Dataset:
+    """
+    An hourly ERA5-Land dataset with random values.
+
+    Parameters:
+        latitudes: number of latitudes
+        longitudes: number of longitudes
+        days: number of days
+        start: the first day
+        north: the northern latitude of the grid
+        west: the western longitude of the grid
+        sea_fraction: the fraction of the grid points without data, taken from the western edge
+        seed: seed of the random values
+    Returns:
+        the dataset with a float32 array per variable, see ``write_netcdf`` to store it like the downloads
+    """
+    rng = np.random.default_rng(seed)
+    time = pd.date_range(start, periods=days * 24, freq=pd.Timedelta(hours=1))
+    latitude = np.round(north - 0.1 * np.arange(latitudes), 1)
+    longitude = np.round(west + 0.1 * np.arange(longitudes), 1)
+    shape = (len(time), latitudes, longitudes)
+    hours = time.hour.to_numpy()
+    cycle = _daily_cycle(hours)[:, None, None]
+    # a slowly varying climate per grid point
+    base = rng.normal(0.0, 1.0, (1, latitudes, longitudes))
+
+    def noise(scale: float) -> np.ndarray:
+        return rng.normal(0.0, scale, shape)
+
+    t2m = 292.0 + 3.0 * base + 5.0 * cycle + noise(0.5)
+    sun = np.clip(_daily_cycle(hours, peak=12), 0.0, None)[:, None, None]
+    data = {
+        "u10": 2.0 * base + noise(1.5),
+        "v10": -1.0 * base + noise(1.5),
+        "d2m": t2m - 4.0 - np.abs(noise(1.5)),
+        "t2m": t2m,
+        "stl1": 293.0 + 3.0 * base + 2.0 * cycle + noise(0.3),
+        "ssr": _accumulated(2.5e6 * sun * rng.uniform(0.3, 1.0, shape), hours),
+        "str": _accumulated(-2.0e5 - np.abs(noise(5.0e4)), hours),
+        "sp": 9.0e4 + 5.0e3 * base + noise(50.0),
+        "tp": _accumulated(
+            np.where(
+                rng.uniform(size=shape) < 0.15, rng.exponential(5.0e-4, shape), 0.0
+            ),
+            hours,
+        ),
+    }
+    sea = int(round(sea_fraction * longitudes))
+    for values in data.values():
+        values[:, :, :sea] = np.nan
+    return xr.Dataset(
+        {
+            name: (
+                ("time", "latitude", "longitude"),
+                data[name].astype(np.float32),
+                {"units": UNITS[name]},
+            )
+            for name in (SHORT_NAMES[variable] for variable in VARIABLES)
+        },
+        coords={"time": time, "latitude": latitude, "longitude": longitude},
+    )
+
+
+def _packing(values: np.ndarray) -> Tuple[float, float]:
+    low, high = float(np.nanmin(values)), float(np.nanmax(values))
+    # -32766 is the lowest value and 32767 the highest, -32767 is kept free for the fill value
+    scale = (high - low) / 65533 or 1.0
+    return scale, low + 32766 * scale
+
+
+def write_netcdf(ds: xr.Dataset, path: str, packed: bool = True) -> None:
+    """
+    Write a synthetic dataset like the downloads of the Climate Data Store.
+
+    Parameters:
+        ds: the dataset, see ``synthetic_era5_land``
+        path: path of the .nc file
+        packed: store the values as 16 bit integers with a scale factor and an offset
+    """
+    encoding: Dict[str, Dict[str, object]] = {}
+    if packed:
+        for name, variable in ds.data_vars.items():
+            scale, offset = _packing(variable.values)
+            encoding[name] = {
+                "dtype": "int16",
+                "scale_factor": scale,
+                "add_offset": offset,
+                "_FillValue": -32767,
+            }
+    ds.to_netcdf(path, encoding=encoding)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--latitudes", type=int, default=20)
+    parser.add_argument("--longitudes", type=int, default=20)
+    parser.add_argument("--days", type=int, default=31)
+    parser.add_argument("--start", default="2018-01-01")
+    parser.add_argument("--sea-fraction", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--unpacked",
+        action="store_true",
+        help="store float32 instead of 16 bit integers",
+    )
+    args = parser.parse_args()
+
+    ds = synthetic_era5_land(
+        args.latitudes,
+        args.longitudes,
+        args.days,
+        args.start,
+        sea_fraction=args.sea_fraction,
+        seed=args.seed,
+    )
+    write_netcdf(ds, args.path, packed=not args.unpacked)
+    print(
+        f"{ds.sizes['time']} hours of {args.latitudes}x{args.longitudes} grid points wrote to {args.path}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,11 @@
 import time
 from src.postgis_era5.types import WGS84Point
 from src.postgis_era5.psql import PSQLInterface
-from sqlalchemy import create_engine
+from src.postgis_era5.engine import create_era5_engine
 from pprint import pprint
 
 db_string = "postgresql://localhost/era5"  # link to local postgres table
-db_connection = create_engine(db_string)
+db_connection = create_era5_engine(db_string)
 
 db = PSQLInterface(db_connection)
 db.check_connection()
@@ -1,6 +1,34 @@
 import dataclasses as dc
+from typing import Optional
 
 @dc.dataclass
 class Config:
     path_to_nc_files: str
-    database_url: str
\ No newline at end of file
+    database_url: str
+    # number of latitudes that are transformed at once, None transforms a whole .nc file at once
+    latitude_chunk: Optional[int] = None
+    # number of rows sent to postgis per COPY statement
+    copy_batch_size: int = 100_000
+    # number of .nc files ingested in parallel, None uses all cores
+    workers: Optional[int] = 1
+    # store the grid points once in a grid_point table instead of a geometry per row, see Era5Layout
+    normalized: bool = False
+    # partition the daily table by year, see Era5Layout
+    partitioned: bool = False
+    # maintain the climatology table that retrieve_monthly_norm reads, see Era5Layout
+    climatology: bool = False
+    # "double", "real" or "scaled" storage of the daily values, see Era5Layout
+    storage: str = "double"
+    # directory of the cached land masks, the sea cells are skipped before they are transformed
+    land_mask_directory: Optional[str] = None
+    # directory of the GeoParquet dataset the daily values are also written to, see src.ingestion.parquet
+    parquet_directory: Optional[str] = None
+    # name of the region of the files in the GeoParquet dataset
+    region: str = "ecuador"
+    # JSON lines file the time, rows and peak memory of every stage of every file are appended to
+    metrics_jsonl_path: Optional[str] = None
+    # Prometheus textfile the summed stage metrics are written to, see src.postgis_era5.metrics
+    metrics_prometheus_path: Optional[str] = None
+    # drop the indexes before the load and build them after it, None does so for a large load, see
+    # src.postgis_era5.indexes
+    rebuild_indexes: Optional[bool] = None
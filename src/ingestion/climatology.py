@@ -0,0 +1,209 @@
+"""
+Incremental maintenance of the climatology table, see ``src.postgis_era5.table.climatology_table``
+"""
+import dataclasses as dc
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from sqlalchemy.sql import text
+from src.ingestion.manifest import Extent, source_filter
+from src.postgis_era5.storage import decoded, stored_values
+from src.postgis_era5.table import NORM_COLUMNS, Era5Layout
+
+
+def _location_column(layout: Era5Layout) -> str:
+    return "point_id" if layout.normalized else "geometry"
+
+
+def _sum_columns() -> List[str]:
+    return [f"{name}_{sum}" for name in NORM_COLUMNS for sum in ("n", "sum", "sumsq")]
+
+
+def _upsert(layout: Era5Layout, select: str) -> str:
+    location = _location_column(layout)
+    separator = ",\n"
+    updates = [
+        f'"{column}" = climatology."{column}" + excluded."{column}"'
+        for column in _sum_columns()
+    ]
+    # the rows are upserted in the order of the primary key, so ingestions that update the same grid
+    # points at the same time wait for each other instead of deadlocking
+    return f"""
+        INSERT INTO "{layout.climatology_table}" AS climatology
+        ({location}, month, day, {", ".join(f'"{column}"' for column in _sum_columns())})
+        {select}
+        ORDER BY {location}, month, day
+        ON CONFLICT ({location}, month, day) DO UPDATE SET
+        {separator.join(updates)};
+        """
+
+
+def _upsert_sums(layout: Era5Layout, where: str) -> str:
+    location = _location_column(layout)
+    sums = []
+    for column in NORM_COLUMNS.values():
+        value = decoded(layout.storage, column)
+        sums += [
+            f'COUNT("{column}") * :sign',
+            f"COALESCE(SUM({value}), 0) * :sign",
+            f"COALESCE(SUM({value} * {value}), 0) * :sign",
+        ]
+    separator = ",\n"
+    return _upsert(
+        layout,
+        f"""
+        SELECT
+        {location},
+        EXTRACT(MONTH FROM time) AS month,
+        EXTRACT(DAY FROM time) AS day,
+        {separator.join(sums)}
+        FROM "{layout.table}"
+        WHERE {where}
+        GROUP BY {location}, EXTRACT(MONTH FROM time), EXTRACT(DAY FROM time)
+        """,
+    )
+
+
+def _upsert_arrays(layout: Era5Layout) -> str:
+    # the sums are sent as arrays in a single statement, like the grid points
+    if layout.normalized:
+        keys = ["unnest(CAST(:point_id AS integer[])) AS point_id"]
+        location = "point_id"
+    else:
+        keys = [
+            "unnest(CAST(:latitude AS double precision[])) AS latitude",
+            "unnest(CAST(:longitude AS double precision[])) AS longitude",
+        ]
+        location = "ST_SetSRID(ST_MakePoint(longitude, latitude), 4326) AS geometry"
+    keys += [
+        "unnest(CAST(:month AS smallint[])) AS month",
+        "unnest(CAST(:day AS smallint[])) AS day",
+    ]
+    sums = [
+        f'unnest(CAST(:{column} AS {"bigint" if column.endswith("_n") else "double precision"}[])) '
+        f'AS "{column}"'
+        for column in _sum_columns()
+    ]
+    separator = ",\n"
+    return _upsert(
+        layout,
+        f"""
+        SELECT {location}, month, day, {", ".join(f'"{column}"' for column in _sum_columns())}
+        FROM (
+            SELECT
+            {separator.join(keys + sums)}
+        ) AS sums
+        """,
+    )
+
+
+def frame_sums(daily: pd.DataFrame, layout: Era5Layout) -> pd.DataFrame:
+    """
+    The climatology sums of daily values, from the values as they are stored in the daily table.
+
+    Parameters:
+        daily: the daily values of a band as they are copied to the daily table, with a ``point_id``
+            column for a normalized layout and a point geometry otherwise
+        layout: layout of the tables
+    Returns:
+        the sums per location, month and day, with ``latitude`` and ``longitude`` columns for the
+        location of a layout that is not normalized
+    """
+    times = pd.DatetimeIndex(daily["time"])
+    if layout.normalized:
+        keys = {"point_id": np.asarray(daily["point_id"])}
+    else:
+        keys = {
+            "latitude": np.asarray(daily.geometry.y),
+            "longitude": np.asarray(daily.geometry.x),
+        }
+    keys.update(month=np.asarray(times.month), day=np.asarray(times.day))
+    sums = {}
+    for name, column in NORM_COLUMNS.items():
+        if column in daily.columns:
+            values = stored_values(daily[column], layout.storage, column)
+        else:
+            values = np.full(len(daily), np.nan)
+        valid = ~np.isnan(values)
+        values = np.where(valid, values, 0.0)
+        sums.update(
+            {
+                f"{name}_n": valid.astype(np.int64),
+                f"{name}_sum": values,
+                f"{name}_sumsq": values * values,
+            }
+        )
+    return (
+        pd.DataFrame({**keys, **sums})
+        .groupby(list(keys), sort=True)
+        .sum()
+        .reset_index()
+    )
+
+
+def add_climatology(
+    conn: sqlalchemy.engine.Connection, layout: Era5Layout, daily: pd.DataFrame
+) -> None:
+    """
+    Add daily values to the climatology from memory, as they are loaded, instead of reading them back from
+    the daily table like ``update_climatology``.
+
+    Parameters:
+        conn: connection with the open transaction that writes the daily values
+        layout: layout of the tables
+        daily: the daily values, see ``frame_sums``
+    """
+    if daily.empty:
+        return
+    sums = frame_sums(daily, layout)
+    conn.execute(
+        text(_upsert_arrays(layout)),
+        **{column: sums[column].tolist() for column in sums.columns},
+    )
+
+
+def update_climatology(
+    conn: sqlalchemy.engine.Connection,
+    layout: Era5Layout,
+    extent: Extent,
+    source_id: Optional[int],
+    sign: int = 1,
+) -> None:
+    """
+    Add the daily values of an ingested file to the climatology, or remove them with ``sign=-1``.
+
+    This runs in the transaction that writes (or deletes) the daily values, so the climatology always
+    matches the daily table.
+
+    Parameters:
+        conn: connection with an open transaction
+        layout: layout of the tables
+        extent: the extent of the rows of the file
+        source_id: the source id of the rows of the file, see ``src.ingestion.manifest.source_filter``
+        sign: 1 to add the rows, -1 to remove them
+    """
+    if extent.empty:
+        return
+    if sign not in (1, -1):
+        raise ValueError(f"sign should be 1 or -1 but found {sign!r}")
+    conn.execute(
+        text(_upsert_sums(layout, source_filter(layout, source_id))),
+        sign=sign,
+        source_id=source_id,
+        **dc.asdict(extent),
+    )
+
+
+def rebuild_climatology(conn: sqlalchemy.engine.Connection, layout: Era5Layout) -> None:
+    """
+    Compute the climatology from all rows of the daily table, for tables that were loaded before the
+    climatology was maintained.
+
+    Parameters:
+        conn: connection to the database
+        layout: layout of the tables
+    """
+    conn.execute(text(f'TRUNCATE "{layout.climatology_table}";'))
+    conn.execute(text(_upsert_sums(layout, "TRUE")), sign=1)
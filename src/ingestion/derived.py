@@ -0,0 +1,293 @@
+"""
+Computation of the derived variables as a dependency graph on NumPy arrays
+
+Every variable is computed once into a buffer of the size of the data, intermediates are dropped as soon as
+no other variable needs them and their buffers are reused. The kernels do the arithmetic of the functions
+in ``src.ingestion.conversions`` in the same order, so the results are identical to them.
+"""
+import dataclasses as dc
+from typing import Callable, Dict, List, Mapping, Sequence, Tuple
+
+import numpy as np
+
+# the factor of ``conversions.wind_speed_10m_2m``
+WIND_10M_TO_2M = 4.87 / (np.log(67.8 * 10 - 5.42))
+
+# 6am - 18 pm = daytime https://www.worlddata.info/america/ecuador/sunset.php
+DAYLIGHT_HOURS = list(range(6, 19))
+
+
+@dc.dataclass(frozen=True)
+class Derived:
+    """
+    A derived variable.
+
+    Parameters:
+        name: name of the variable
+        inputs: names of the variables or input arrays it is computed from
+        kernel: ``kernel(out, scratch, *inputs)`` writes the variable into ``out``, it can use the
+            arrays in ``scratch`` for intermediate values but should not modify the inputs
+        scratch: the number of scratch arrays the kernel needs
+    """
+
+    name: str
+    inputs: Tuple[str, ...]
+    kernel: Callable[..., None]
+    scratch: int = 0
+
+
+class DerivedGraph:
+    """
+    A set of derived variables that can be evaluated together.
+    """
+
+    variables: Dict[str, Derived]
+
+    def __init__(self, variables: Sequence[Derived]) -> None:
+        self.variables = {variable.name: variable for variable in variables}
+        if len(self.variables) != len(variables):
+            raise ValueError("the names of the derived variables should be unique")
+
+    @property
+    def inputs(self) -> List[str]:
+        """
+        The names of the arrays the graph needs that are not derived variables.
+        """
+        names = []
+        for variable in self.variables.values():
+            for name in variable.inputs:
+                if name not in self.variables and name not in names:
+                    names.append(name)
+        return names
+
+    def plan(self, outputs: Sequence[str]) -> List[Derived]:
+        """
+        The variables needed for ``outputs`` in an order in which every variable comes after its inputs.
+
+        Raises:
+            ValueError: If an output is unknown or the variables depend on each other in a cycle.
+        """
+        order: List[Derived] = []
+        state: Dict[str, str] = {}
+
+        def visit(name: str) -> None:
+            if name not in self.variables or state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"the derived variable {name!r} depends on itself")
+            state[name] = "visiting"
+            for dependency in self.variables[name].inputs:
+                visit(dependency)
+            state[name] = "done"
+            order.append(self.variables[name])
+
+        for name in outputs:
+            if name not in self.variables:
+                raise ValueError(f"unknown derived variable {name!r}")
+            visit(name)
+        return order
+
+    def evaluate(
+        self, inputs: Mapping[str, np.ndarray], outputs: Sequence[str]
+    ) -> Dict[str, np.ndarray]:
+        """
+        Compute derived variables.
+
+        Parameters:
+            inputs: the input arrays, all of the same length
+            outputs: the names of the variables to compute
+        Returns:
+            the arrays of the outputs, in the floating point type of the inputs
+        """
+        order = self.plan(outputs)
+        missing = [
+            name for name in self.inputs if name not in inputs and _needed(name, order)
+        ]
+        if missing:
+            raise ValueError(f"missing inputs {missing}")
+        floats = [
+            array.dtype
+            for array in inputs.values()
+            if np.issubdtype(array.dtype, np.floating)
+        ]
+        dtype = np.result_type(*floats) if floats else np.float64
+        shape = np.shape(next(iter(inputs.values())))
+
+        # the index of the last step that reads a variable, after it its buffer can be reused
+        last_use = {}
+        for step, variable in enumerate(order):
+            for name in variable.inputs:
+                last_use[name] = step
+        free: List[np.ndarray] = []
+
+        def buffer() -> np.ndarray:
+            return free.pop() if free else np.empty(shape, dtype=dtype)
+
+        values: Dict[str, np.ndarray] = dict(inputs)
+        for step, variable in enumerate(order):
+            out = buffer()
+            scratch = [buffer() for _ in range(variable.scratch)]
+            variable.kernel(out, scratch, *(values[name] for name in variable.inputs))
+            values[variable.name] = out
+            free.extend(scratch)
+            for name in variable.inputs:
+                if (
+                    last_use[name] == step
+                    and name in self.variables
+                    and name not in outputs
+                ):
+                    free.append(values.pop(name))
+        return {name: values[name] for name in outputs}
+
+
+def _needed(name: str, order: Sequence[Derived]) -> bool:
+    return any(name in variable.inputs for variable in order)
+
+
+def _kelvin_to_celcius(out, scratch, k):
+    np.subtract(k, 273.15, out=out)
+
+
+def _meters_to_mm(out, scratch, m):
+    np.multiply(m, 1000, out=out)
+
+
+def _wind_speed_from_u_v(out, scratch, u, v):
+    np.square(u, out=out)
+    np.square(v, out=scratch[0])
+    np.add(out, scratch[0], out=out)
+    np.sqrt(out, out=out)
+
+
+def _wind_speed_10m_2m(out, scratch, ws):
+    # like pandas, a float32 series is multiplied by the factor in float32
+    np.multiply(ws, out.dtype.type(WIND_10M_TO_2M), out=out)
+
+
+def _add(out, scratch, a, b):
+    np.add(a, b, out=out)
+
+
+def _tetens(out, scratch, tc):
+    # 0.61078 * np.exp((17.2694 * tc) / (237.7 + tc))
+    np.multiply(17.2694, tc, out=out)
+    np.add(237.7, tc, out=scratch[0])
+    np.divide(out, scratch[0], out=out)
+    np.exp(out, out=out)
+    np.multiply(0.61078, out, out=out)
+
+
+def _relative_humidity(out, scratch, avp, svp):
+    np.divide(avp, svp, out=out)
+    np.multiply(out, 100, out=out)
+
+
+def _soil_heat_flux(out, scratch, nr, hour):
+    np.multiply(nr, 0.5, out=out)
+    np.multiply(nr, 0.1, out=out, where=np.isin(hour, DAYLIGHT_HOURS))
+
+
+HOURLY = DerivedGraph(
+    [
+        Derived("d2m_celcius", ("d2m",), _kelvin_to_celcius),
+        Derived("t2m_celcius", ("t2m",), _kelvin_to_celcius),
+        Derived("tp_mm", ("tp",), _meters_to_mm),
+        Derived("ws_10m", ("u10", "v10"), _wind_speed_from_u_v, scratch=1),
+        Derived("ws_2m", ("ws_10m",), _wind_speed_10m_2m),
+        Derived("nr", ("ssr", "str"), _add),
+        Derived("avp", ("d2m_celcius",), _tetens, scratch=1),
+        Derived("svp", ("t2m_celcius",), _tetens, scratch=1),
+        Derived("rh", ("avp", "svp"), _relative_humidity),
+        # if day multiply net radiation by 0.1 else 0.5 if night. Following the guidelines set in https://www.nature.com/articles/s41597-021-01003-9
+        Derived("G", ("nr", "hour"), _soil_heat_flux),
+    ]
+)
+
+
+def _gdd(out, scratch, t2m_max, t2m_min, t2m_base=10):
+    np.add(t2m_max, t2m_min, out=out)
+    np.divide(out, 2, out=out)
+    np.subtract(out, t2m_base, out=out)
+
+
+def _divide_by(divisor: float) -> Callable[..., None]:
+    def kernel(out, scratch, value):
+        np.divide(value, divisor, out=out)
+
+    return kernel
+
+
+def _fao_vapour_pressure(out, scratch, tc):
+    # 0.6108 * np.exp((17.27 * tc) / (tc + 237.3)), eq 11 and 14 in FAO
+    np.multiply(17.27, tc, out=out)
+    np.add(tc, 237.3, out=scratch[0])
+    np.divide(out, scratch[0], out=out)
+    np.exp(out, out=out)
+    np.multiply(0.6108, out, out=out)
+
+
+def _svp_slope(out, scratch, svp, tc):
+    # 4098.0 * svp / (tc + 237.3) ** 2, eq 13 in FAO
+    np.multiply(4098.0, svp, out=out)
+    np.add(tc, 237.3, out=scratch[0])
+    np.square(scratch[0], out=scratch[0])
+    np.divide(out, scratch[0], out=out)
+
+
+def _psychrometric_constant(out, scratch, pressure):
+    # cp * P / (eps * lmbda), eq 8 in FAO
+    lmbda, cp, eps = 2.45, 1.013e-3, 0.622
+    np.multiply(cp, pressure, out=out)
+    np.divide(out, eps * lmbda, out=out)
+
+
+def _daily_pet(
+    out, scratch, delta, net_radiation, soil_hf, psychrometric, tc, u2, svp, avp
+):
+    # eq 6 in FAO with the operations of ``conversions.calculate_pet``
+    a, b = scratch
+    np.subtract(net_radiation, soil_hf, out=a)
+    np.multiply(0.408, delta, out=out)
+    np.multiply(out, a, out=out)
+    np.add(tc, 273, out=a)
+    np.divide(900, a, out=a)
+    np.multiply(psychrometric, a, out=b)
+    np.multiply(b, u2, out=b)
+    np.subtract(svp, avp, out=a)
+    np.multiply(b, a, out=b)
+    np.add(out, b, out=out)
+    np.multiply(0.34, u2, out=a)
+    np.add(1, a, out=a)
+    np.multiply(psychrometric, a, out=a)
+    np.add(delta, a, out=a)
+    np.divide(out, a, out=out)
+
+
+DAILY = DerivedGraph(
+    [
+        Derived("nr", ("ssr_max", "str_min"), _add),
+        Derived("gdd", ("t2m_max", "t2m_min"), _gdd),
+        Derived("sp_kpa", ("sp_mean",), _divide_by(1000)),  # from pa to Kpa
+        Derived("nr_mj", ("nr",), _divide_by(1000000)),  # from joule -> megajoule
+        Derived("G_mj", ("G_mean",), _divide_by(1000000)),
+        Derived("psychrometric", ("sp_kpa",), _psychrometric_constant),
+        Derived("fao_svp", ("t2m_mean",), _fao_vapour_pressure, scratch=1),
+        Derived("fao_avp", ("d2m_mean",), _fao_vapour_pressure, scratch=1),
+        Derived("svp_slope", ("fao_svp", "t2m_mean"), _svp_slope, scratch=1),
+        Derived(
+            "daily_pet_mean",
+            (
+                "svp_slope",
+                "nr_mj",
+                "G_mj",
+                "psychrometric",
+                "t2m_mean",
+                "ws_2m_mean",
+                "fao_svp",
+                "fao_avp",
+            ),
+            _daily_pet,
+            scratch=2,
+        ),
+    ]
+)
@@ -0,0 +1,372 @@
+"""
+Download of ERA5-Land from the Climate Data Store in chunks, concurrently and resumable
+
+A region-year is requested as one chunk per month (or per month and variable) instead of one large
+request. The chunks are retrieved by a pool of threads, failed chunks are retried with an exponential
+backoff and every chunk is written under a temporary name and renamed when it is complete. Next to every
+file a ``.sha256`` sidecar records its size and checksum, chunks with a matching file are skipped, so an
+interrupted download continues where it stopped. The files of the variables of a month are merged into
+the file of the month once they are all downloaded, so the ingestion always gets a file per month.
+"""
+import dataclasses as dc
+import json
+import logging
+import os
+import tempfile
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import xarray as xr
+
+from src.ingestion.constants import DAYS, MONTHS, TIME, VARIABLES
+from src.ingestion.manifest import file_checksum
+
+logger = logging.getLogger(__name__)
+
+DATASET = "reanalysis-era5-land"
+
+# one request per month with all variables
+CHUNK_MONTH = "month"
+# one request per month and variable, the files of a month are merged by ``DownloadManager.download``
+CHUNK_VARIABLE = "variable"
+CHUNKS = (CHUNK_MONTH, CHUNK_VARIABLE)
+
+SIDECAR_SUFFIX = ".sha256"
+
+
+@dc.dataclass(frozen=True)
+class DownloadChunk:
+    """
+    A request to the Climate Data Store.
+
+    Parameters:
+        region: name of the region, part of the file name
+        year: the year
+        month: the month as in ``MONTHS``
+        area: the area of the request as min lat, min lon, max lat, max lon
+        variables: the variables of the request
+    """
+
+    region: str
+    year: int
+    month: str
+    area: Tuple[float, float, float, float]
+    variables: Tuple[str, ...] = tuple(VARIABLES)
+
+    @property
+    def filename(self) -> str:
+        if self.variables == tuple(VARIABLES):
+            return f"era5_{self.region}_{self.year}_{self.month}.nc"
+        return (
+            f"era5_{self.region}_{self.year}_{self.month}_{'_'.join(self.variables)}.nc"
+        )
+
+    def request(self) -> dict:
+        return {
+            "variable": list(self.variables),
+            "year": self.year,
+            "month": self.month,
+            "day": DAYS,
+            "time": TIME,
+            "area": list(self.area),
+            "format": "netcdf",
+        }
+
+
+def chunk_requests(
+    min_lat: float,
+    max_lat: float,
+    min_lon: float,
+    max_lon: float,
+    year: int,
+    region: str,
+    chunk: str = CHUNK_MONTH,
+    months: Sequence[str] = MONTHS,
+) -> List[DownloadChunk]:
+    """
+    Split the request of a region-year in chunks.
+
+    Parameters:
+        min_lat: southern edge of the region
+        max_lat: northern edge of the region
+        min_lon: western edge of the region
+        max_lon: eastern edge of the region
+        year: the year
+        region: name of the region
+        chunk: ``CHUNK_MONTH`` or ``CHUNK_VARIABLE``
+        months: the months to request
+    Returns:
+        the chunks
+    """
+    if chunk not in CHUNKS:
+        raise ValueError(f"chunk should be one of {CHUNKS} but found {chunk!r}")
+    area = (min_lat, min_lon, max_lat, max_lon)
+    if chunk == CHUNK_MONTH:
+        return [DownloadChunk(region, year, month, area) for month in months]
+    return [
+        DownloadChunk(region, year, month, area, variables=(variable,))
+        for month in months
+        for variable in VARIABLES
+    ]
+
+
+def _files(
+    chunks: Sequence[DownloadChunk],
+) -> List[Tuple[DownloadChunk, List[DownloadChunk]]]:
+    # the files of the chunks with the chunks they are made of, the chunks of single variables of a month
+    # make one file with all their variables
+    groups: Dict[Tuple[Any, ...], List[DownloadChunk]] = {}
+    for chunk in chunks:
+        if len(chunk.variables) == 1:
+            key: Tuple[Any, ...] = (chunk.region, chunk.year, chunk.month, chunk.area)
+        else:
+            key = (chunk,)
+        groups.setdefault(key, []).append(chunk)
+    files = []
+    for parts in groups.values():
+        first = parts[0]
+        variables = tuple(variable for part in parts for variable in part.variables)
+        file = dc.replace(first, variables=variables)
+        files.append((file, parts))
+    return files
+
+
+@dc.dataclass
+class ChunkResult:
+    path: str
+    attempts: int = 0
+    seconds: float = 0.0
+    skipped: bool = False
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _describe(e: Exception) -> str:
+    return traceback.format_exception_only(type(e), e)[0].strip()
+
+
+def _write_atomic(path: str, write: Callable[[str], None]) -> None:
+    # written under a temporary name and renamed, so a file is either complete or absent
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class DownloadManager:
+    """
+    Downloads chunks concurrently with a ``cdsapi.Client``, or any object with its ``retrieve`` method.
+    """
+
+    client: Any
+    directory: str
+    max_concurrency: int
+    retries: int
+    backoff: float
+    verify_checksum: bool
+
+    def __init__(
+        self,
+        client: Any,
+        directory: str,
+        max_concurrency: int = 4,
+        retries: int = 3,
+        backoff: float = 30.0,
+        verify_checksum: bool = True,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """
+        Parameters:
+            client: the client of the Climate Data Store, ``retrieve(name, request, target)`` writes the
+                result of a request to ``target``
+            directory: directory of the downloaded files
+            max_concurrency: the maximum number of requests at once, the Climate Data Store queues the
+                requests of a user above its own limit
+            retries: number of times a failed chunk is requested again
+            backoff: seconds to wait before the first retry, doubled for every next retry
+            verify_checksum: verify the checksum of a downloaded file before it is skipped, otherwise only
+                its size is checked
+            sleep: function that waits, replaced in tests
+        """
+        if max_concurrency < 1:
+            raise ValueError(
+                f"max_concurrency should be a positive number but found {max_concurrency!r}"
+            )
+        if retries < 0:
+            raise ValueError(f"retries should not be negative but found {retries!r}")
+        self.client = client
+        self.directory = directory
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.verify_checksum = verify_checksum
+        self._sleep = sleep
+
+    def path(self, chunk: DownloadChunk) -> str:
+        return os.path.join(self.directory, chunk.filename)
+
+    def is_downloaded(self, chunk: DownloadChunk) -> bool:
+        """
+        Whether the file of a chunk is on disk with the size and checksum of its sidecar.
+        """
+        path = self.path(chunk)
+        try:
+            with open(path + SIDECAR_SUFFIX) as f:
+                sidecar = json.load(f)
+            if os.path.getsize(path) != sidecar["size"]:
+                return False
+        except (OSError, ValueError, KeyError):
+            return False
+        return not self.verify_checksum or file_checksum(path) == sidecar["sha256"]
+
+    def _retrieve(self, chunk: DownloadChunk) -> None:
+        self._write(
+            self.path(chunk),
+            lambda tmp_path: self.client.retrieve(DATASET, chunk.request(), tmp_path),
+        )
+
+    def _write(self, path: str, write: Callable[[str], None]) -> None:
+        # the file and then its sidecar, a file without a sidecar is downloaded again
+        _write_atomic(path, write)
+        sidecar = {"size": os.path.getsize(path), "sha256": file_checksum(path)}
+
+        def write_sidecar(tmp_path: str) -> None:
+            with open(tmp_path, "w") as f:
+                json.dump(sidecar, f)
+
+        _write_atomic(path + SIDECAR_SUFFIX, write_sidecar)
+
+    def download_chunk(self, chunk: DownloadChunk) -> ChunkResult:
+        """
+        Download a chunk unless it is already downloaded, with retries.
+
+        Returns:
+            the result of the chunk, a chunk that failed after all retries has its last error
+        """
+        path = self.path(chunk)
+        tic = time.perf_counter()
+        if self.is_downloaded(chunk):
+            return ChunkResult(
+                path=path, skipped=True, seconds=time.perf_counter() - tic
+            )
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                self._retrieve(chunk)
+            except Exception as e:
+                logger.warning(
+                    f"{path}; attempt {attempt + 1} failed with {_describe(e)}"
+                )
+                error = _describe(e)
+            else:
+                logger.info(f"{path}; downloaded")
+                return ChunkResult(
+                    path=path, attempts=attempt + 1, seconds=time.perf_counter() - tic
+                )
+        return ChunkResult(
+            path=path,
+            attempts=self.retries + 1,
+            seconds=time.perf_counter() - tic,
+            error=error,
+        )
+
+    def merge(
+        self,
+        file: DownloadChunk,
+        parts: Sequence[DownloadChunk],
+        results: Sequence[ChunkResult],
+    ) -> ChunkResult:
+        """
+        Merge the downloaded files of the variables of a month into one file, the files of the variables
+        are removed once it is written.
+
+        Parameters:
+            file: the chunk of the merged file
+            parts: the chunks of the variables
+            results: the results of the downloads of ``parts``
+        Returns:
+            the result of the merged file, with the first error of the downloads when one failed
+        """
+        path = self.path(file)
+        result = ChunkResult(
+            path=path,
+            attempts=sum(result.attempts for result in results),
+            seconds=sum(result.seconds for result in results),
+        )
+        errors = [result.error for result in results if not result.ok]
+        if errors:
+            result.error = errors[0]
+            return result
+        tic = time.perf_counter()
+        datasets = [xr.open_dataset(self.path(part)) for part in parts]
+        try:
+            merged = xr.merge(datasets)
+            self._write(path, lambda tmp_path: merged.to_netcdf(tmp_path))
+        except Exception as e:
+            logger.warning(f"{path}; merge failed with {_describe(e)}")
+            result.error = _describe(e)
+            return result
+        finally:
+            for ds in datasets:
+                ds.close()
+        for part in parts:
+            for part_path in (self.path(part), self.path(part) + SIDECAR_SUFFIX):
+                os.unlink(part_path)
+        result.seconds += time.perf_counter() - tic
+        logger.info(f"{path}; merged from {len(parts)} files")
+        return result
+
+    def download(self, chunks: Sequence[DownloadChunk]) -> List[ChunkResult]:
+        """
+        Download chunks concurrently, at most ``max_concurrency`` at a time. A chunk that fails is
+        logged and reported in the results without stopping the other chunks.
+
+        The chunks of single variables of the same month are merged into one file, see ``merge``. The
+        variables of a month whose merged file is already downloaded are skipped.
+
+        Returns:
+            the result of every file, in the order of ``chunks``: one result for the variables of a month
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        tic = time.perf_counter()
+        files = _files(chunks)
+        by_file: Dict[DownloadChunk, ChunkResult] = {}
+        pending: List[DownloadChunk] = []
+        for file, parts in files:
+            if len(parts) > 1 and self.is_downloaded(file):
+                by_file[file] = ChunkResult(path=self.path(file), skipped=True)
+            else:
+                pending += parts
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            downloaded = dict(zip(pending, executor.map(self.download_chunk, pending)))
+        for file, parts in files:
+            if file in by_file:
+                continue
+            if len(parts) == 1:
+                by_file[file] = downloaded[file]
+            else:
+                by_file[file] = self.merge(
+                    file, parts, [downloaded[part] for part in parts]
+                )
+        results = [by_file[file] for file, _ in files]
+        failed = [result for result in results if not result.ok]
+        skipped = [result for result in results if result.skipped]
+        logger.info(
+            f"{len(results) - len(failed) - len(skipped)}/{len(results)} chunks downloaded, "
+            f"{len(skipped)} skipped as already downloaded, in {time.perf_counter() - tic:0.1f} seconds"
+        )
+        for result in failed:
+            logger.error(f"{result.path}; failed with {result.error}")
+        return results
@@ -0,0 +1,102 @@
+"""
+Grid points of the normalized layout, see ``src.postgis_era5.table.Era5Layout``
+"""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import sqlalchemy
+import xarray as xr
+from sqlalchemy.sql import text
+from src.postgis_era5.grid import grid_point_ids
+
+
+def grid_points(ds: xr.Dataset) -> pd.DataFrame:
+    """
+    The grid points of a dataset and whether they are on land.
+
+    ERA5-Land has no values for the sea, so a grid point is on land when it has a value in the first hour.
+
+    Parameters:
+        ds: hourly ERA5-Land dataset
+    Returns:
+        the id, latitude, longitude and land flag of every grid point
+    """
+    first_hour = ds[list(ds.data_vars)[0]].isel(time=0)
+    is_land = first_hour.notnull().transpose("latitude", "longitude").values
+    latitude, longitude = np.meshgrid(
+        ds.latitude.values, ds.longitude.values, indexing="ij"
+    )
+    points = pd.DataFrame(
+        {
+            "latitude": latitude.ravel().astype(np.float64),
+            "longitude": longitude.ravel().astype(np.float64),
+            "is_land": is_land.ravel(),
+        }
+    )
+    points.insert(0, "id", grid_point_ids(points.latitude, points.longitude))
+    return points
+
+
+def daily_grid_points(gdf: gpd.GeoDataFrame) -> pd.DataFrame:
+    """
+    The grid points of daily values, they are all on land.
+
+    Parameters:
+        gdf: daily values as made by ``src.ingestion.transform.transform_dataset``
+    Returns:
+        the grid points like ``grid_points``
+    """
+    points = pd.DataFrame(
+        {"latitude": gdf.geometry.y.to_numpy(), "longitude": gdf.geometry.x.to_numpy()}
+    ).drop_duplicates(ignore_index=True)
+    points["is_land"] = True
+    points.insert(0, "id", grid_point_ids(points.latitude, points.longitude))
+    return points
+
+
+def write_grid_points(
+    conn: sqlalchemy.engine.Connection, points: pd.DataFrame, name: str = "grid_point"
+) -> None:
+    """
+    Insert the grid points that are not in the grid table yet. A grid point that is on land in any of the
+    ingested files is on land.
+
+    Parameters:
+        conn: connection to the database
+        points: grid points, see ``grid_points``
+        name: name of the grid table
+    """
+    query = text(
+        f"""
+        INSERT INTO "{name}" (id, latitude, longitude, geometry, is_land)
+        SELECT id, latitude, longitude, ST_SetSRID(ST_MakePoint(longitude, latitude), 4326), is_land
+        FROM unnest(
+            CAST(:ids AS integer[]),
+            CAST(:latitudes AS double precision[]),
+            CAST(:longitudes AS double precision[]),
+            CAST(:is_land AS boolean[])
+        ) AS points(id, latitude, longitude, is_land)
+        ON CONFLICT (id) DO UPDATE SET is_land = "{name}".is_land OR excluded.is_land;
+        """
+    )
+    conn.execute(
+        query,
+        ids=points.id.tolist(),
+        latitudes=points.latitude.tolist(),
+        longitudes=points.longitude.tolist(),
+        is_land=points.is_land.tolist(),
+    )
+
+
+def to_normalized(gdf: gpd.GeoDataFrame) -> pd.DataFrame:
+    """
+    Replace the geometry of the daily values by the id of their grid point.
+
+    Parameters:
+        gdf: daily values as made by ``src.ingestion.transform.transform_dataset``
+    Returns:
+        the daily values with a ``point_id`` column instead of a geometry
+    """
+    df = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+    df["point_id"] = grid_point_ids(gdf.geometry.y, gdf.geometry.x)
+    return df
@@ -1,7 +1,14 @@
-from typing import List
+from typing import List, Optional
 
 import cdsapi
 from src.ingestion.constants import DAYS, MONTHS, TIME, VARIABLES
+from src.ingestion.download import (
+    CHUNK_MONTH,
+    DATASET,
+    ChunkResult,
+    DownloadManager,
+    chunk_requests,
+)
 
 
 class CdsAPI:
@@ -18,9 +25,18 @@ class CdsAPI:
         max_lon: float,
         year: int,
         region: str,
+        output_path: Optional[str] = None,
     ) -> None:
+        """
+        Download a region-year in one request, see ``download_era5_land`` for large regions.
+
+        Parameters:
+            output_path: path of the .nc file, ``output_files/sicredi/parana/era5_<region>_<year>.nc`` by default
+        """
+        if output_path is None:
+            output_path = f"output_files/sicredi/parana/era5_{region}_{year}.nc"
         self.cds_api.retrieve(
-            "reanalysis-era5-land",
+            DATASET,
             {
                 "variable": VARIABLES,
                 "year": year,
@@ -35,7 +51,41 @@ class CdsAPI:
                 ],
                 "format": "netcdf",
             },
-            f"output_files/sicredi/parana/era5_{region}_{year}.nc",
+            output_path,
         )
 
         return None
+
+    def download_era5_land(
+        self,
+        min_lat: float,
+        max_lat: float,
+        min_lon: float,
+        max_lon: float,
+        year: int,
+        region: str,
+        directory: str,
+        chunk: str = CHUNK_MONTH,
+        max_concurrency: int = 4,
+        retries: int = 3,
+    ) -> List[ChunkResult]:
+        """
+        Download a region-year in chunks, concurrently and resumable, see ``src.ingestion.download``.
+
+        Parameters:
+            directory: directory of the downloaded files, one ``era5_<region>_<year>_<month>.nc`` per month
+            chunk: ``"month"`` or ``"variable"``, the files of the variables of a month are merged into the
+                file of the month
+            max_concurrency: the maximum number of requests at once
+            retries: number of times a failed chunk is requested again
+        Returns:
+            the result of every chunk
+        """
+        manager = DownloadManager(
+            self.cds_api, directory, max_concurrency=max_concurrency, retries=retries
+        )
+        return manager.download(
+            chunk_requests(
+                min_lat, max_lat, min_lon, max_lon, year, region, chunk=chunk
+            )
+        )
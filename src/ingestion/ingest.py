@@ -0,0 +1,597 @@
+"""
+Ingestion of a single ERA5-Land .nc file into postgis
+"""
+import contextlib
+import dataclasses as dc
+import logging
+import os
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Union
+
+import geopandas as gpd
+import pandas as pd
+import sqlalchemy
+import xarray as xr
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import text
+from src.ingestion.climatology import add_climatology, update_climatology
+from src.ingestion.grid import (
+    daily_grid_points,
+    grid_points,
+    to_normalized,
+    write_grid_points,
+)
+from src.ingestion.land_mask import cached_land_mask
+from src.ingestion.loader import DEFAULT_BATCH_SIZE, copy_to_postgis
+from src.ingestion.manifest import (
+    Extent,
+    ManifestEntry,
+    delete_rows,
+    file_checksum,
+    get_entry,
+    is_loaded,
+    next_source_id,
+    pipeline_version,
+    write_entry,
+)
+from src.ingestion.parquet import (
+    parquet_files,
+    parquet_rows,
+    read_daily_parquet,
+    with_parquet,
+)
+from src.ingestion.transform import transform_dataset
+from src.postgis_era5.cache import bump_dataset_version
+from src.postgis_era5.indexes import bulk_load
+from src.postgis_era5.metrics import Metrics, file_stages, stage
+from src.postgis_era5.partitions import ensure_partitions
+from src.postgis_era5.storage import column_storage_rows
+from src.postgis_era5.table import (
+    DAILY_VALUE_COLUMNS,
+    Era5Layout,
+    climatology_table,
+    column_storage_table,
+    daily_table,
+    dataset_version_table,
+    grid_table,
+    manifest_table,
+    source_id_sequence,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dc.dataclass(frozen=True)
+class IngestOptions:
+    """
+    Settings of the ingestion of a .nc file.
+
+    Parameters:
+        layout: layout of the tables the daily values are written to
+        latitude_chunk: number of latitudes that are transformed at once, ``None`` transforms the whole file at once
+        copy_batch_size: number of rows sent per COPY statement
+        land_mask_directory: directory of the cached land masks, the sea cells are skipped before they are
+            transformed, see ``src.ingestion.land_mask``; ``None`` drops them after they are read
+        parquet_directory: directory of the GeoParquet dataset the daily values are also written to, see
+            ``src.ingestion.parquet``; ``None`` does not write them
+        region: name of the region of the files in the GeoParquet dataset
+    """
+
+    layout: Era5Layout = Era5Layout()
+    latitude_chunk: Optional[int] = None
+    copy_batch_size: int = DEFAULT_BATCH_SIZE
+    land_mask_directory: Optional[str] = None
+    parquet_directory: Optional[str] = None
+    region: str = "ecuador"
+
+
+def dataset_years(ds: Union[xr.Dataset, pd.DataFrame]) -> List[int]:
+    return sorted(set(pd.DatetimeIndex(ds.time.values).year))
+
+
+def estimated_rows(paths: Iterable[str]) -> int:
+    """
+    The number of daily rows of .nc files, including their sea cells, from their dimensions.
+    """
+    rows = 0
+    for path in paths:
+        with xr.open_dataset(path) as ds:
+            days = pd.DatetimeIndex(ds.time.values).normalize().nunique()
+            rows += days * ds.sizes["latitude"] * ds.sizes["longitude"]
+    return rows
+
+
+def write_column_storage(
+    conn: sqlalchemy.engine.Connection, layout: Era5Layout
+) -> None:
+    """
+    Record the storage of the daily value columns, or check it against the recorded storage.
+
+    Parameters:
+        conn: connection with an open transaction
+        layout: layout of the tables
+    Raises:
+        ValueError: If the daily table was created with another storage profile.
+    """
+    rows = column_storage_rows(layout.table, layout.storage, DAILY_VALUE_COLUMNS)
+    conn.execute(
+        insert(column_storage_table)
+        .values(rows)
+        .on_conflict_do_nothing(
+            index_elements=[
+                column_storage_table.c.table_name,
+                column_storage_table.c.column_name,
+            ]
+        )
+    )
+    stored = conn.execute(
+        column_storage_table.select().where(
+            column_storage_table.c.table_name == layout.table
+        )
+    ).fetchall()
+    by_column = {row["column_name"]: row for row in rows}
+    if any(dict(row) != by_column.get(row["column_name"]) for row in stored):
+        raise ValueError(
+            f"the table {layout.table!r} was created with another storage than {layout.storage!r}, "
+            f"see the {column_storage_table.name!r} table"
+        )
+
+
+def create_tables(
+    engine: sqlalchemy.engine.Engine,
+    options: IngestOptions = IngestOptions(),
+    paths: Sequence[str] = (),
+) -> None:
+    """
+    Create the tables the ingestion writes to. This is done once before files are ingested in parallel,
+    so the workers do not race to create them.
+
+    Parameters:
+        engine: engine of the database
+        options: settings of the ingestion
+        paths: paths to the .nc files that will be ingested, for a partitioned layout the partitions of
+            their years are created
+    """
+    layout = options.layout
+    with engine.begin() as conn:
+        daily_table(
+            layout.table,
+            normalized=layout.normalized,
+            partitioned=layout.partitioned,
+            storage=layout.storage,
+        ).create(conn, checkfirst=True)
+        if layout.normalized:
+            grid_table(layout.grid_table).create(conn, checkfirst=True)
+        if layout.climatology:
+            climatology_table(layout).create(conn, checkfirst=True)
+        manifest_table.create(conn, checkfirst=True)
+        source_id_sequence.create(conn, checkfirst=True)
+        # tables created before the source of the rows was recorded
+        for table, column in (
+            (layout.table, "integer"),
+            (manifest_table.name, "integer UNIQUE"),
+        ):
+            conn.execute(
+                text(
+                    f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS source_id {column};'
+                )
+            )
+        dataset_version_table.create(conn, checkfirst=True)
+        column_storage_table.create(conn, checkfirst=True)
+        write_column_storage(conn, layout)
+
+    if layout.partitioned and paths:
+        years = set()
+        for path in paths:
+            with xr.open_dataset(path) as ds:
+                years.update(dataset_years(ds))
+        with engine.begin() as conn:
+            ensure_partitions(conn, layout, years)
+
+
+def ingest_file(
+    path: str,
+    engine: sqlalchemy.engine.Engine,
+    options: IngestOptions = IngestOptions(),
+    metrics: Optional[Metrics] = None,
+) -> Optional[int]:
+    """
+    Transform a .nc file to daily values and write them to postgis.
+
+    All rows of the file are written in one transaction together with its manifest entry, so a file that
+    fails halfway leaves no rows behind. A file that is already ingested with the same content and
+    pipeline version is skipped, a file that changed replaces the rows of its previous ingestion.
+    The tables should exist, see ``create_tables``; missing partitions are created.
+
+    Parameters:
+        path: path to the .nc file, the manifest uses its absolute path
+        engine: engine of the database
+        options: settings of the ingestion
+        metrics: records the time, rows and memory of every stage of the file, see
+            ``src.postgis_era5.metrics``
+    Returns:
+        the number of rows written or ``None`` when the file was skipped
+    """
+    path = os.path.abspath(path)
+    layout = options.layout
+    version = pipeline_version()
+    # the dataset is opened lazily, only the band that is transformed is read into memory
+    with file_stages(metrics, path), xr.open_dataset(path) as ds:
+        if layout.partitioned:
+            with engine.begin() as conn:
+                ensure_partitions(conn, layout, dataset_years(ds))
+        rows = _ingest_dataset(path, ds, engine, options, version)
+    if rows is not None:
+        logger.info(f"{path}; {rows} rows wrote to postgis")
+    return rows
+
+
+def _land_mask(ds: xr.Dataset, options: IngestOptions) -> Optional[xr.DataArray]:
+    if options.land_mask_directory is None:
+        return None
+    with stage("land_mask") as run:
+        land = cached_land_mask(ds, options.land_mask_directory)
+        run.rows_out = int(land.sum())
+    return land
+
+
+def _transform(
+    path: str, ds: xr.Dataset, options: IngestOptions
+) -> Iterator[gpd.GeoDataFrame]:
+    gdfs = transform_dataset(
+        ds, latitude_chunk=options.latitude_chunk, land=_land_mask(ds, options)
+    )
+    return with_parquet(gdfs, options.parquet_directory, options.region, path)
+
+
+def _ingest_dataset(
+    path: str,
+    ds: xr.Dataset,
+    engine: sqlalchemy.engine.Engine,
+    options: IngestOptions,
+    version: str,
+) -> Optional[int]:
+    layout = options.layout
+    with engine.begin() as conn:
+        source_id = _replace_entry(conn, path, layout, version)
+        if source_id is None:
+            return None
+        logger.info(f"{path}; start processing")
+        grid = grid_points(ds) if layout.normalized else None
+        gdfs = _transform(path, ds, options)
+        return _load_rows(conn, path, source_id, grid, gdfs, options, version)
+
+
+def _replace_entry(
+    conn: sqlalchemy.engine.Connection, path: str, layout: Era5Layout, version: str
+) -> Optional[int]:
+    # the source id to write the rows of the file with or None when the file is skipped, the rows of a
+    # previous ingestion of a changed file are deleted
+    entry = get_entry(conn, path)
+    if is_loaded(entry, path, version):
+        logger.info(f"{path}; already ingested, skipped")
+        return None
+    if entry is None:
+        return next_source_id(conn)
+    if layout.climatology:
+        update_climatology(conn, layout, entry.extent, entry.source_id, sign=-1)
+    deleted = delete_rows(conn, entry, layout)
+    logger.info(f"{path}; changed since its last ingestion, {deleted} rows deleted")
+    return next_source_id(conn) if entry.source_id is None else entry.source_id
+
+
+def _load_rows(
+    conn: sqlalchemy.engine.Connection,
+    path: str,
+    source_id: int,
+    grid: Optional[pd.DataFrame],
+    gdfs: Iterable[gpd.GeoDataFrame],
+    options: IngestOptions,
+    version: str,
+) -> int:
+    layout = options.layout
+    rows = 0
+    extent = Extent()
+    if grid is not None:
+        with stage("grid_points", rows_in=len(grid)):
+            write_grid_points(conn, grid, layout.grid_table)
+    for gdf in gdfs:
+        extent.update(gdf)
+        with stage("copy", rows_in=len(gdf)) as run:
+            daily = to_normalized(gdf) if layout.normalized else gdf
+            run.rows_out = copy_to_postgis(
+                daily.assign(source_id=source_id),
+                name=layout.table,
+                con=conn,
+                batch_size=options.copy_batch_size,
+                storage=layout.storage,
+            )
+        rows += run.rows_out
+        if layout.climatology:
+            # from the band in memory, reading the rows of the file back would scan the daily table
+            # when its indexes are dropped for a bulk load
+            with stage("climatology", rows_in=len(daily)):
+                add_climatology(conn, layout, daily)
+
+    # invalidates the cached query results, see ``src.postgis_era5.cache``
+    bump_dataset_version(conn, layout)
+    write_entry(
+        conn,
+        ManifestEntry(
+            path=path,
+            size=os.path.getsize(path),
+            checksum=file_checksum(path),
+            pipeline_version=version,
+            table_name=layout.table,
+            rows=rows,
+            extent=extent,
+            source_id=source_id,
+        ),
+    )
+    return rows
+
+
+# marks the end of the bands of a BandStream
+_END = object()
+
+
+class BandStream:
+    """
+    The bands of a file, transformed by a thread of their own while the bands before them are loaded.
+
+    The thread stays at most ``ahead`` bands ahead of the consumer, so a file in a pipeline holds a few
+    bands in memory instead of all of them. An error of the transformation is raised by the iteration.
+    The stream should be closed when it is not iterated to the end, which stops the thread.
+
+    Streams that share ``slots`` transform at most as many bands at once as the semaphore allows. A slot is
+    only held while a band is transformed, not while the band waits for the consumer, so streams that
+    wait for their consumers do not keep the others from running.
+    """
+
+    def __init__(
+        self,
+        bands: Callable[[], Iterator[gpd.GeoDataFrame]],
+        ahead: int = 1,
+        name: str = "",
+        slots: Optional[threading.Semaphore] = None,
+    ) -> None:
+        """
+        Parameters:
+            bands: makes the iterator of the bands, it is called and iterated in the thread
+            ahead: the number of transformed bands that can wait for the consumer
+            name: name of the thread
+            slots: limits the number of bands transformed at once by the streams that share it
+        """
+        if ahead < 1:
+            raise ValueError(f"ahead should be a positive number but found {ahead!r}")
+        self._queue: "queue.Queue" = queue.Queue(maxsize=ahead)
+        self._closed = threading.Event()
+        self._slots = slots
+        self._thread = threading.Thread(
+            target=self._produce, args=(bands,), name=name, daemon=True
+        )
+        self._thread.start()
+
+    def _put(self, item: object) -> bool:
+        # waits for room in the queue, gives up when the stream is closed
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _next(self, iterator: Iterator[gpd.GeoDataFrame]) -> object:
+        with self._slots if self._slots is not None else contextlib.nullcontext():
+            return next(iterator, _END)
+
+    def _produce(self, bands: Callable[[], Iterator[gpd.GeoDataFrame]]) -> None:
+        iterator = bands()
+        try:
+            while True:
+                gdf = self._next(iterator)
+                if gdf is _END:
+                    break
+                if not self._put(gdf):
+                    return
+        except BaseException as e:
+            self._put(e)
+            return
+        finally:
+            # a stream that is closed early closes the dataset of the bands
+            if hasattr(iterator, "close"):
+                iterator.close()
+        self._put(_END)
+
+    def __iter__(self) -> Iterator[gpd.GeoDataFrame]:
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    def close(self) -> None:
+        self._closed.set()
+        self._thread.join()
+
+
+@dc.dataclass
+class TransformedFile:
+    """
+    The daily values of a .nc file, transformed apart from the transaction that loads them.
+
+    Parameters:
+        path: absolute path to the .nc file
+        version: the pipeline version of the transformation
+        years: the years of the file
+        grid: the grid points of the file for a normalized layout
+        gdfs: the daily values of every band, a ``BandStream`` for a file of ``transform_file``
+    """
+
+    path: str
+    version: str
+    years: List[int]
+    grid: Optional[pd.DataFrame]
+    gdfs: Iterable[gpd.GeoDataFrame]
+
+    def close(self) -> None:
+        if isinstance(self.gdfs, BandStream):
+            self.gdfs.close()
+
+
+def transform_file(
+    path: str,
+    engine: sqlalchemy.engine.Engine,
+    options: IngestOptions = IngestOptions(),
+    metrics: Optional[Metrics] = None,
+    bands_ahead: int = 1,
+    slots: Optional[threading.Semaphore] = None,
+) -> Optional[TransformedFile]:
+    """
+    The transformation half of ``ingest_file``, so a file can be transformed while another one is loaded.
+
+    The bands are transformed by a thread while ``load_file`` loads the bands before them, see
+    ``BandStream``, so only the grid points and the years are read here and the transformation takes
+    place during the loading.
+
+    Parameters:
+        path: path to the .nc file
+        engine: engine of the database, to skip files that are already ingested
+        options: settings of the ingestion
+        metrics: records the stages of the transformation, see ``ingest_file``
+        bands_ahead: the number of transformed bands that can wait for the loading
+        slots: limits the number of bands transformed at once, see ``BandStream``
+    Returns:
+        the daily values of the file, ``None`` when it is already ingested
+    """
+    path = os.path.abspath(path)
+    version = pipeline_version()
+    with engine.connect() as conn:
+        if is_loaded(get_entry(conn, path), path, version):
+            logger.info(f"{path}; already ingested, skipped")
+            return None
+    with xr.open_dataset(path) as ds:
+        grid = grid_points(ds) if options.layout.normalized else None
+        years = dataset_years(ds)
+
+    def bands() -> Iterator[gpd.GeoDataFrame]:
+        # the dataset is opened lazily again in the thread of the stream, which has its own stages
+        with file_stages(metrics, path), xr.open_dataset(path) as ds:
+            logger.info(f"{path}; start processing")
+            yield from _transform(path, ds, options)
+
+    gdfs = BandStream(
+        bands,
+        ahead=bands_ahead,
+        name=f"bands-{os.path.basename(path)}",
+        slots=slots,
+    )
+    return TransformedFile(
+        path=path, version=version, years=years, grid=grid, gdfs=gdfs
+    )
+
+
+def load_file(
+    transformed: TransformedFile,
+    engine: sqlalchemy.engine.Engine,
+    options: IngestOptions = IngestOptions(),
+    metrics: Optional[Metrics] = None,
+) -> Optional[int]:
+    """
+    The loading half of ``ingest_file``, writes the daily values of ``transform_file`` in one transaction
+    as their bands are transformed.
+
+    Parameters:
+        metrics: records the stages of the loading, see ``ingest_file``
+    Returns:
+        the number of rows written or ``None`` when the file was ingested in the meantime
+    """
+    layout = options.layout
+    try:
+        with file_stages(metrics, transformed.path):
+            if layout.partitioned:
+                with engine.begin() as conn:
+                    ensure_partitions(conn, layout, transformed.years)
+            with engine.begin() as conn:
+                source_id = _replace_entry(
+                    conn, transformed.path, layout, transformed.version
+                )
+                if source_id is None:
+                    return None
+                rows = _load_rows(
+                    conn,
+                    transformed.path,
+                    source_id,
+                    transformed.grid,
+                    transformed.gdfs,
+                    options,
+                    transformed.version,
+                )
+    finally:
+        # stops the transformation of a file that is skipped or failed to load
+        transformed.close()
+    logger.info(f"{transformed.path}; {rows} rows wrote to postgis")
+    return rows
+
+
+def load_parquet(
+    root: str,
+    engine: sqlalchemy.engine.Engine,
+    options: IngestOptions = IngestOptions(),
+    region: Optional[str] = None,
+    years: Optional[Iterable[int]] = None,
+    metrics: Optional[Metrics] = None,
+    rebuild_indexes: Optional[bool] = None,
+) -> int:
+    """
+    Load the daily values of the GeoParquet dataset into postgis, instead of ingesting the .nc files.
+
+    Every Parquet file is loaded in its own transaction with a manifest entry, like a .nc file in
+    ``ingest_file``, so a load can be restarted. The daily derived variables are computed again by the
+    current code, see ``src.ingestion.parquet.read_daily_parquet``. Do not load the Parquet files into a
+    table that the .nc files they were made from are ingested in, the values would be there twice.
+
+    Parameters:
+        root: directory of the GeoParquet dataset
+        engine: engine of the database
+        options: settings of the ingestion, only the layout and the COPY batch size are used
+        region: only the files of a region, ``None`` for all regions
+        years: only the files of these years, ``None`` for all years
+        metrics: records the stages of every Parquet file, see ``ingest_file``
+        rebuild_indexes: drop the indexes before the load and build them after it, ``None`` does so when
+            the load is large compared with the table, see ``src.postgis_era5.indexes.bulk_load``
+    Returns:
+        the number of rows written
+    """
+    paths = parquet_files(root, region=region, years=years)
+    create_tables(engine, options)
+
+    version = pipeline_version()
+    pending = []
+    with engine.connect() as conn:
+        for path in map(os.path.abspath, paths):
+            if is_loaded(get_entry(conn, path), path, version):
+                logger.info(f"{path}; already loaded, skipped")
+            else:
+                pending.append(path)
+    rows = 0
+    with bulk_load(engine, options.layout, parquet_rows(pending), rebuild_indexes):
+        for path in pending:
+            with file_stages(metrics, path):
+                with stage("read_parquet") as run:
+                    gdf = read_daily_parquet(path)
+                    run.rows_out = len(gdf)
+            transformed = TransformedFile(
+                path=path,
+                version=version,
+                years=dataset_years(gdf),
+                grid=daily_grid_points(gdf) if options.layout.normalized else None,
+                gdfs=[gdf],
+            )
+            rows += load_file(transformed, engine, options, metrics) or 0
+    logger.info(f"{len(paths)} Parquet files of {root} loaded, {rows} rows")
+    return rows
@@ -0,0 +1,101 @@
+"""
+Land mask of the ERA5-Land grid, so the sea cells are skipped before any conversion or aggregation
+
+ERA5-Land has no values over sea, a sea cell is missing in every variable at every hour. The mask is
+derived from the first hour of a dataset and cached on disk per grid extent, so the other files of the
+same grid only read a small .npy file.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy as np
+import xarray as xr
+
+logger = logging.getLogger(__name__)
+
+
+def grid_key(ds: xr.Dataset) -> str:
+    """
+    Identifier of the grid of a dataset, the latitudes and longitudes in the order of the dataset.
+
+    Parameters:
+        ds: ERA5-Land dataset
+    Returns:
+        a hex string
+    """
+    digest = hashlib.sha256()
+    for dim in ("latitude", "longitude"):
+        digest.update(dim.encode())
+        digest.update(np.ascontiguousarray(ds[dim].values, dtype=np.float64).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def land_mask(ds: xr.Dataset) -> xr.DataArray:
+    """
+    The cells of a dataset with a value in any variable at the first hour.
+
+    Parameters:
+        ds: hourly ERA5-Land dataset, only its first hour is read
+    Returns:
+        a boolean (latitude, longitude) array with the coordinates of the dataset
+    """
+    first = ds.isel(time=0)
+    land = np.zeros((ds.sizes["latitude"], ds.sizes["longitude"]), dtype=bool)
+    for variable in first.data_vars.values():
+        land |= ~np.isnan(variable.transpose("latitude", "longitude").values)
+    return xr.DataArray(
+        land,
+        dims=("latitude", "longitude"),
+        coords={"latitude": ds.latitude.values, "longitude": ds.longitude.values},
+    )
+
+
+def cached_land_mask(ds: xr.Dataset, directory: str) -> xr.DataArray:
+    """
+    The land mask of the grid of a dataset, read from ``directory`` or derived with ``land_mask`` and
+    written to it.
+
+    Parameters:
+        ds: hourly ERA5-Land dataset
+        directory: directory of the cached masks, one ``land_mask_<grid key>.npy`` per grid
+    Returns:
+        the land mask, see ``land_mask``
+    """
+    path = os.path.join(directory, f"land_mask_{grid_key(ds)}.npy")
+    try:
+        land = np.load(path)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.warning(f"could not read the land mask {path}: {e}")
+    else:
+        if land.shape == (ds.sizes["latitude"], ds.sizes["longitude"]):
+            return xr.DataArray(
+                land,
+                dims=("latitude", "longitude"),
+                coords={
+                    "latitude": ds.latitude.values,
+                    "longitude": ds.longitude.values,
+                },
+            )
+        logger.warning(
+            f"the land mask {path} does not match the grid, it is derived again"
+        )
+
+    mask = land_mask(ds)
+    os.makedirs(directory, exist_ok=True)
+    # written under a temporary name and renamed, so parallel ingestions never read a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, mask.values)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    logger.info(
+        f"land mask of {int(mask.sum())} of {mask.size} cells written to {path}"
+    )
+    return mask
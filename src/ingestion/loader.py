@@ -0,0 +1,258 @@
+"""
+Bulk loading of the daily GeoDataFrames into postgis with ``COPY ... FROM STDIN`` in the binary format
+"""
+import io
+import logging
+import struct
+from typing import List, Optional, Tuple, Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from psycopg2 import sql
+from src.postgis_era5.storage import STORAGE_DOUBLE, column_storage, encode
+from src.postgis_era5.table import DAILY_VALUE_COLUMNS, daily_table
+
+logger = logging.getLogger(__name__)
+
+# See https://www.postgresql.org/docs/current/sql-copy.html "Binary Format"
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+PGCOPY_TRAILER = struct.pack("!h", -1)
+NULL_SIZE = -1
+
+# postgres sends timestamps as microseconds since 2000-01-01
+POSTGRES_EPOCH = np.datetime64("2000-01-01T00:00:00", "us")
+
+# little endian EWKB point with an SRID, see https://github.com/postgis/postgis/blob/master/doc/ZMSgeoms.txt
+EWKB_LITTLE_ENDIAN = 1
+EWKB_POINT_WITH_SRID = 0x20000001
+EWKB_POINT_SIZE = 1 + 4 + 4 + 8 + 8
+
+DEFAULT_BATCH_SIZE = 100_000
+
+
+def _column_kind(series: pd.Series) -> str:
+    if isinstance(series, gpd.GeoSeries):
+        return "geometry"
+    if pd.api.types.is_datetime64_any_dtype(series) and series.dt.tz is None:
+        return "timestamp"
+    if pd.api.types.is_float_dtype(series):
+        return "float8"
+    if pd.api.types.is_integer_dtype(series):
+        return "int4"
+    raise TypeError(
+        f"column {series.name!r} of dtype {series.dtype} can not be written with binary COPY"
+    )
+
+
+# the binary COPY kind of the postgres types of the storage profiles
+STORAGE_KINDS = {
+    "double precision": "float8",
+    "real": "float4",
+    "smallint": "int2",
+    "integer": "int4",
+}
+
+# the numpy type of the fixed size kinds in network byte order
+KIND_DTYPES = {
+    "timestamp": ">i8",
+    "int2": ">i2",
+    "int4": ">i4",
+    "float4": ">f4",
+    "float8": ">f8",
+}
+
+
+def _row_dtype(kinds: List[str]) -> np.dtype:
+    """
+    The layout of a row of the COPY stream without NULL values, every field has a fixed size.
+    """
+    fields = [("field_count", ">i2")]
+    for i, kind in enumerate(kinds):
+        fields.append((f"size_{i}", ">i4"))
+        if kind != "geometry":
+            fields.append((f"value_{i}", KIND_DTYPES[kind]))
+        else:
+            fields += [
+                (f"byte_order_{i}", "u1"),
+                (f"geometry_type_{i}", "<u4"),
+                (f"srid_{i}", "<u4"),
+                (f"x_{i}", "<f8"),
+                (f"y_{i}", "<f8"),
+            ]
+    return np.dtype(fields)
+
+
+def _field_values(
+    gdf: gpd.GeoDataFrame, storage: str
+) -> Tuple[List[str], List[object], List[Optional[np.ndarray]]]:
+    """
+    The kind, the values and the NULL mask of every column, pandas writes NaN as NULL so this does too.
+    """
+    kinds, values, nulls = [], [], []
+    for column in gdf.columns:
+        series = gdf[column]
+        kind = _column_kind(series)
+        null = None
+        if kind == "timestamp":
+            microseconds = series.values.astype("datetime64[us]") - POSTGRES_EPOCH
+            value = microseconds.astype(np.int64)
+        elif kind == "int4":
+            value = series.to_numpy().astype(np.int32)
+        elif (
+            kind == "float8"
+            and column in DAILY_VALUE_COLUMNS
+            and storage != STORAGE_DOUBLE
+        ):
+            stored = column_storage(storage, column)
+            kind = STORAGE_KINDS[stored.type]
+            value = series.to_numpy(dtype=np.float64)
+            null = np.isnan(value)
+            if stored.scaled:
+                value = encode(value, stored, column)
+            else:
+                value = value.astype(np.float32)
+        elif kind == "float8":
+            value = series.to_numpy(dtype=np.float64)
+            null = np.isnan(value)
+        else:
+            value = (series.x.to_numpy(), series.y.to_numpy())
+        kinds.append(kind)
+        values.append(value)
+        nulls.append(null)
+    return kinds, values, nulls
+
+
+def _encode_row(
+    row: int,
+    kinds: List[str],
+    values: List[object],
+    nulls: List[Optional[np.ndarray]],
+    srid: int,
+) -> bytes:
+    """
+    Slow path for the rows that contain a NULL value.
+    """
+    parts = [struct.pack("!h", len(kinds))]
+    for kind, value, null in zip(kinds, values, nulls):
+        if null is not None and null[row]:
+            parts.append(struct.pack("!i", NULL_SIZE))
+        elif kind == "geometry":
+            x, y = value
+            parts.append(struct.pack("!i", EWKB_POINT_SIZE))
+            parts.append(
+                struct.pack(
+                    "<BIIdd",
+                    EWKB_LITTLE_ENDIAN,
+                    EWKB_POINT_WITH_SRID,
+                    srid,
+                    x[row],
+                    y[row],
+                )
+            )
+        else:
+            dtype = np.dtype(KIND_DTYPES[kind])
+            parts.append(struct.pack("!i", dtype.itemsize))
+            parts.append(value[row : row + 1].astype(dtype).tobytes())
+    return b"".join(parts)
+
+
+def encode_copy_binary(
+    gdf: Union[gpd.GeoDataFrame, pd.DataFrame], storage: str = STORAGE_DOUBLE
+) -> bytes:
+    """
+    Encode a GeoDataFrame as a binary COPY stream.
+
+    Parameters:
+        gdf: (Geo)DataFrame with naive timestamp, integer, float and point geometry columns
+        storage: the storage profile of the daily value columns, see ``src.postgis_era5.storage``
+    Returns:
+        the stream including the header and trailer
+    See also:
+        https://www.postgresql.org/docs/current/sql-copy.html
+    """
+    crs = getattr(gdf, "crs", None)
+    srid = crs.to_epsg() if crs is not None else 0
+    kinds, values, nulls = _field_values(gdf, storage)
+
+    has_null = np.zeros(len(gdf), dtype=bool)
+    for null in nulls:
+        if null is not None:
+            has_null |= null
+    complete = ~has_null
+
+    rows = np.zeros(int(complete.sum()), dtype=_row_dtype(kinds))
+    rows["field_count"] = len(kinds)
+    for i, (kind, value) in enumerate(zip(kinds, values)):
+        if kind == "geometry":
+            rows[f"size_{i}"] = EWKB_POINT_SIZE
+            rows[f"byte_order_{i}"] = EWKB_LITTLE_ENDIAN
+            rows[f"geometry_type_{i}"] = EWKB_POINT_WITH_SRID
+            rows[f"srid_{i}"] = srid
+            rows[f"x_{i}"] = value[0][complete]
+            rows[f"y_{i}"] = value[1][complete]
+        else:
+            rows[f"size_{i}"] = np.dtype(KIND_DTYPES[kind]).itemsize
+            rows[f"value_{i}"] = value[complete]
+
+    incomplete = [
+        _encode_row(row, kinds, values, nulls, srid) for row in np.flatnonzero(has_null)
+    ]
+    return b"".join([PGCOPY_HEADER, rows.tobytes(), *incomplete, PGCOPY_TRAILER])
+
+
+def copy_to_postgis(
+    gdf: Union[gpd.GeoDataFrame, pd.DataFrame],
+    name: str,
+    con: Union[sqlalchemy.engine.Engine, sqlalchemy.engine.Connection],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    storage: str = STORAGE_DOUBLE,
+) -> int:
+    """
+    Append a daily GeoDataFrame to a table with binary COPY, the table is created if it does not exist.
+
+    This is a drop in replacement for ``gdf.to_postgis(name=name, con=con, if_exists="append")``.
+    When ``con`` is a connection the caller is responsible for the transaction, so the data can be
+    committed together with other statements.
+
+    Parameters:
+        gdf: daily values as made by ``src.ingestion.transform.transform_dataset``, or by
+            ``src.ingestion.grid.to_normalized`` for the normalized layout
+        name: name of the table
+        con: engine or connection to the database
+        batch_size: number of rows sent per COPY statement
+        storage: the storage profile of the daily values, see ``src.postgis_era5.storage``
+    Returns:
+        the number of rows written
+    """
+    if batch_size < 1:
+        raise ValueError(
+            f"batch_size should be a positive number but found {batch_size!r}"
+        )
+    if isinstance(con, sqlalchemy.engine.Engine):
+        with con.begin() as conn:
+            return copy_to_postgis(
+                gdf, name, conn, batch_size=batch_size, storage=storage
+            )
+
+    daily_table(name, normalized="point_id" in gdf.columns, storage=storage).create(
+        con, checkfirst=True
+    )
+
+    cursor = con.connection.cursor()
+    try:
+        statement = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT binary)").format(
+            sql.Identifier(name),
+            sql.SQL(", ").join(sql.Identifier(column) for column in gdf.columns),
+        )
+        statement = statement.as_string(cursor)
+        for start in range(0, len(gdf), batch_size):
+            batch = gdf.iloc[start : start + batch_size]
+            cursor.copy_expert(
+                statement, io.BytesIO(encode_copy_binary(batch, storage))
+            )
+            logger.debug(f"{start + len(batch)}/{len(gdf)} rows copied to {name}")
+    finally:
+        cursor.close()
+    return len(gdf)
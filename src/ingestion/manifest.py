@@ -0,0 +1,240 @@
+"""
+Bookkeeping of the ingested .nc files, so an ingestion can be restarted without duplicating rows
+"""
+import dataclasses as dc
+import datetime
+import hashlib
+import os
+from typing import Optional
+
+import geopandas as gpd
+import sqlalchemy
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import text
+from src.postgis_era5.table import Era5Layout, manifest_table, source_id_sequence
+
+# the version of the code that turns a .nc file into daily values, bump it when a change to the conversion
+# or transformation changes the ingested values so every file is ingested again
+PIPELINE_VERSION = "1"
+
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+
+
+def pipeline_version() -> str:
+    """
+    Version of the code that turns a .nc file into daily values, see ``PIPELINE_VERSION``.
+
+    Returns:
+        the version
+    """
+    return PIPELINE_VERSION
+
+
+def file_checksum(path: str) -> str:
+    """
+    Compute the sha256 checksum of a file
+
+    Parameters:
+        path: path to the file
+    Returns:
+        the checksum as a hex string
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@dc.dataclass
+class Extent:
+    """
+    The time range and bounding box of the rows written for a file
+    """
+
+    time_start: Optional[datetime.datetime] = None
+    time_end: Optional[datetime.datetime] = None
+    min_latitude: Optional[float] = None
+    max_latitude: Optional[float] = None
+    min_longitude: Optional[float] = None
+    max_longitude: Optional[float] = None
+
+    @property
+    def empty(self) -> bool:
+        return self.time_start is None
+
+    def update(self, gdf: gpd.GeoDataFrame) -> None:
+        if gdf.empty:
+            return
+        (
+            min_longitude,
+            min_latitude,
+            max_longitude,
+            max_latitude,
+        ) = gdf.geometry.total_bounds
+        time_start, time_end = (
+            gdf.time.min().to_pydatetime(),
+            gdf.time.max().to_pydatetime(),
+        )
+        if self.empty:
+            self.time_start, self.time_end = time_start, time_end
+            self.min_latitude, self.max_latitude = min_latitude, max_latitude
+            self.min_longitude, self.max_longitude = min_longitude, max_longitude
+            return
+        self.time_start = min(self.time_start, time_start)
+        self.time_end = max(self.time_end, time_end)
+        self.min_latitude = min(self.min_latitude, min_latitude)
+        self.max_latitude = max(self.max_latitude, max_latitude)
+        self.min_longitude = min(self.min_longitude, min_longitude)
+        self.max_longitude = max(self.max_longitude, max_longitude)
+
+
+@dc.dataclass
+class ManifestEntry:
+    path: str
+    size: int
+    checksum: str
+    pipeline_version: str
+    table_name: str
+    rows: int
+    extent: Extent
+    source_id: Optional[int] = None
+
+
+def get_entry(conn: sqlalchemy.engine.Connection, path: str) -> Optional[ManifestEntry]:
+    """
+    Get the manifest entry of a file and lock it until the end of the transaction.
+
+    Parameters:
+        conn: connection with an open transaction
+        path: path to the .nc file
+    Returns:
+        the entry or ``None`` when the file was never ingested
+    """
+    row = conn.execute(
+        manifest_table.select().where(manifest_table.c.path == path).with_for_update()
+    ).fetchone()
+    if row is None:
+        return None
+    return ManifestEntry(
+        path=row["path"],
+        size=row["size"],
+        checksum=row["checksum"],
+        pipeline_version=row["pipeline_version"],
+        table_name=row["table_name"],
+        rows=row["rows"],
+        extent=Extent(
+            time_start=row["time_start"],
+            time_end=row["time_end"],
+            min_latitude=row["min_latitude"],
+            max_latitude=row["max_latitude"],
+            min_longitude=row["min_longitude"],
+            max_longitude=row["max_longitude"],
+        ),
+        source_id=row["source_id"],
+    )
+
+
+def is_loaded(entry: Optional[ManifestEntry], path: str, version: str) -> bool:
+    """
+    Check whether a file is already ingested with its current content and the current pipeline version.
+
+    The checksum is only computed when the size and version match, which makes skipping cheap to decide
+    for files that changed.
+
+    Parameters:
+        entry: manifest entry of the file
+        path: path to the .nc file
+        version: the current pipeline version
+    Returns:
+        whether the file can be skipped
+    """
+    if entry is None:
+        return False
+    if entry.size != os.path.getsize(path) or entry.pipeline_version != version:
+        return False
+    return entry.checksum == file_checksum(path)
+
+
+def extent_filter(layout: Era5Layout) -> str:
+    """
+    SQL condition on the daily table for the rows within the parameters of an ``Extent``.
+    """
+    envelope = "ST_MakeEnvelope(:min_longitude, :min_latitude, :max_longitude, :max_latitude, 4326)"
+    if layout.normalized:
+        location_filter = f'point_id IN (SELECT id FROM "{layout.grid_table}" WHERE geometry && {envelope})'
+    else:
+        location_filter = f"geometry && {envelope}"
+    return f"time >= :time_start AND time <= :time_end AND {location_filter}"
+
+
+def next_source_id(conn: sqlalchemy.engine.Connection) -> int:
+    """
+    A new source id for the rows of a file that has none yet.
+    """
+    return conn.execute(source_id_sequence.next_value()).scalar()
+
+
+def source_filter(layout: Era5Layout, source_id: Optional[int]) -> str:
+    """
+    SQL condition on the daily table for the rows of a file, with ``:source_id`` and the parameters of
+    its ``Extent``. The time range lets postgres skip the partitions and blocks of other periods.
+
+    The rows of files ingested before the source was recorded have no source id, for those the rows
+    without a source id within the extent of the file are used.
+    """
+    if source_id is None:
+        return f"{extent_filter(layout)} AND source_id IS NULL"
+    return "source_id = :source_id AND time >= :time_start AND time <= :time_end"
+
+
+def delete_rows(
+    conn: sqlalchemy.engine.Connection, entry: ManifestEntry, layout: Era5Layout
+) -> int:
+    """
+    Delete the rows that were written for a file, the rows of other files in the same period and area
+    are kept.
+
+    Parameters:
+        conn: connection with an open transaction
+        entry: manifest entry of the file
+        layout: layout of the tables
+    Returns:
+        the number of deleted rows
+    """
+    extent = entry.extent
+    if extent.empty:
+        return 0
+    query = text(
+        f"""
+        DELETE FROM "{entry.table_name}"
+        WHERE {source_filter(layout, entry.source_id)};
+        """
+    )
+    res = conn.execute(query, source_id=entry.source_id, **dc.asdict(extent))
+    return res.rowcount
+
+
+def write_entry(conn: sqlalchemy.engine.Connection, entry: ManifestEntry) -> None:
+    """
+    Insert or replace the manifest entry of a file, in the transaction that wrote its rows.
+
+    Parameters:
+        conn: connection with an open transaction
+        entry: manifest entry of the file
+    """
+    values = dc.asdict(entry)
+    values.update(values.pop("extent"))
+    statement = insert(manifest_table).values(**values)
+    statement = statement.on_conflict_do_update(
+        index_elements=[manifest_table.c.path],
+        set_={
+            **{
+                column: statement.excluded[column]
+                for column in values
+                if column != "path"
+            },
+            "loaded_at": sqlalchemy.func.now(),
+        },
+    )
+    conn.execute(statement)
@@ -0,0 +1,182 @@
+"""
+Ingestion of many .nc files in parallel with a process pool
+"""
+import dataclasses as dc
+import logging
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Sequence
+
+import sqlalchemy
+from src.ingestion.ingest import (
+    IngestOptions,
+    create_tables,
+    estimated_rows,
+    ingest_file,
+)
+from src.ingestion.manifest import get_entry, pipeline_version
+from src.postgis_era5.engine import create_era5_engine
+from src.postgis_era5.indexes import bulk_load
+from src.postgis_era5.metrics import MemoryExporter, Metrics, StageMetric
+
+logger = logging.getLogger(__name__)
+
+# the engine of a worker process, every worker has its own connection to the database
+_engine: Optional[sqlalchemy.engine.Engine] = None
+
+
+@dc.dataclass
+class FileResult:
+    path: str
+    rows: int = 0
+    seconds: float = 0.0
+    skipped: bool = False
+    error: Optional[str] = None
+    # the stages of the file, see ``src.postgis_era5.metrics``
+    stages: List[StageMetric] = dc.field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _describe(e: Exception) -> str:
+    return traceback.format_exception_only(type(e), e)[0].strip()
+
+
+def _init_worker(database_url: str) -> None:
+    global _engine
+    if not logging.getLogger().handlers:
+        # spawned workers do not inherit the logging configuration of the parent
+        logging.basicConfig(
+            format="%(asctime)s %(levelname)-8s %(processName)s %(message)s",
+            level=logging.INFO,
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
+    # loading a file can take longer than any sensible statement timeout
+    _engine = create_era5_engine(
+        database_url, pool_size=1, max_overflow=0, statement_timeout=None
+    )
+
+
+def _ingest(path: str, options: IngestOptions) -> FileResult:
+    # the stages are sent back to the parent with the result, which exports them
+    stages = MemoryExporter()
+    tic = time.perf_counter()
+    try:
+        rows = ingest_file(path, _engine, options, Metrics([stages]))
+    except Exception as e:
+        logger.exception(f"{path}; failed")
+        return FileResult(
+            path=path,
+            seconds=time.perf_counter() - tic,
+            error=_describe(e),
+            stages=stages.records,
+        )
+    if rows is None:
+        return FileResult(
+            path=path,
+            seconds=time.perf_counter() - tic,
+            skipped=True,
+            stages=stages.records,
+        )
+    return FileResult(
+        path=path, rows=rows, seconds=time.perf_counter() - tic, stages=stages.records
+    )
+
+
+def _probably_new(engine: sqlalchemy.engine.Engine, paths: Sequence[str]) -> List[str]:
+    # the checksums are left to the workers, a file with the size and version of its entry is taken as
+    # already ingested
+    version = pipeline_version()
+    new = []
+    with engine.connect() as conn:
+        for path in paths:
+            entry = get_entry(conn, os.path.abspath(path))
+            if (
+                entry is None
+                or entry.size != os.path.getsize(path)
+                or entry.pipeline_version != version
+            ):
+                new.append(path)
+    return new
+
+
+def log_summary(results: Sequence[FileResult], seconds: float) -> None:
+    failed = [result for result in results if not result.ok]
+    skipped = [result for result in results if result.skipped]
+    rows = sum(result.rows for result in results)
+    logger.info(
+        f"{len(results) - len(failed) - len(skipped)}/{len(results)} files ingested, {len(skipped)} skipped "
+        f"as already ingested, {rows} rows in {seconds:0.1f} seconds"
+    )
+    for result in failed:
+        logger.error(f"{result.path}; failed with {result.error}")
+
+
+def ingest_files(
+    paths: Sequence[str],
+    database_url: str,
+    workers: Optional[int] = None,
+    options: IngestOptions = IngestOptions(),
+    metrics: Optional[Metrics] = None,
+    rebuild_indexes: Optional[bool] = None,
+) -> List[FileResult]:
+    """
+    Ingest .nc files with a pool of worker processes.
+
+    Every file is ingested in its own transaction, a file that fails is logged and reported in the results
+    without stopping the other files. Files that are already ingested are skipped, see ``ingest_file``.
+    The indexes of a large load are dropped before it and built concurrently after it, see
+    ``src.postgis_era5.indexes.bulk_load``.
+
+    Parameters:
+        paths: paths to the .nc files
+        database_url: url of the database, every worker makes its own engine with it
+        workers: number of worker processes, ``None`` uses all cores and 1 ingests in this process
+        options: settings of the ingestion
+        metrics: the stages of every file are recorded to it as the file is done, see
+            ``src.postgis_era5.metrics``
+        rebuild_indexes: drop the indexes before the load and build them after it, ``None`` does so when
+            the files are large compared with the table
+    Returns:
+        the result per file, in order of completion
+    """
+    tic = time.perf_counter()
+    engine = create_era5_engine(database_url, statement_timeout=None)
+    create_tables(engine, options, paths)
+
+    results: List[FileResult] = []
+
+    def done(result: FileResult) -> None:
+        results.append(result)
+        if metrics is not None:
+            for metric in result.stages:
+                metrics.record(metric)
+
+    rows = (
+        estimated_rows(_probably_new(engine, paths)) if rebuild_indexes is None else 0
+    )
+    with bulk_load(engine, options.layout, rows, rebuild_indexes):
+        if workers == 1:
+            _init_worker(database_url)
+            for path in paths:
+                done(_ingest(path, options))
+        else:
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker, initargs=(database_url,)
+            ) as executor:
+                futures = {
+                    executor.submit(_ingest, path, options): path for path in paths
+                }
+                for future in as_completed(futures):
+                    try:
+                        done(future.result())
+                    except Exception as e:
+                        # the worker died, for example when it ran out of memory
+                        logger.exception(f"{futures[future]}; worker failed")
+                        done(FileResult(path=futures[future], error=_describe(e)))
+    log_summary(results, time.perf_counter() - tic)
+    return results
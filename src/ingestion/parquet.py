@@ -0,0 +1,192 @@
+"""
+GeoParquet tier of the daily values, between the .nc files and postgis
+
+The daily values of every ingested .nc file are also written to a GeoParquet dataset partitioned as
+``region=<region>/year=<year>/month=<month>/<file>-<hash>.<band>.parquet``, where the hash is of the
+absolute path of the .nc file so files with the same name in different directories do not collide, with ``latitude`` and ``longitude``
+columns next to the geometry. A database can then be rebuilt, or a daily derived variable added, from the
+Parquet files without decoding and aggregating the hourly NetCDF again, see
+``src.ingestion.ingest.load_parquet``. Writing the files needs the ``parquet`` extra.
+"""
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Collection, Iterable, Iterator, List, Optional
+
+import geopandas as gpd
+import pandas as pd
+import xarray as xr
+from src.ingestion.transform import add_daily_derived, transform_dataset
+from src.postgis_era5.metrics import stage
+
+logger = logging.getLogger(__name__)
+
+
+def partition_directory(root: str, region: str, year: int, month: int) -> str:
+    return os.path.join(root, f"region={region}", f"year={year}", f"month={month:02d}")
+
+
+def _source_name(source: str) -> str:
+    source = os.path.abspath(source)
+    digest = hashlib.sha1(source.encode()).hexdigest()[:12]
+    return f"{os.path.splitext(os.path.basename(source))[0]}-{digest}"
+
+
+def remove_source(
+    root: str, region: str, source: str, keep: Collection[str] = ()
+) -> int:
+    """
+    Remove the Parquet files of a .nc file, after it was written again with possibly other bands.
+
+    Parameters:
+        root: directory of the Parquet dataset
+        region: name of the region
+        source: path to the .nc file
+        keep: paths of the files of the new write, they are not removed
+    Returns:
+        the number of removed files
+    """
+    pattern = os.path.join(
+        glob.escape(root),
+        f"region={glob.escape(region)}",
+        "year=*",
+        "month=*",
+        f"{glob.escape(_source_name(source))}.*.parquet",
+    )
+    keep = {os.path.abspath(path) for path in keep}
+    paths = [path for path in glob.glob(pattern) if os.path.abspath(path) not in keep]
+    for path in paths:
+        os.unlink(path)
+    return len(paths)
+
+
+def write_daily_parquet(
+    gdf: gpd.GeoDataFrame, root: str, region: str, source: str, band: int = 0
+) -> List[str]:
+    """
+    Write daily values to the partitions of their months.
+
+    Parameters:
+        gdf: daily values as made by ``src.ingestion.transform.transform_dataset``
+        root: directory of the Parquet dataset
+        region: name of the region
+        source: path to the .nc file of the values, its name and a hash of its path name the Parquet files
+        band: index of the band of the .nc file
+    Returns:
+        the paths of the written files
+    """
+    paths = []
+    times = pd.DatetimeIndex(gdf.time)
+    for (year, month), rows in gdf.groupby([times.year, times.month], sort=True):
+        directory = partition_directory(root, region, year, month)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{_source_name(source)}.{band:03d}.parquet")
+        # written under a temporary name and renamed, so a reader never sees a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        os.close(fd)
+        rows = rows.reset_index(drop=True)
+        # plain coordinates for engines without spatial types, see ``src.postgis_era5.parquet_interface``
+        rows["latitude"] = rows.geometry.y
+        rows["longitude"] = rows.geometry.x
+        try:
+            rows.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        paths.append(path)
+    return paths
+
+
+def with_parquet(
+    gdfs: Iterable[gpd.GeoDataFrame], root: Optional[str], region: str, source: str
+) -> Iterator[gpd.GeoDataFrame]:
+    """
+    Write the bands of a .nc file to the Parquet dataset as they pass by, nothing is written when
+    ``root`` is ``None``.
+
+    A file of a band replaces the file of the same band of a previous write. The files of a previous write
+    that are not written again, e.g. with other bands, are only removed after the last band is written, so
+    a write that fails leaves the previous files of the other bands in place.
+    """
+    if root is None:
+        yield from gdfs
+        return
+    written: List[str] = []
+    for band, gdf in enumerate(gdfs):
+        with stage("parquet", rows_in=len(gdf)) as run:
+            written += write_daily_parquet(gdf, root, region, source, band=band)
+            run.rows_out = len(gdf)
+        yield gdf
+    removed = remove_source(root, region, source, keep=written)
+    if removed:
+        logger.info(f"{source}; {removed} Parquet files of a previous write removed")
+
+
+def transform_to_parquet(
+    path: str,
+    root: str,
+    region: str,
+    latitude_chunk: Optional[int] = None,
+    land: Optional[xr.DataArray] = None,
+) -> int:
+    """
+    Transform a .nc file into the Parquet dataset only, without a database.
+
+    Returns:
+        the number of rows written
+    """
+    rows = 0
+    with xr.open_dataset(path) as ds:
+        gdfs = transform_dataset(ds, latitude_chunk=latitude_chunk, land=land)
+        for gdf in with_parquet(gdfs, root, region, path):
+            rows += len(gdf)
+    logger.info(f"{path}; {rows} rows wrote to {root}")
+    return rows
+
+
+def parquet_files(
+    root: str, region: Optional[str] = None, years: Optional[Iterable[int]] = None
+) -> List[str]:
+    """
+    The files of the Parquet dataset, in order of region, year, month and name.
+
+    Parameters:
+        root: directory of the Parquet dataset
+        region: only the files of a region, ``None`` for all regions
+        years: only the files of these years, ``None`` for all years
+    """
+    regions = "*" if region is None else glob.escape(region)
+    paths = glob.glob(
+        os.path.join(
+            glob.escape(root), f"region={regions}", "year=*", "month=*", "*.parquet"
+        )
+    )
+    if years is not None:
+        directories = {f"year={year}" for year in years}
+        paths = [path for path in paths if path.split(os.sep)[-3] in directories]
+    return sorted(paths)
+
+
+def parquet_rows(paths: Iterable[str]) -> int:
+    """
+    The number of rows of Parquet files, from their metadata.
+    """
+    import pyarrow.parquet as pq
+
+    return sum(pq.read_metadata(path).num_rows for path in paths)
+
+
+def read_daily_parquet(path: str) -> gpd.GeoDataFrame:
+    """
+    Read a file of the Parquet dataset, with the daily derived variables computed by the current code.
+
+    Parameters:
+        path: path to the file
+    Returns:
+        the daily values as made by ``src.ingestion.transform.transform_dataset``
+    """
+    gdf = gpd.read_parquet(path).drop(columns=["latitude", "longitude"])
+    return add_daily_derived(gdf)
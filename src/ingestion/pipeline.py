@@ -0,0 +1,283 @@
+"""
+Download, transformation and loading of ERA5-Land as overlapping stages
+
+The stages are linked by bounded queues and every stage has its own threads, so while chunk N is loaded
+into postgis chunk N+1 is transformed and chunk N+2 is downloaded. When a stage falls behind, the queue in
+front of it fills up and the stages before it wait. A chunk is transformed band by band while its earlier
+bands are loaded, see ``src.ingestion.ingest.BandStream``, so at most a few bands of a few chunks are in
+memory at once. The time of a region-year approaches the time of the slowest stage instead of the sum of
+the stages.
+"""
+import dataclasses as dc
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from src.ingestion.download import (
+    CHUNK_MONTH,
+    DownloadChunk,
+    DownloadManager,
+    chunk_requests,
+)
+from src.ingestion.ingest import IngestOptions, create_tables, load_file, transform_file
+from src.postgis_era5.engine import create_era5_engine
+from src.postgis_era5.metrics import Metrics, file_stages, stage
+
+logger = logging.getLogger(__name__)
+
+# marks the end of the items in a queue
+_DONE = object()
+
+
+@dc.dataclass(frozen=True)
+class Stage:
+    """
+    A step of a pipeline.
+
+    Parameters:
+        name: name of the stage in the results and the logs
+        function: turns the value of the previous stage into the value of the next stage, ``None`` ends
+            the item without running the next stages (e.g. a file that is already ingested)
+        workers: number of threads of the stage
+        queue_size: number of items that can wait in front of the stage, the previous stage waits
+            when the queue is full
+    """
+
+    name: str
+    function: Callable[[Any], Any]
+    workers: int = 1
+    queue_size: int = 1
+
+    def __post_init__(self) -> None:
+        if self.workers < 1:
+            raise ValueError(
+                f"workers should be a positive number but found {self.workers!r}"
+            )
+        if self.queue_size < 1:
+            raise ValueError(
+                f"queue_size should be a positive number but found {self.queue_size!r}"
+            )
+
+
+@dc.dataclass
+class ItemResult:
+    """
+    What happened to an item of a pipeline.
+
+    Parameters:
+        item: the item
+        value: the value of the last stage that ran
+        stage: the name of the last stage that ran
+        seconds: the time of the item in every stage that ran
+        error: the error of the stage that failed
+    """
+
+    item: Any
+    value: Any = None
+    stage: Optional[str] = None
+    seconds: Dict[str, float] = dc.field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _describe(e: Exception) -> str:
+    return traceback.format_exception_only(type(e), e)[0].strip()
+
+
+def run_pipeline(items: Iterable[Any], stages: Sequence[Stage]) -> List[ItemResult]:
+    """
+    Run items through stages, the stages run concurrently on different items.
+
+    An item that fails in a stage is logged and reported in the results without running its next
+    stages or stopping the other items.
+
+    Parameters:
+        items: the input of the first stage, consumed as the first stage has room for them
+        stages: the stages in order
+    Returns:
+        the result of every item, in the order of ``items``
+    """
+    if not stages:
+        raise ValueError("a pipeline needs at least one stage")
+    queues: List["queue.Queue"] = [
+        queue.Queue(maxsize=stage.queue_size) for stage in stages
+    ]
+    results: List[ItemResult] = []
+    running = [stage.workers for stage in stages]
+    lock = threading.Lock()
+
+    def work(index: int) -> None:
+        stage = stages[index]
+        while True:
+            result = queues[index].get()
+            if result is _DONE:
+                break
+            tic = time.perf_counter()
+            try:
+                value = stage.function(result.value)
+            except Exception as e:
+                logger.exception(f"{result.item!r}; failed in {stage.name}")
+                result.error = _describe(e)
+                value = None
+            result.seconds[stage.name] = time.perf_counter() - tic
+            result.stage, result.value = stage.name, value
+            if value is not None and index + 1 < len(stages):
+                queues[index + 1].put(result)
+        with lock:
+            running[index] -= 1
+            last = running[index] == 0
+        # the last worker of a stage tells every worker of the next stage to stop
+        if last and index + 1 < len(stages):
+            for _ in range(stages[index + 1].workers):
+                queues[index + 1].put(_DONE)
+
+    threads = [
+        threading.Thread(
+            target=work, args=(index,), name=f"{stage.name}-{worker}", daemon=True
+        )
+        for index, stage in enumerate(stages)
+        for worker in range(stage.workers)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for item in items:
+            result = ItemResult(item=item, value=item)
+            results.append(result)
+            queues[0].put(result)
+    finally:
+        for _ in range(stages[0].workers):
+            queues[0].put(_DONE)
+        for thread in threads:
+            thread.join()
+    return results
+
+
+def _download_stage(
+    manager: DownloadManager, metrics: Optional[Metrics]
+) -> Callable[[DownloadChunk], str]:
+    def download(chunk: DownloadChunk) -> str:
+        path = os.path.abspath(manager.path(chunk))
+        with file_stages(metrics, path), stage("download"):
+            result = manager.download_chunk(chunk)
+        if not result.ok:
+            raise RuntimeError(result.error)
+        return result.path
+
+    return download
+
+
+def download_and_ingest(
+    client: Any,
+    directory: str,
+    database_url: str,
+    min_lat: float,
+    max_lat: float,
+    min_lon: float,
+    max_lon: float,
+    year: int,
+    region: str,
+    options: IngestOptions = IngestOptions(),
+    download_workers: int = 4,
+    transform_workers: int = 1,
+    load_workers: int = 1,
+    queue_size: int = 1,
+    metrics: Optional[Metrics] = None,
+    bands_ahead: int = 1,
+) -> List[ItemResult]:
+    """
+    Download a region-year month by month and ingest every month as soon as it is downloaded.
+
+    The transformation runs in threads, its NumPy work runs in parallel with the downloads and the
+    COPY of the previous month but the rest of it holds the GIL, so more than one or two transform
+    workers rarely helps.
+
+    The "transform" stage only opens a month and starts the thread that transforms its bands, see
+    ``src.ingestion.ingest.BandStream``, so the bands are transformed while the month is in the "load"
+    stage. The seconds of "transform" in the results are the time of the opening; the transformation is
+    timed by the stages of ``metrics`` (e.g. "aggregate") and its waits are part of the seconds of "load".
+
+    Parameters:
+        client: the client of the Climate Data Store, see ``src.ingestion.download.DownloadManager``
+        directory: directory of the downloaded files
+        database_url: url of the database
+        min_lat: southern edge of the region
+        max_lat: northern edge of the region
+        min_lon: western edge of the region
+        max_lon: eastern edge of the region
+        year: the year
+        region: name of the region
+        options: settings of the ingestion
+        download_workers: number of months downloaded at once
+        transform_workers: number of bands transformed at once, over all months
+        load_workers: number of months loaded at once, each in its own transaction
+        queue_size: number of months that can wait in front of the transformation and the loading
+        metrics: records the stages of every month, see ``src.postgis_era5.metrics``
+        bands_ahead: number of transformed bands of a month that can wait for its loading
+    Returns:
+        the result of every month, the value of a loaded month is its number of rows and ``None`` for a
+        month that was ingested by another process in the meantime
+    """
+    # the pipeline downloads with ``download_chunk``, which expects the directory to exist
+    os.makedirs(directory, exist_ok=True)
+    manager = DownloadManager(client, directory, max_concurrency=download_workers)
+    engine = create_era5_engine(
+        database_url,
+        pool_size=transform_workers + load_workers,
+        max_overflow=0,
+        statement_timeout=None,
+    )
+    create_tables(engine, options)
+    transforming = threading.BoundedSemaphore(transform_workers)
+
+    tic = time.perf_counter()
+    results = run_pipeline(
+        chunk_requests(
+            min_lat, max_lat, min_lon, max_lon, year, region, chunk=CHUNK_MONTH
+        ),
+        [
+            Stage(
+                "download",
+                _download_stage(manager, metrics),
+                workers=download_workers,
+                queue_size=download_workers,
+            ),
+            Stage(
+                "transform",
+                lambda path: transform_file(
+                    path, engine, options, metrics, bands_ahead, transforming
+                ),
+                workers=transform_workers,
+                queue_size=queue_size,
+            ),
+            Stage(
+                "load",
+                lambda transformed: load_file(transformed, engine, options, metrics),
+                workers=load_workers,
+                queue_size=queue_size,
+            ),
+        ],
+    )
+    failed = [result for result in results if not result.ok]
+    loaded = [
+        result
+        for result in results
+        if result.ok and result.stage == "load" and result.value is not None
+    ]
+    logger.info(
+        f"{len(loaded)}/{len(results)} months of {region} {year} ingested, "
+        f"{len(results) - len(loaded) - len(failed)} skipped as already ingested, "
+        f"{sum(result.value or 0 for result in loaded)} rows in {time.perf_counter() - tic:0.1f} seconds"
+    )
+    for result in failed:
+        logger.error(
+            f"{result.item.filename}; failed in {result.stage} with {result.error}"
+        )
+    return results
@@ -0,0 +1,378 @@
+"""
+Transformation of the hourly ERA5-Land data into the daily values that are written to postgis
+"""
+import logging
+from typing import Dict, Iterator, Optional, Tuple
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import xarray as xr
+from src.ingestion.derived import DAILY, HOURLY
+from src.postgis_era5.metrics import stage
+
+logger = logging.getLogger(__name__)
+
+DAILY_AGGREGATIONS = {
+    "d2m": ["min", "mean", "max"],
+    "t2m": ["min", "mean", "max"],
+    "stl1": ["min", "mean", "max"],
+    "ssr": ["max"],  # the max gets the accumulated radiation over the whole day
+    "str": ["min"],  # the min gets the accumulated radiation over the whole day
+    "sp": [
+        "mean"
+    ],  # this is a feature that don't really deviate and is only used to calculate pet
+    "tp": ["sum"],  # sum total precipitation on a day
+    "ws_2m": ["mean", "max"],
+    "rh": ["min", "mean", "max"],
+    "G": ["min", "mean", "max"],
+}
+
+
+def _assign(df: pd.DataFrame, values: Dict[str, np.ndarray]) -> None:
+    # wrapped in a series so pandas takes the arrays as they are instead of copying them
+    for name, value in values.items():
+        df[name] = pd.Series(value, index=df.index, copy=False)
+
+
+def convert_hourly(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Apply the unit conversions and compute the hourly derived variables in place.
+
+    Parameters:
+        df: hourly ERA5-Land values indexed by (time, latitude, longitude)
+    Returns:
+        the same dataframe with ws_10m, ws_2m, nr, rh and G added
+    See also:
+        ``src.ingestion.derived.HOURLY``
+    """
+    inputs = {name: df[name].to_numpy() for name in HOURLY.inputs if name != "hour"}
+    # the hour of every distinct time, looked up by the codes of the index instead of per row
+    times = df.index.levels[df.index.names.index("time")]
+    inputs["hour"] = times.hour.to_numpy()[df.index.codes[df.index.names.index("time")]]
+    values = HOURLY.evaluate(
+        inputs,
+        ["d2m_celcius", "t2m_celcius", "tp_mm", "ws_10m", "ws_2m", "nr", "rh", "G"],
+    )
+    values["d2m"] = values.pop("d2m_celcius")
+    values["t2m"] = values.pop("t2m_celcius")
+    values["tp"] = values.pop("tp_mm")
+    _assign(df, values)
+    return df
+
+
+def aggregate_daily(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Resample the hourly values to daily values per grid point.
+
+    Parameters:
+        df: converted hourly values, see ``convert_hourly``
+    Returns:
+        daily values indexed by (latitude, longitude, time) with ``<variable>_<aggregation>`` columns
+    """
+    agg_df = df.groupby(
+        [
+            pd.Grouper(level="latitude"),
+            pd.Grouper(level="longitude"),
+            pd.Grouper(level="time", freq="D"),
+        ]
+    ).agg(DAILY_AGGREGATIONS)
+    agg_df.columns = ["_".join(col) for col in agg_df.columns]
+    return agg_df
+
+
+def _day_positions(times: pd.DatetimeIndex) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+    """
+    The days of ascending times and the positions of their hours as a (day, hour of the day) array, -1
+    marks the hours a day does not have.
+    """
+    codes, days = pd.factorize(times.floor("D"), sort=True)
+    counts = np.bincount(codes, minlength=len(days))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    positions = np.full((len(days), counts.max(initial=0)), -1)
+    positions[codes, np.arange(len(times)) - starts[codes]] = np.arange(len(times))
+    return days, positions
+
+
+def _by_day(values: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """
+    Reshape (time, cell) values into (day, hour of the day, cell) values, a view when every day has all
+    of its hours.
+    """
+    if positions.size == len(values) and (positions >= 0).all():
+        return values.reshape(positions.shape + values.shape[1:])
+    return values[positions.clip(0)]
+
+
+def _kahan_sum(values: np.ndarray, valid: Optional[np.ndarray]) -> np.ndarray:
+    """
+    The sum of the valid values over the hours (axis 1) with the compensated summation in the order of
+    the hours that the groupby sum and mean of pandas do, so the results are identical to them.
+    ``valid=None`` means that every value is valid.
+    """
+    total = np.zeros(values.shape[:1] + values.shape[2:], dtype=values.dtype)
+    compensation = np.zeros_like(total)
+    y, t = np.empty_like(total), np.empty_like(total)
+    # an infinite value makes the compensation NaN, pandas resets it to keep the infinite sum
+    infinite = bool(np.isinf(values).any())
+    for hour in range(values.shape[1]):
+        np.subtract(values[:, hour], compensation, out=y)
+        np.add(total, y, out=t)
+        if valid is None:
+            np.subtract(t, total, out=compensation)
+            np.subtract(compensation, y, out=compensation)
+            if infinite:
+                compensation[np.isnan(compensation)] = 0
+            total, t = t, total
+        else:
+            c = (t - total) - y
+            if infinite:
+                c[np.isnan(c)] = 0
+            np.copyto(compensation, c, where=valid[:, hour])
+            np.copyto(total, t, where=valid[:, hour])
+    return total
+
+
+def _aggregate(
+    values: np.ndarray, valid: Optional[np.ndarray], count: np.ndarray, how: str
+) -> np.ndarray:
+    if how == "min":
+        if valid is None:
+            return values.min(axis=1)
+        return np.min(values, axis=1, initial=np.inf, where=valid)
+    if how == "max":
+        if valid is None:
+            return values.max(axis=1)
+        return np.max(values, axis=1, initial=-np.inf, where=valid)
+    total = _kahan_sum(values, valid)
+    if how == "sum":
+        return total
+    if how == "mean":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (total / count).astype(values.dtype)
+    raise ValueError(f"unknown aggregation {how!r}")
+
+
+def aggregate_daily_arrays(
+    ds: xr.Dataset, land: Optional[xr.DataArray] = None
+) -> pd.DataFrame:
+    """
+    Convert and resample a dataset to daily values on the (time, latitude, longitude) arrays, without
+    the hourly dataframe of ``convert_hourly`` and ``aggregate_daily``.
+
+    The hours of every day are a separate axis of the arrays, the aggregations reduce that axis and only
+    the daily values are flattened into rows. Like ``df.dropna()`` in ``transform_dataframe``, an hour is
+    left out of the aggregations if any variable of the dataset is missing in it, and a day without hours
+    gives no row.
+
+    Parameters:
+        ds: hourly ERA5-Land dataset
+        land: land mask of the grid, see ``src.ingestion.land_mask``; only the latitudes and longitudes
+            with land are read and only the land cells are converted and aggregated
+    Returns:
+        the daily values, identical to ``aggregate_daily(convert_hourly(df.dropna()))``
+        with the index reset
+    """
+    ds = ds.transpose("time", "latitude", "longitude")
+    for dim in ("time", "latitude", "longitude"):
+        if not ds.indexes[dim].is_monotonic_increasing:
+            ds = ds.sortby(dim)
+    if land is not None:
+        land = land.sel(latitude=ds.latitude, longitude=ds.longitude).values
+        # a lazily opened dataset only reads the bounding box of the land
+        land_latitudes, land_longitudes = land.any(axis=1), land.any(axis=0)
+        ds = ds.isel(latitude=land_latitudes, longitude=land_longitudes)
+        land = land[land_latitudes][:, land_longitudes]
+    times = ds.indexes["time"]
+    shape = (len(times), ds.sizes["latitude"] * ds.sizes["longitude"])
+    latitude, longitude = np.meshgrid(
+        ds.latitude.values, ds.longitude.values, indexing="ij"
+    )
+    latitude, longitude = latitude.ravel(), longitude.ravel()
+
+    hourly = {
+        name: variable.values.reshape(shape) for name, variable in ds.data_vars.items()
+    }
+    if land is not None and not land.all():
+        cells = land.ravel()
+        hourly = {name: array[:, cells] for name, array in hourly.items()}
+        latitude, longitude = latitude[cells], longitude[cells]
+    valid = np.ones((len(times), len(latitude)), dtype=bool)
+    for array in hourly.values():
+        valid &= ~np.isnan(array)
+    # the ocean cells are dropped before any computation
+    cells = valid.any(axis=0)
+    if not cells.all():
+        hourly = {name: array[:, cells] for name, array in hourly.items()}
+        valid, latitude, longitude = valid[:, cells], latitude[cells], longitude[cells]
+
+    inputs = {name: hourly[name] for name in HOURLY.inputs if name != "hour"}
+    inputs["hour"] = np.broadcast_to(times.hour.to_numpy()[:, np.newaxis], valid.shape)
+    values = HOURLY.evaluate(
+        inputs, ["d2m_celcius", "t2m_celcius", "tp_mm", "ws_2m", "rh", "G"]
+    )
+    values["d2m"] = values.pop("d2m_celcius")
+    values["t2m"] = values.pop("t2m_celcius")
+    values["tp"] = values.pop("tp_mm")
+
+    days, positions = _day_positions(times)
+    if valid.all() and (positions >= 0).all():
+        count = np.full((len(days), len(latitude)), positions.shape[1])
+        valid = None
+    else:
+        valid = _by_day(valid, positions) & (positions >= 0)[:, :, np.newaxis]
+        count = valid.sum(axis=1)
+
+    columns = {}
+    for name, aggregations in DAILY_AGGREGATIONS.items():
+        by_day = _by_day(values[name] if name in values else hourly[name], positions)
+        for how in aggregations:
+            columns[f"{name}_{how}"] = _aggregate(by_day, valid, count, how)
+
+    # the rows in the order of the groupby, by latitude, longitude and day
+    keep = count.T.ravel() > 0
+    rows = {
+        "latitude": np.repeat(latitude, len(days))[keep],
+        "longitude": np.repeat(longitude, len(days))[keep],
+        "time": np.tile(days.to_numpy(), len(latitude))[keep],
+    }
+    rows.update((name, column.T.ravel()[keep]) for name, column in columns.items())
+    return pd.DataFrame(rows)
+
+
+def add_daily_derived(agg_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compute the daily net radiation, GDD and PET in place.
+
+    Parameters:
+        agg_df: daily values, see ``aggregate_daily``
+    Returns:
+        the same dataframe with nr, gdd and daily_pet_mean added
+    See also:
+        ``src.ingestion.derived.DAILY``
+    """
+    values = DAILY.evaluate(
+        {name: agg_df[name].to_numpy() for name in DAILY.inputs},
+        ["nr", "gdd", "daily_pet_mean"],
+    )
+    _assign(agg_df, values)
+    return agg_df
+
+
+def df_to_gdf(df: pd.DataFrame) -> gpd.GeoDataFrame:
+    if "latitude" not in df.columns or "longitude" not in df.columns:
+        raise ValueError("latitude and longitude not in columns")
+    gdf = gpd.GeoDataFrame(
+        df,
+        geometry=gpd.points_from_xy(df.longitude, df.latitude),
+        crs="EPSG:4326",
+    )
+    gdf.drop(columns=["latitude", "longitude"], inplace=True)
+    return gdf
+
+
+def transform_dataframe(df: pd.DataFrame) -> gpd.GeoDataFrame:
+    """
+    Turn the hourly dataframe of a .nc file (or a part of it) into the daily GeoDataFrame that is written to postgis.
+
+    Parameters:
+        df: hourly ERA5-Land values as returned by ``xr.Dataset.to_dataframe``
+    Returns:
+        daily values with a point geometry per row
+    """
+    # drops the ocean cells
+    df.dropna(inplace=True)
+
+    with stage("convert", rows_in=len(df)) as run:
+        convert_hourly(df)
+        run.rows_out = len(df)
+
+    with stage("aggregate", rows_in=len(df)) as run:
+        agg_df = aggregate_daily(df)
+        run.rows_out = len(agg_df)
+
+    with stage("derived", rows_in=len(agg_df)) as run:
+        add_daily_derived(agg_df)
+        run.rows_out = len(agg_df)
+
+    with stage("geodataframe", rows_in=len(agg_df)) as run:
+        gdf = df_to_gdf(agg_df.reset_index())
+        run.rows_out = len(gdf)
+    return gdf
+
+
+def transform_band(
+    ds: xr.Dataset, land: Optional[xr.DataArray] = None
+) -> gpd.GeoDataFrame:
+    """
+    Turn the hourly values of a dataset (or a band of it) into the daily GeoDataFrame that is written to postgis.
+
+    Parameters:
+        ds: hourly ERA5-Land dataset
+        land: land mask of the grid, see ``aggregate_daily_arrays``
+    Returns:
+        daily values with a point geometry per row, identical to ``transform_dataframe(ds.to_dataframe())``
+    """
+    # the input rows are the hourly cells, the conversions are part of the aggregation
+    with stage("aggregate", rows_in=int(np.prod(list(ds.sizes.values())))) as run:
+        agg_df = aggregate_daily_arrays(ds, land=land)
+        run.rows_out = len(agg_df)
+
+    with stage("derived", rows_in=len(agg_df)) as run:
+        add_daily_derived(agg_df)
+        run.rows_out = len(agg_df)
+
+    with stage("geodataframe", rows_in=len(agg_df)) as run:
+        gdf = df_to_gdf(agg_df)
+        run.rows_out = len(gdf)
+    return gdf
+
+
+def iter_latitude_bands(
+    ds: xr.Dataset, latitude_chunk: Optional[int] = None
+) -> Iterator[xr.Dataset]:
+    """
+    Split a dataset in bands of ``latitude_chunk`` latitudes, in ascending order of latitude.
+
+    Every grid point falls in exactly one band with all of its hours, so the daily aggregation of a
+    band does not depend on the other bands. Because the daily output is sorted by latitude first, the
+    concatenated output of the bands is identical to the output of the whole dataset.
+
+    Parameters:
+        ds: hourly ERA5-Land dataset
+        latitude_chunk: number of latitudes per band, ``None`` yields the whole dataset
+    Returns:
+        the bands of the dataset
+    """
+    if latitude_chunk is None:
+        yield ds
+        return
+    if latitude_chunk < 1:
+        raise ValueError(
+            f"latitude_chunk should be a positive number but found {latitude_chunk!r}"
+        )
+
+    latitudes = np.sort(ds.latitude.values)
+    for start in range(0, len(latitudes), latitude_chunk):
+        yield ds.sel(latitude=latitudes[start : start + latitude_chunk])
+
+
+def transform_dataset(
+    ds: xr.Dataset,
+    latitude_chunk: Optional[int] = None,
+    land: Optional[xr.DataArray] = None,
+) -> Iterator[gpd.GeoDataFrame]:
+    """
+    Transform a dataset band by band, so only one band is in memory as a dataframe at a time.
+
+    Parameters:
+        ds: hourly ERA5-Land dataset, preferably lazily opened with ``xr.open_dataset``
+        latitude_chunk: number of latitudes per band, ``None`` processes the whole dataset at once
+        land: land mask of the grid, see ``src.ingestion.land_mask``
+    Returns:
+        the daily GeoDataFrame of each band, see ``transform_band``
+    """
+    for band in iter_latitude_bands(ds, latitude_chunk):
+        gdf = transform_band(band, land=land)
+        if not gdf.empty:
+            yield gdf
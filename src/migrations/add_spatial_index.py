@@ -1,14 +1,16 @@
-import psycopg2
+from src.postgis_era5.engine import create_era5_engine
+from src.postgis_era5.indexes import analyze, create_indexes
+from src.postgis_era5.table import Era5Layout
 
 
 def main():
-    conn1 = psycopg2.connect(dbname="era5", host="localhost", port="5432")
-    conn1.autocommit = True
-    cursor = conn1.cursor()
-    cursor.execute("CREATE INDEX spatial_index_era5 ON era5 USING GIST (geometry);")
-    conn1.commit()
-    cursor.close()
-    conn1.close()
+    # the indexes of the table the ingestion writes to, see src.postgis_era5.indexes
+    engine = create_era5_engine(
+        "postgresql://localhost:5432/era5", statement_timeout=None
+    )
+    layout = Era5Layout(table="era5_ecuador")
+    create_indexes(engine, layout)
+    analyze(engine, layout)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,216 @@
+"""
+Asyncio counterpart of ``src.postgis_era5.psql.PSQLInterface``, for services that serve many queries at once.
+
+The engine is a SQLAlchemy ``AsyncEngine``, for example
+``create_async_engine("postgresql+asyncpg://localhost/era5")`` which needs the ``asyncpg`` extra.
+"""
+import asyncio
+from typing import Awaitable, Iterable, List, Optional, Sequence, Tuple, TypeVar, Union
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.sql import text
+from src.postgis_era5.parsing import (
+    DAILY_WEATHER_NORM_COLUMNS,
+    DailyWeather,
+    DailyWeatherNorm,
+    daily_weather_frame,
+    daily_weather_norm_frame,
+    parse_daily_weather,
+    parse_daily_weather_norm,
+)
+from src.postgis_era5.psql import _coordinates
+from src.postgis_era5.queries import (
+    baseline_range,
+    climatology_norm_query,
+    closest_point_query,
+    closest_points_query,
+    historical_observations_query,
+    last_year_query,
+    location_params,
+    month_range,
+    monthly_norm_query,
+    unique_points_query,
+)
+from src.postgis_era5.table import Era5Layout
+from src.postgis_era5.types import WGS84Point
+
+T = TypeVar("T")
+
+
+class AsyncPSQLInterface:
+    """
+    The queries of ``PSQLInterface`` as coroutines. Every query checks out its own connection from the
+    pool of the engine, so queries that are awaited together run concurrently.
+    """
+
+    engine: AsyncEngine
+    layout: Era5Layout
+    max_concurrency: int
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        layout: Era5Layout = Era5Layout(),
+        max_concurrency: int = 10,
+    ) -> None:
+        """
+        Parameters:
+            engine: async engine of the database
+            layout: layout of the tables
+            max_concurrency: the maximum number of queries the ``gather`` helpers run at once, at most
+                the size of the connection pool to not wait for connections
+        """
+        if max_concurrency < 1:
+            raise ValueError(
+                f"max_concurrency should be a positive number but found {max_concurrency!r}"
+            )
+        self.engine = engine
+        self.layout = layout
+        self.max_concurrency = max_concurrency
+
+    async def check_connection(self) -> None:
+        async with self.engine.connect() as conn:
+            res = (await conn.execute(text("SELECT 1;"))).all()
+        if res != [(1,)]:
+            raise Exception(
+                f"unexpected value when running the health check, expected [(1,)] but found {repr(res)}, "
+            )
+
+    async def get_all_unique_points(self) -> List[str]:
+        async with self.engine.connect() as conn:
+            res = (await conn.execute(unique_points_query(self.layout))).all()
+        return res
+
+    async def get_closest_point(self, location: WGS84Point) -> str:
+        wkt_text = f"SRID=4326;POINT({location.longitude} {location.latitude})"
+        async with self.engine.connect() as conn:
+            res = await conn.execute(
+                closest_point_query(self.layout), {"wkt": wkt_text}
+            )
+            return res.scalar_one()
+
+    async def get_closest_points(
+        self, locations: Union[Sequence[WGS84Point], np.ndarray]
+    ) -> List[str]:
+        """
+        The nearest grid point of many locations in one query, see ``PSQLInterface.get_closest_points``.
+        """
+        latitude, longitude = _coordinates(locations)
+        if len(latitude) == 0:
+            return []
+        async with self.engine.connect() as conn:
+            res = await conn.execute(
+                closest_points_query(self.layout),
+                {"latitudes": latitude.tolist(), "longitudes": longitude.tolist()},
+            )
+            return list(res.scalars())
+
+    async def retrieve_monthly_norm(
+        self,
+        month: int,
+        year_range: Optional[int] = None,
+        location: Optional[WGS84Point] = None,
+        radius: Optional[float] = None,
+        k: Optional[int] = None,
+        columnar: bool = False,
+    ) -> Union[List[DailyWeatherNorm], pd.DataFrame]:
+        """
+        The average and standard deviation of the daily values of every day of a month, see
+        ``PSQLInterface.retrieve_monthly_norm``.
+        """
+        scope, params = location_params(self.layout, location, radius=radius, k=k)
+        async with self.engine.connect() as conn:
+            if year_range is None and self.layout.climatology:
+                query = climatology_norm_query(self.layout, scope)
+            elif year_range is None:
+                query = monthly_norm_query(self.layout, scope=scope)
+            else:
+                last_year = (await conn.execute(last_year_query(self.layout))).scalar()
+                if last_year is None:
+                    if columnar:
+                        return daily_weather_norm_frame(
+                            [], columns=DAILY_WEATHER_NORM_COLUMNS
+                        )
+                    return []
+                query = monthly_norm_query(self.layout, windowed=True, scope=scope)
+                params["start"], params["end"] = baseline_range(last_year, year_range)
+            result = await conn.execute(query, {"month": month, **params})
+            columns, res = list(result.keys()), result.all()
+        if columnar:
+            return daily_weather_norm_frame(res, columns=columns)
+        return parse_daily_weather_norm([row._mapping for row in res])
+
+    async def retrieve_monthly_historical_observations(
+        self,
+        month: int,
+        year: int,
+        location: Optional[WGS84Point] = None,
+        radius: Optional[float] = None,
+        k: Optional[int] = None,
+        columnar: bool = False,
+    ) -> Union[List[DailyWeather], pd.DataFrame]:
+        """
+        The daily values of a month, see ``PSQLInterface.retrieve_monthly_historical_observations``.
+        """
+        scope, params = location_params(self.layout, location, radius=radius, k=k)
+        start, end = month_range(month, year)
+        async with self.engine.connect() as conn:
+            result = await conn.execute(
+                historical_observations_query(self.layout, scope),
+                {"start": start, "end": end, **params},
+            )
+            columns, res = list(result.keys()), result.all()
+        if columnar:
+            return daily_weather_frame(res, columns=columns)
+        return parse_daily_weather([row._mapping for row in res])
+
+    async def gather(self, queries: Iterable[Awaitable[T]]) -> List[T]:
+        """
+        Run queries concurrently, at most ``max_concurrency`` at a time, so the time is bounded by the
+        slowest queries instead of the sum of all of them.
+
+        Parameters:
+            queries: the coroutines of the queries, e.g. ``[db.get_closest_point(p) for p in points]``
+        Returns:
+            the results in the order of the queries
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def limited(query: Awaitable[T]) -> T:
+            async with semaphore:
+                return await query
+
+        return list(await asyncio.gather(*(limited(query) for query in queries)))
+
+    async def gather_monthly_norms(
+        self, months: Sequence[int], **kwargs
+    ) -> List[Union[List[DailyWeatherNorm], pd.DataFrame]]:
+        """
+        The norms of several months at once, the keyword arguments are passed to
+        ``retrieve_monthly_norm``.
+
+        Returns:
+            the norms of every month, in the order of ``months``
+        """
+        return await self.gather(
+            self.retrieve_monthly_norm(month, **kwargs) for month in months
+        )
+
+    async def gather_monthly_historical_observations(
+        self, months: Sequence[Tuple[int, int]], **kwargs
+    ) -> List[Union[List[DailyWeather], pd.DataFrame]]:
+        """
+        The daily values of several months at once, the keyword arguments are passed to
+        ``retrieve_monthly_historical_observations``.
+
+        Parameters:
+            months: (month, year) pairs
+        Returns:
+            the daily values of every month, in the order of ``months``
+        """
+        return await self.gather(
+            self.retrieve_monthly_historical_observations(month, year, **kwargs)
+            for month, year in months
+        )
@@ -0,0 +1,235 @@
+"""
+Caching of the PSQLInterface query results, invalidated by the version of the dataset
+"""
+import dataclasses as dc
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+import sqlalchemy
+from sqlalchemy.sql import text
+from src.postgis_era5.table import Era5Layout
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+def dataset_version(conn: sqlalchemy.engine.Connection, layout: Era5Layout) -> int:
+    """
+    The version of the data of a layout, 0 when nothing was ingested since versions are kept.
+
+    Parameters:
+        conn: connection to the database
+        layout: layout of the tables
+    Returns:
+        the version
+    """
+    version = conn.execute(
+        text('SELECT version FROM "dataset_version" WHERE table_name = :table_name;'),
+        table_name=layout.table,
+    ).scalar()
+    return 0 if version is None else version
+
+
+def bump_dataset_version(conn: sqlalchemy.engine.Connection, layout: Era5Layout) -> int:
+    """
+    Increment the version of the data of a layout, in the transaction that changes the data so the new
+    version becomes visible together with the data.
+
+    Parameters:
+        conn: connection with an open transaction
+        layout: layout of the tables
+    Returns:
+        the new version
+    """
+    return conn.execute(
+        text(
+            """
+            INSERT INTO "dataset_version" AS current (table_name, version)
+            VALUES (:table_name, 1)
+            ON CONFLICT (table_name) DO UPDATE SET
+            version = current.version + 1,
+            updated_at = now()
+            RETURNING version;
+            """
+        ),
+        table_name=layout.table,
+    ).scalar()
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+@dc.dataclass
+class CacheStats:
+    hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class QueryCache:
+    """
+    Least recently used cache of query results in memory, with an optional directory as a second tier
+    that survives restarts and can be shared by processes.
+
+    Every entry belongs to a namespace, the table it was read from, and to a dataset version of that
+    namespace. When a newer version is seen the entries of the older versions of the namespace are dropped,
+    so a result is never served after new data was ingested. Processes that share the directory may see
+    the new version at different times, an older version never removes the entries of a newer one.
+    """
+
+    maxsize: int
+    directory: Optional[str]
+    stats: CacheStats
+
+    def __init__(self, maxsize: int = 1024, directory: Optional[str] = None) -> None:
+        """
+        Parameters:
+            maxsize: the maximum number of results kept in memory
+            directory: directory for the results on disk, ``None`` only keeps them in memory
+        """
+        if maxsize < 1:
+            raise ValueError(
+                f"maxsize should be a positive number but found {maxsize!r}"
+            )
+        self.maxsize = maxsize
+        self.directory = directory
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[Tuple[str, int, Hashable], object]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _path(self, namespace: str, version: int, key: Hashable) -> str:
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, namespace, str(version), f"{digest}.pickle")
+
+    def _set_version(self, namespace: str, version: int) -> bool:
+        # called with the lock held, returns whether the version is the newest of the namespace
+        current = self._versions.get(namespace)
+        if current is not None and version <= current:
+            return version == current
+        for entry in [entry for entry in self._entries if entry[0] == namespace]:
+            del self._entries[entry]
+        self._versions[namespace] = version
+        directory = (
+            None if self.directory is None else os.path.join(self.directory, namespace)
+        )
+        if directory is not None and os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.isdigit() and int(name) < version:
+                    shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+        return True
+
+    def get(self, version: int, key: Hashable, namespace: str = "default") -> object:
+        """
+        Get a result from the cache.
+
+        Parameters:
+            version: the current dataset version of the namespace
+            key: the key of the result, its ``repr`` identifies it on disk
+            namespace: the namespace of the result, a directory name
+        Returns:
+            the result or ``MISSING``
+        """
+        with self._lock:
+            newest = self._set_version(namespace, version)
+            value = self._entries.get((namespace, version, key), MISSING)
+            if value is not MISSING:
+                self._entries.move_to_end((namespace, version, key))
+                self.stats.hits += 1
+                return value
+        if self.directory is not None and newest:
+            try:
+                with open(self._path(namespace, version, key), "rb") as f:
+                    value = pickle.load(f)
+            except FileNotFoundError:
+                pass
+            except (OSError, pickle.UnpicklingError, EOFError) as e:
+                logger.warning(f"could not read cached result {key!r}: {e}")
+            else:
+                with self._lock:
+                    self.stats.hits += 1
+                    self.stats.disk_hits += 1
+                    self._remember(namespace, version, key, value)
+                return value
+        with self._lock:
+            self.stats.misses += 1
+        return MISSING
+
+    def _remember(
+        self, namespace: str, version: int, key: Hashable, value: object
+    ) -> None:
+        # called with the lock held
+        if version != self._versions.get(namespace):
+            return
+        self._entries[(namespace, version, key)] = value
+        self._entries.move_to_end((namespace, version, key))
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def put(
+        self, version: int, key: Hashable, value: object, namespace: str = "default"
+    ) -> None:
+        """
+        Add a result to the cache. A result of an older version than the newest one seen is not kept, and
+        a result that can not be written to disk is only kept in memory.
+
+        Parameters:
+            version: the dataset version the result was computed from
+            key: the key of the result
+            value: the result, it is shared by everyone that gets it from the cache
+            namespace: the namespace of the result, a directory name
+        """
+        with self._lock:
+            if not self._set_version(namespace, version):
+                return
+            self._remember(namespace, version, key, value)
+        if self.directory is None:
+            return
+        path = self._path(namespace, version, key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # written under a temporary name and renamed, so readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        except OSError as e:
+            logger.warning(f"could not write cached result {key!r}: {e}")
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # for example a full disk, or the directory of the version was removed by a newer version
+            logger.warning(f"could not write cached result {key!r}: {e}")
+            _unlink(tmp_path)
+        except BaseException:
+            _unlink(tmp_path)
+            raise
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            if self.directory is not None:
+                shutil.rmtree(self.directory, ignore_errors=True)
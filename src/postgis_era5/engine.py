@@ -0,0 +1,95 @@
+"""
+Engines with the connection pool settings of the PSQLInterface and the ingestion
+"""
+from typing import Dict, Optional
+
+import sqlalchemy
+from sqlalchemy import create_engine
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+# connections are replaced before servers or proxies close them for being idle too long
+DEFAULT_POOL_RECYCLE = 30 * 60
+DEFAULT_STATEMENT_TIMEOUT = 30_000
+APPLICATION_NAME = "postgis_era5"
+
+
+def _server_settings(statement_timeout: Optional[int]) -> Dict[str, str]:
+    settings = {"application_name": APPLICATION_NAME}
+    if statement_timeout is not None:
+        if statement_timeout < 1:
+            raise ValueError(
+                f"statement_timeout should be a positive number but found {statement_timeout!r}"
+            )
+        settings["statement_timeout"] = str(statement_timeout)
+    return settings
+
+
+def create_era5_engine(
+    database_url: str,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    max_overflow: int = DEFAULT_MAX_OVERFLOW,
+    pool_recycle: int = DEFAULT_POOL_RECYCLE,
+    statement_timeout: Optional[int] = DEFAULT_STATEMENT_TIMEOUT,
+    **kwargs,
+) -> sqlalchemy.engine.Engine:
+    """
+    Create an engine with a connection pool for the psycopg2 driver.
+
+    Connections are checked with a ping when they are taken from the pool, so a restarted database
+    does not fail the first query of every pooled connection.
+
+    Parameters:
+        database_url: url of the database
+        pool_size: the number of connections kept open
+        max_overflow: the number of connections that are opened on top of ``pool_size`` under load
+        pool_recycle: the number of seconds after which a connection is replaced
+        statement_timeout: the number of milliseconds after which the server cancels a statement,
+            ``None`` for no timeout which is needed to ingest large files
+        kwargs: passed to ``sqlalchemy.create_engine``
+    Returns:
+        the engine
+    """
+    settings = _server_settings(statement_timeout)
+    options = " ".join(f"-c {name}={value}" for name, value in settings.items())
+    return create_engine(
+        database_url,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=True,
+        connect_args={"options": options, **kwargs.pop("connect_args", {})},
+        **kwargs,
+    )
+
+
+def create_async_era5_engine(
+    database_url: str,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    max_overflow: int = DEFAULT_MAX_OVERFLOW,
+    pool_recycle: int = DEFAULT_POOL_RECYCLE,
+    statement_timeout: Optional[int] = DEFAULT_STATEMENT_TIMEOUT,
+    **kwargs,
+):
+    """
+    Create an async engine with the ``asyncpg`` driver for ``AsyncPSQLInterface``, see
+    ``create_era5_engine`` for the parameters. asyncpg prepares and caches every statement by itself.
+
+    Returns:
+        the ``sqlalchemy.ext.asyncio.AsyncEngine``
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url = sqlalchemy.engine.make_url(database_url).set(drivername="postgresql+asyncpg")
+    return create_async_engine(
+        url,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=True,
+        connect_args={
+            "server_settings": _server_settings(statement_timeout),
+            **kwargs.pop("connect_args", {}),
+        },
+        **kwargs,
+    )
@@ -0,0 +1,139 @@
+"""
+The ERA5-Land grid
+"""
+from typing import Tuple
+
+import numpy as np
+
+# ERA5-Land is a regular latitude/longitude grid of 0.1 by 0.1 degrees
+GRID_RESOLUTION = 0.1
+GRID_ROWS = 1801
+GRID_COLUMNS = 3600
+
+# the number of distances computed at once when searching the nearest point by brute force
+BRUTE_FORCE_BLOCK_SIZE = 4_000_000
+
+
+def _grid_position(
+    latitude: np.ndarray, longitude: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The row and column of the grid nodes nearest to points, and whether the points are off the grid.
+    """
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    row = np.rint((90.0 - latitude) / GRID_RESOLUTION)
+    column = np.rint((longitude + 180.0) / GRID_RESOLUTION)
+    off_grid = (np.abs(90.0 - row * GRID_RESOLUTION - latitude) > 1e-4) | (
+        np.abs(column * GRID_RESOLUTION - 180.0 - longitude) > 1e-4
+    )
+    return row.astype(np.int64), column.astype(np.int64), off_grid
+
+
+def grid_point_ids(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """
+    Compute the ids of grid points from their coordinates.
+
+    The id is the position of the point on the global grid, counted row by row from the north pole
+    and from 180 degrees west. It is the same for every region and every ingested file, so it can be
+    computed without looking it up in the database.
+
+    Parameters:
+        latitude: latitudes of the grid points
+        longitude: longitudes of the grid points
+    Returns:
+        the ids of the grid points
+    Raises:
+        ValueError: If a point is not on the ERA5-Land grid.
+    """
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    row, column, off_grid = _grid_position(latitude, longitude)
+    if off_grid.any():
+        raise ValueError(
+            f"points should be on the {GRID_RESOLUTION} degree grid but found "
+            f"latitude {latitude[off_grid][0]!r} and longitude {longitude[off_grid][0]!r}"
+        )
+    return row * GRID_COLUMNS + column % GRID_COLUMNS
+
+
+def _node_keys(row: np.ndarray, column: np.ndarray) -> np.ndarray:
+    # unlike the grid point ids, 180 east and 180 west are different nodes here, because the distance
+    # of the postgis KNN operator does not wrap around the antimeridian either
+    return row * (GRID_COLUMNS + 1) + column
+
+
+class GridIndex:
+    """
+    In memory index of the grid points that have data, to find the nearest one to many locations
+    without a round trip to the database per location.
+
+    A location is snapped to the nearest node of the grid. When that node has no data, for example
+    because it is in the ocean, the nearest grid point is searched by brute force. Distances are
+    planar in degrees like those of the postgis ``<->`` operator on geometries, so the result is the
+    same as ``PSQLInterface.get_closest_point`` (up to ties).
+    """
+
+    latitude: np.ndarray
+    longitude: np.ndarray
+
+    def __init__(self, latitude: np.ndarray, longitude: np.ndarray) -> None:
+        """
+        Parameters:
+            latitude: latitudes of the grid points with data
+            longitude: longitudes of the grid points with data
+        Raises:
+            ValueError: If a point is not on the ERA5-Land grid.
+        """
+        self.latitude = np.asarray(latitude, dtype=np.float64)
+        self.longitude = np.asarray(longitude, dtype=np.float64)
+        row, column, off_grid = _grid_position(self.latitude, self.longitude)
+        if off_grid.any():
+            raise ValueError(
+                f"points should be on the {GRID_RESOLUTION} degree grid but found "
+                f"latitude {self.latitude[off_grid][0]!r} and longitude {self.longitude[off_grid][0]!r}"
+            )
+        keys = _node_keys(row, column)
+        self._order = np.argsort(keys, kind="stable")
+        self._keys = keys[self._order]
+
+    def __len__(self) -> int:
+        return len(self.latitude)
+
+    def _brute_force(self, latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+        nearest = np.empty(len(latitude), dtype=np.int64)
+        block = max(BRUTE_FORCE_BLOCK_SIZE // len(self), 1)
+        for start in range(0, len(latitude), block):
+            stop = start + block
+            distance = np.square(latitude[start:stop, None] - self.latitude[None, :])
+            distance += np.square(longitude[start:stop, None] - self.longitude[None, :])
+            nearest[start:stop] = distance.argmin(axis=1)
+        return nearest
+
+    def nearest(self, latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+        """
+        Find the nearest grid point of every location.
+
+        Parameters:
+            latitude: latitudes of the locations
+            longitude: longitudes of the locations
+        Returns:
+            the positions of the nearest grid points in ``self.latitude`` and ``self.longitude``
+        Raises:
+            ValueError: If the index is empty.
+        """
+        if len(self) == 0:
+            raise ValueError("the grid index has no points")
+        latitude = np.asarray(latitude, dtype=np.float64)
+        longitude = np.asarray(longitude, dtype=np.float64)
+        row, column, _ = _grid_position(latitude, longitude)
+        keys = _node_keys(row, column)
+
+        position = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+        found = self._keys[position] == keys
+        nearest = np.empty(len(keys), dtype=np.int64)
+        nearest[found] = self._order[position[found]]
+        missing = ~found
+        if missing.any():
+            nearest[missing] = self._brute_force(latitude[missing], longitude[missing])
+        return nearest
@@ -0,0 +1,304 @@
+"""
+The secondary indexes of the daily table and the grid table, and their lifecycle around bulk loads
+
+The queries find grid points with the GiST index on the geometry (``<->``, ``&&`` and ``ST_DWithin``), the
+normalized layout finds the days of a grid point with the b-tree on (point_id, time), and the BRIN index
+on time is a few pages that lets the time range of a query or of ``src.ingestion.manifest.delete_rows``
+skip the files of other periods. In the default layout a b-tree on (geometry, time) would not be used,
+the spatial conditions are answered by the GiST index.
+
+Keeping the indexes up to date row by row makes a large COPY several times slower than building them
+afterwards, so ``bulk_load`` drops them before a large load, builds them again with
+``CREATE INDEX CONCURRENTLY`` so queries are not blocked, and runs ``ANALYZE``. The BRIN index is kept, it
+costs the COPY little and without it every re-ingested file of the load would scan the whole table to
+delete its previous rows. A partitioned index can
+not be built concurrently, so its partitions are built one by one and attached to it.
+"""
+import contextlib
+import dataclasses as dc
+import logging
+import time
+from typing import Iterator, List, Optional, Tuple
+
+import sqlalchemy
+from sqlalchemy.sql import text
+from src.postgis_era5.table import Era5Layout
+
+logger = logging.getLogger(__name__)
+
+# a load of at least this fraction of the rows that are already in the daily table is a bulk load
+BULK_LOAD_FRACTION = 0.25
+
+
+@dc.dataclass(frozen=True)
+class IndexSpec:
+    """
+    An index of the managed set.
+
+    Parameters:
+        suffix: the name of the index is ``<table>_<suffix>``
+        table: the table of the index
+        method: the index method, ``"gist"``, ``"brin"`` or ``"btree"``
+        columns: the indexed columns
+    """
+
+    suffix: str
+    table: str
+    method: str
+    columns: Tuple[str, ...]
+
+    @property
+    def name(self) -> str:
+        return self.index_name(self.table)
+
+    def index_name(self, table: str) -> str:
+        return f"{table}_{self.suffix}"
+
+    def create_sql(
+        self,
+        table: Optional[str] = None,
+        concurrently: bool = False,
+        only: bool = False,
+    ) -> str:
+        """
+        The ``CREATE INDEX`` statement of the index, or of its index on a partition.
+
+        Parameters:
+            table: the partition, ``None`` for the table itself
+            concurrently: build the index without blocking writes
+            only: create the index of a partitioned table without the indexes of its partitions
+        """
+        table = self.table if table is None else table
+        columns = ", ".join(f'"{column}"' for column in self.columns)
+        return (
+            f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS \"{self.index_name(table)}\" "
+            f"ON {'ONLY ' if only else ''}\"{table}\" USING {self.method} ({columns});"
+        )
+
+
+def managed_indexes(layout: Era5Layout) -> List[IndexSpec]:
+    """
+    The secondary indexes of the tables of a layout.
+    """
+    indexes = [IndexSpec("time_brin", layout.table, "brin", ("time",))]
+    if layout.normalized:
+        indexes += [
+            IndexSpec(
+                "point_id_time_btree", layout.table, "btree", ("point_id", "time")
+            ),
+            IndexSpec("geometry_gist", layout.grid_table, "gist", ("geometry",)),
+        ]
+    else:
+        indexes.append(IndexSpec("geometry_gist", layout.table, "gist", ("geometry",)))
+    return indexes
+
+
+def _autocommit(engine: sqlalchemy.engine.Engine) -> sqlalchemy.engine.Connection:
+    # CONCURRENTLY can not run in a transaction
+    return engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+
+def partitions(conn: sqlalchemy.engine.Connection, table: str) -> List[str]:
+    """
+    The partitions of a partitioned table, an empty list for a table that is not partitioned.
+    """
+    return (
+        conn.execute(
+            text(
+                """
+                SELECT child.relname
+                FROM pg_inherits
+                JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+                JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent
+                WHERE parent.relname = :table AND parent.relkind = 'p'
+                ORDER BY child.relname;
+                """
+            ),
+            table=table,
+        )
+        .scalars()
+        .all()
+    )
+
+
+def _exists(
+    conn: sqlalchemy.engine.Connection, name: str, partitioned: bool = False
+) -> bool:
+    # a concurrent build that failed leaves an invalid index, it is dropped to be built again; the index of
+    # a partitioned table stays invalid until the indexes of all partitions are attached
+    valid = conn.execute(
+        text(
+            """
+            SELECT pg_index.indisvalid
+            FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+            WHERE pg_class.relname = :name AND pg_class.relkind IN ('i', 'I');
+            """
+        ),
+        name=name,
+    ).scalar()
+    if partitioned:
+        return valid is not None
+    if valid is False:
+        logger.warning(f"dropping the invalid index {name!r} of a failed build")
+        conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}";'))
+    return bool(valid)
+
+
+def _attached(conn: sqlalchemy.engine.Connection, name: str) -> List[str]:
+    # the partitions that have an index attached to the index of the partitioned table
+    return (
+        conn.execute(
+            text(
+                """
+                SELECT partition.relname
+                FROM pg_inherits
+                JOIN pg_index ON pg_index.indexrelid = pg_inherits.inhrelid
+                JOIN pg_class AS partition ON partition.oid = pg_index.indrelid
+                WHERE pg_inherits.inhparent = CAST(:name AS regclass);
+                """
+            ),
+            name=f'"{name}"',
+        )
+        .scalars()
+        .all()
+    )
+
+
+def create_indexes(engine: sqlalchemy.engine.Engine, layout: Era5Layout) -> List[str]:
+    """
+    Build the managed indexes that do not exist yet without blocking the queries or the ingestion.
+
+    Parameters:
+        engine: engine of the database
+        layout: layout of the tables
+    Returns:
+        the names of the indexes that were built, including those of the partitions
+    """
+    built = []
+
+    def build(index: IndexSpec, table: str) -> None:
+        tic = time.perf_counter()
+        conn.execute(text(index.create_sql(table=table, concurrently=True)))
+        logger.info(
+            f"index {index.index_name(table)} built in {time.perf_counter() - tic:0.1f} seconds"
+        )
+        built.append(index.index_name(table))
+
+    with _autocommit(engine) as conn:
+        for index in managed_indexes(layout):
+            children = partitions(conn, index.table)
+            if not children:
+                if not _exists(conn, index.name):
+                    build(index, index.table)
+                continue
+            # the index of the partitioned table is invalid until the index of every partition is attached,
+            # postgres builds those of the partitions that are created after it
+            if not _exists(conn, index.name, partitioned=True):
+                conn.execute(text(index.create_sql(only=True)))
+                built.append(index.name)
+            attached = set(_attached(conn, index.name))
+            for child in children:
+                if child in attached:
+                    continue
+                if not _exists(conn, index.index_name(child)):
+                    build(index, child)
+                conn.execute(
+                    text(
+                        f'ALTER INDEX "{index.name}" ATTACH PARTITION "{index.index_name(child)}";'
+                    )
+                )
+    return built
+
+
+def drop_indexes(engine: sqlalchemy.engine.Engine, layout: Era5Layout) -> List[str]:
+    """
+    Drop the managed indexes of the daily table, before a bulk load. The BRIN index on time is kept for the
+    deletes of the load, and the index of the grid table because the grid points are few and the nearest
+    grid point queries need it during the load.
+
+    Returns:
+        the names of the dropped indexes
+    """
+    names = []
+    with _autocommit(engine) as conn:
+        for index in managed_indexes(layout):
+            if index.table != layout.table or index.method == "brin":
+                continue
+            if partitions(conn, index.table):
+                # the index of a partitioned table can not be dropped concurrently, it drops those of the partitions
+                conn.execute(text(f'DROP INDEX IF EXISTS "{index.name}";'))
+            else:
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}";'))
+            names.append(index.name)
+    logger.info(f"indexes {', '.join(names)} dropped for a bulk load")
+    return names
+
+
+def analyze(engine: sqlalchemy.engine.Engine, layout: Era5Layout) -> None:
+    """
+    Update the statistics of the tables of a layout, a partitioned table is analyzed with its partitions.
+    """
+    tables = [layout.table] + ([layout.grid_table] if layout.normalized else [])
+    with _autocommit(engine) as conn:
+        for table in tables:
+            conn.execute(text(f'ANALYZE "{table}";'))
+
+
+def table_rows(engine: sqlalchemy.engine.Engine, table: str) -> int:
+    """
+    The estimated number of rows of a table and its partitions, from the statistics of postgres.
+    """
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(
+                """
+                SELECT COALESCE(SUM(GREATEST(pg_class.reltuples, 0)), 0)
+                FROM pg_partition_tree(CAST(:table AS regclass)) AS tree
+                JOIN pg_class ON pg_class.oid = tree.relid
+                WHERE tree.isleaf;
+                """
+            ),
+            table=f'"{table}"',
+        ).scalar()
+    return int(rows)
+
+
+def is_bulk_load(
+    engine: sqlalchemy.engine.Engine, layout: Era5Layout, rows: int
+) -> bool:
+    """
+    Whether a load of ``rows`` rows is large enough to load without the indexes, see ``BULK_LOAD_FRACTION``.
+    """
+    return rows > 0 and rows >= BULK_LOAD_FRACTION * table_rows(engine, layout.table)
+
+
+@contextlib.contextmanager
+def bulk_load(
+    engine: sqlalchemy.engine.Engine,
+    layout: Era5Layout,
+    rows: int = 0,
+    rebuild: Optional[bool] = None,
+) -> Iterator[bool]:
+    """
+    Manage the indexes around a load: for a bulk load they are dropped before and built concurrently after
+    it, followed by ``ANALYZE``; otherwise the indexes that are missing are built after it. The indexes are
+    also built when the load fails, so the table is never left without them.
+
+    Parameters:
+        engine: engine of the database
+        layout: layout of the tables, they should exist
+        rows: the estimated number of rows of the load
+        rebuild: whether to drop and build the indexes, ``None`` decides with ``is_bulk_load``
+    Returns:
+        whether the indexes were dropped
+    """
+    if rebuild is None:
+        rebuild = is_bulk_load(engine, layout, rows)
+    if rebuild:
+        drop_indexes(engine, layout)
+    try:
+        yield rebuild
+    finally:
+        create_indexes(engine, layout)
+        if rebuild:
+            analyze(engine, layout)
@@ -0,0 +1,466 @@
+"""
+Metrics of the ingestion stages and the queries, exported as JSON lines or a Prometheus textfile
+
+A stage of the ingestion of a file (e.g. the daily aggregation or the COPY) is timed with ``stage``. Within
+``file_stages`` the stages are summed per file and recorded with their rows in and out when the file is
+done; outside it they are only logged. A record also has the peak RSS of the process so far, which covers
+the life of the process and not the stage: it is the memory high-water mark of the ingestion, not the
+memory of a stage or a file. The queries of ``PSQLInterface`` are recorded with their time and number of
+rows, and with ``explain`` also with the plan of ``EXPLAIN (ANALYZE, BUFFERS)``.
+
+Every record is given to the exporters of a ``Metrics``: ``JsonLinesExporter`` appends it to a file and
+``PrometheusExporter`` adds it to counters written for the textfile collector of the node exporter.
+"""
+import contextlib
+import contextvars
+import dataclasses as dc
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """
+    The peak resident set size of the process so far, ``None`` where it is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@dc.dataclass
+class StageMetric:
+    """
+    A stage of the ingestion of a file.
+
+    Parameters:
+        file: the file
+        stage: name of the stage
+        seconds: the wall time of the stage, summed over the bands of the file
+        rows_in: the number of input rows, e.g. hourly cells for the aggregation
+        rows_out: the number of output rows
+        process_peak_rss_bytes: the peak resident set size of the process from its start to the end of the
+            stage, the same for every stage that ends after the peak
+        error: the error when the stage failed
+    """
+
+    file: str
+    stage: str
+    seconds: float = 0.0
+    rows_in: Optional[int] = None
+    rows_out: Optional[int] = None
+    process_peak_rss_bytes: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def rows_per_second(self) -> Optional[float]:
+        rows = self.rows_out if self.rows_out is not None else self.rows_in
+        if rows is None or self.seconds <= 0:
+            return None
+        return rows / self.seconds
+
+
+@dc.dataclass
+class QueryMetric:
+    """
+    A query of ``PSQLInterface``.
+
+    Parameters:
+        query: name of the method
+        seconds: the wall time of the method, including the parsing of the result but not the EXPLAIN
+        rows: the number of rows of the result
+        plans: the output of ``EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)`` of every statement of the query
+        explain_seconds: the wall time of the EXPLAIN statements
+        error: the error when the query failed
+    """
+
+    query: str
+    seconds: float = 0.0
+    rows: Optional[int] = None
+    plans: List[Any] = dc.field(default_factory=list)
+    explain_seconds: float = 0.0
+    error: Optional[str] = None
+
+
+Record = Union[StageMetric, QueryMetric]
+
+
+def record_dict(record: Record) -> Dict[str, Any]:
+    """
+    A record as a JSON serializable dictionary, with its kind and the time it was exported.
+    """
+    kind = "stage" if isinstance(record, StageMetric) else "query"
+    values: Dict[str, Any] = {
+        "kind": kind,
+        "timestamp": time.time(),
+        **dc.asdict(record),
+    }
+    if isinstance(record, StageMetric):
+        values["rows_per_second"] = record.rows_per_second
+    return values
+
+
+class MemoryExporter:
+    """
+    Keeps the records in a list, e.g. to send them from a worker process to the parent.
+    """
+
+    records: List[Record]
+
+    def __init__(self) -> None:
+        self.records = []
+
+    def export(self, record: Record) -> None:
+        self.records.append(record)
+
+    def close(self) -> None:
+        pass
+
+
+class JsonLinesExporter:
+    """
+    Appends every record to a file as a line of JSON.
+    """
+
+    path: str
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, record: Record) -> None:
+        line = json.dumps(record_dict(record), default=str) + "\n"
+        # a single append per record, so the lines of several processes do not interleave
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+
+    def close(self) -> None:
+        pass
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class PrometheusExporter:
+    """
+    Sums the records into counters and writes them in the text format of Prometheus, for the textfile
+    collector of the node exporter. The file is replaced atomically at most once per ``interval`` seconds
+    and when the exporter is closed.
+
+    The counters are labelled by stage and by query only, the records of every file and call are in the
+    JSON lines.
+    """
+
+    path: str
+    prefix: str
+    interval: float
+
+    # name, type and help of every metric
+    METRICS = {
+        "ingest_stage_seconds_total": ("counter", "wall time of the ingestion stages"),
+        "ingest_stage_runs_total": (
+            "counter",
+            "number of files that went through the stages",
+        ),
+        "ingest_stage_errors_total": (
+            "counter",
+            "number of files that failed in the stages",
+        ),
+        "ingest_stage_rows_in_total": ("counter", "input rows of the ingestion stages"),
+        "ingest_stage_rows_out_total": (
+            "counter",
+            "output rows of the ingestion stages",
+        ),
+        "ingest_stage_last_rows_per_second": (
+            "gauge",
+            "rows per second of the last file of the stages",
+        ),
+        "process_peak_rss_bytes": (
+            "gauge",
+            "peak resident set size of the process since it started",
+        ),
+        "query_seconds_total": ("counter", "wall time of the queries"),
+        "query_calls_total": ("counter", "number of queries"),
+        "query_errors_total": ("counter", "number of failed queries"),
+        "query_rows_total": ("counter", "rows returned by the queries"),
+        "query_last_seconds": ("gauge", "wall time of the last query"),
+    }
+
+    def __init__(self, path: str, prefix: str = "era5", interval: float = 15.0) -> None:
+        """
+        Parameters:
+            path: path of the ``.prom`` file
+            prefix: prefix of the names of the metrics
+            interval: the minimum number of seconds between writes of the file
+        """
+        self.path = path
+        self.prefix = prefix
+        self.interval = interval
+        self._values: Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = {
+            name: {} for name in self.METRICS
+        }
+        self._lock = threading.Lock()
+        self._written = 0.0
+
+    def _add(
+        self, name: str, labels: Tuple[Tuple[str, str], ...], value: float
+    ) -> None:
+        self._values[name][labels] = self._values[name].get(labels, 0.0) + value
+
+    def _set(
+        self, name: str, labels: Tuple[Tuple[str, str], ...], value: float
+    ) -> None:
+        self._values[name][labels] = value
+
+    def export(self, record: Record) -> None:
+        with self._lock:
+            if isinstance(record, StageMetric):
+                labels = (("stage", record.stage),)
+                self._add("ingest_stage_seconds_total", labels, record.seconds)
+                self._add("ingest_stage_runs_total", labels, 1)
+                self._add("ingest_stage_errors_total", labels, record.error is not None)
+                self._add("ingest_stage_rows_in_total", labels, record.rows_in or 0)
+                self._add("ingest_stage_rows_out_total", labels, record.rows_out or 0)
+                if record.rows_per_second is not None:
+                    self._set(
+                        "ingest_stage_last_rows_per_second",
+                        labels,
+                        record.rows_per_second,
+                    )
+                if record.process_peak_rss_bytes is not None:
+                    peak = self._values["process_peak_rss_bytes"].get((), 0.0)
+                    self._set(
+                        "process_peak_rss_bytes",
+                        (),
+                        float(max(peak, record.process_peak_rss_bytes)),
+                    )
+            else:
+                labels = (("query", record.query),)
+                self._add("query_seconds_total", labels, record.seconds)
+                self._add("query_calls_total", labels, 1)
+                self._add("query_errors_total", labels, record.error is not None)
+                self._add("query_rows_total", labels, record.rows or 0)
+                self._set("query_last_seconds", labels, record.seconds)
+            if time.monotonic() - self._written >= self.interval:
+                self._write()
+
+    def text(self) -> str:
+        """
+        The metrics in the text format of Prometheus.
+        """
+        lines = []
+        for name, (kind, description) in self.METRICS.items():
+            if not self._values[name]:
+                continue
+            lines.append(f"# HELP {self.prefix}_{name} {description}")
+            lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+            for labels, value in sorted(self._values[name].items()):
+                lines.append(f"{self.prefix}_{name}{_labels(labels)} {value!r}")
+        return "\n".join(lines) + "\n"
+
+    def _write(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        # written under a temporary name and renamed, so the collector never reads a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.text())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._written = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            self._write()
+
+
+class Metrics:
+    """
+    Gives the records of the ingestion and the queries to exporters.
+
+    An exporter has an ``export(record)`` and a ``close()`` method, see ``MemoryExporter``,
+    ``JsonLinesExporter`` and ``PrometheusExporter``. An exporter that fails is logged, it does not fail
+    the ingestion or the query.
+    """
+
+    exporters: List[Any]
+
+    def __init__(self, exporters: Sequence[Any] = ()) -> None:
+        self.exporters = list(exporters)
+
+    def record(self, record: Record) -> None:
+        for exporter in self.exporters:
+            try:
+                exporter.export(record)
+            except Exception:
+                logger.exception(f"could not export the metrics to {exporter!r}")
+
+    def close(self) -> None:
+        for exporter in self.exporters:
+            exporter.close()
+
+
+def exporters(
+    jsonl_path: Optional[str] = None, prometheus_path: Optional[str] = None
+) -> List[Any]:
+    """
+    The exporters of the paths that are given.
+    """
+    result: List[Any] = []
+    if jsonl_path is not None:
+        result.append(JsonLinesExporter(jsonl_path))
+    if prometheus_path is not None:
+        result.append(PrometheusExporter(prometheus_path))
+    return result
+
+
+@dc.dataclass
+class _FileStages:
+    file: str
+    stages: Dict[str, StageMetric] = dc.field(default_factory=dict)
+
+
+# the stages of the file that is ingested in the current thread or task
+_current_file: contextvars.ContextVar = contextvars.ContextVar(
+    "current_file", default=None
+)
+
+
+def _describe(e: BaseException) -> str:
+    return f"{type(e).__name__}: {e}"
+
+
+@contextlib.contextmanager
+def file_stages(metrics: Optional[Metrics], file: str) -> Iterator[None]:
+    """
+    Collect the stages of the ingestion of a file and record them when the file is done, also when it
+    failed. Nothing is recorded when ``metrics`` is ``None``.
+
+    Parameters:
+        metrics: the metrics the stages are recorded to
+        file: the file
+    """
+    if metrics is None:
+        yield
+        return
+    collected = _FileStages(file=file)
+    token = _current_file.set(collected)
+    try:
+        yield
+    finally:
+        _current_file.reset(token)
+        for metric in collected.stages.values():
+            metrics.record(metric)
+
+
+@contextlib.contextmanager
+def stage(name: str, rows_in: Optional[int] = None) -> Iterator[StageMetric]:
+    """
+    Time a stage of the ingestion of the current file, see ``file_stages``. A stage that runs once per
+    band is summed over the bands.
+
+    Parameters:
+        name: name of the stage
+        rows_in: the number of input rows
+    Returns:
+        the metric of this run of the stage, set its ``rows_out`` before the block ends
+    """
+    collected: Optional[_FileStages] = _current_file.get()
+    run = StageMetric(
+        file=collected.file if collected is not None else "",
+        stage=name,
+        rows_in=rows_in,
+    )
+    tic = time.perf_counter()
+    try:
+        yield run
+    except BaseException as e:
+        run.error = _describe(e)
+        raise
+    finally:
+        run.seconds = time.perf_counter() - tic
+        run.process_peak_rss_bytes = peak_rss_bytes()
+        logger.info(
+            f"{run.file + '; ' if run.file else ''}{name} finished in {run.seconds:0.3f} seconds"
+            + (f", {run.rows_out} rows" if run.rows_out is not None else "")
+        )
+        if collected is not None:
+            _add_run(collected, run)
+
+
+def _add_run(collected: _FileStages, run: StageMetric) -> None:
+    metric = collected.stages.get(run.stage)
+    if metric is None:
+        collected.stages[run.stage] = run
+        return
+    metric.seconds += run.seconds
+    if run.rows_in is not None:
+        metric.rows_in = (metric.rows_in or 0) + run.rows_in
+    if run.rows_out is not None:
+        metric.rows_out = (metric.rows_out or 0) + run.rows_out
+    metric.process_peak_rss_bytes = run.process_peak_rss_bytes
+    metric.error = metric.error or run.error
+
+
+# the metric of the query that runs in the current thread or task, for its plans
+_current_query: contextvars.ContextVar = contextvars.ContextVar(
+    "current_query", default=None
+)
+
+
+def current_query() -> Optional[QueryMetric]:
+    return _current_query.get()
+
+
+@contextlib.contextmanager
+def timed_query(
+    metrics: Optional[Metrics], name: str
+) -> Iterator[Optional[QueryMetric]]:
+    """
+    Time a query and record it, set the ``rows`` of the metric before the block ends.
+
+    Parameters:
+        metrics: the metrics the query is recorded to, nothing is recorded when ``None``
+        name: name of the query
+    Returns:
+        the metric of the query, ``None`` when ``metrics`` is ``None`` or when it runs within another query
+    """
+    if metrics is None or _current_query.get() is not None:
+        # a query that calls another one, e.g. through the cache, is recorded once
+        yield None
+        return
+    metric = QueryMetric(query=name)
+    token = _current_query.set(metric)
+    tic = time.perf_counter()
+    try:
+        yield metric
+    except BaseException as e:
+        metric.error = _describe(e)
+        raise
+    finally:
+        metric.seconds = time.perf_counter() - tic - metric.explain_seconds
+        _current_query.reset(token)
+        metrics.record(metric)
@@ -0,0 +1,300 @@
+"""
+The queries of ``src.postgis_era5.psql.PSQLInterface`` on the GeoParquet dataset of ``src.ingestion.parquet``,
+with an embedded DuckDB instead of a database server. Needs the ``duckdb`` extra.
+
+The grid points of a query are found in memory, DuckDB only reads the partitions of the requested years and
+months, the columns of the result and the row groups whose time range overlaps the query. Distances are the
+same as in postgis: planar in degrees for the nearest grid points and on the WGS 84 ellipsoid for a radius.
+"""
+import glob
+import os
+import threading
+from typing import List, Optional, Sequence, Tuple, Union
+
+import duckdb
+import numpy as np
+import pandas as pd
+from pyproj import Geod
+from src.postgis_era5.grid import GridIndex
+from src.postgis_era5.parsing import (
+    DAILY_WEATHER_NORM_COLUMNS,
+    DailyWeather,
+    DailyWeatherNorm,
+    daily_weather_frame,
+    daily_weather_norm_frame,
+    parse_daily_weather,
+    parse_daily_weather_norm,
+)
+from src.postgis_era5.psql import _coordinates
+from src.postgis_era5.queries import HISTORICAL_COLUMNS, baseline_range, month_range
+from src.postgis_era5.table import NORM_COLUMNS
+from src.postgis_era5.types import WGS84Point
+
+WGS84 = Geod(ellps="WGS84")
+
+
+def point_wkt(latitude: float, longitude: float) -> str:
+    """
+    The WKT of a point like ``ST_AsText`` of postgis 3.1 and later, with the shortest decimals that
+    round trip.
+    """
+
+    def number(value: float) -> str:
+        text = np.format_float_positional(value, trim="-")
+        return "0" if text == "-0" else text
+
+    return f"POINT({number(longitude)} {number(latitude)})"
+
+
+class ParquetInterface:
+    """
+    Read only backend with the methods of ``PSQLInterface``, for offline jobs and tests without a database.
+    """
+
+    root: str
+    region: Optional[str]
+
+    def __init__(
+        self, root: str, region: Optional[str] = None, threads: Optional[int] = None
+    ) -> None:
+        """
+        Parameters:
+            root: directory of the GeoParquet dataset
+            region: only query the files of a region, ``None`` queries all regions
+            threads: number of threads of DuckDB, ``None`` uses all cores
+        """
+        self.root = root
+        self.region = region
+        self._connection = duckdb.connect()
+        if threads is not None:
+            self._connection.execute(f"SET threads = {int(threads)}")
+        self._lock = threading.Lock()
+        self._points: Optional[pd.DataFrame] = None
+        self._grid_index: Optional[GridIndex] = None
+
+    def _pattern(self, year: str = "*", month: str = "*") -> str:
+        region = "*" if self.region is None else glob.escape(self.region)
+        return os.path.join(
+            glob.escape(self.root),
+            f"region={region}",
+            f"year={year}",
+            f"month={month}",
+            "*.parquet",
+        )
+
+    def _years(self) -> List[int]:
+        return sorted(
+            {
+                int(path.split(os.sep)[-3][len("year=") :])
+                for path in glob.glob(self._pattern())
+            }
+        )
+
+    def _source(self) -> str:
+        pattern = self._pattern().replace("'", "''")
+        return f"read_parquet('{pattern}', hive_partitioning = true)"
+
+    def _execute(
+        self,
+        sql: str,
+        params: Sequence[object] = (),
+        points: Optional[pd.DataFrame] = None,
+    ) -> Tuple[List[str], List[tuple]]:
+        # a cursor per query, so the interface can be used from several threads
+        cursor = self._connection.cursor()
+        try:
+            if points is not None:
+                cursor.register("points", points)
+            result = cursor.execute(sql, list(params))
+            columns = [column[0] for column in result.description]
+            return columns, result.fetchall()
+        finally:
+            cursor.close()
+
+    def check_connection(self) -> None:
+        _, res = self._execute("SELECT 1;")
+        if res != [(1,)]:
+            raise Exception(
+                f"unexpected value when running the health check, expected [(1,)] but found {repr(res)}, "
+            )
+
+    def points(self, refresh: bool = False) -> pd.DataFrame:
+        """
+        The grid points of the dataset with their WKT, read from the Parquet files on first use.
+
+        Parameters:
+            refresh: read the grid points again, for example after new files were written
+        Returns:
+            the latitude, longitude and geometry of every grid point, sorted by latitude and longitude
+        """
+        with self._lock:
+            if self._points is None or refresh:
+                if self._years():
+                    _, rows = self._execute(
+                        f"SELECT DISTINCT latitude, longitude FROM {self._source()} "
+                        "ORDER BY latitude, longitude"
+                    )
+                else:
+                    rows = []
+                points = pd.DataFrame(
+                    rows, columns=["latitude", "longitude"], dtype=np.float64
+                )
+                points["geometry"] = [
+                    point_wkt(latitude, longitude)
+                    for latitude, longitude in zip(points.latitude, points.longitude)
+                ]
+                self._points = points
+                self._grid_index = GridIndex(
+                    points.latitude.to_numpy(), points.longitude.to_numpy()
+                )
+            return self._points
+
+    def grid_index(self, refresh: bool = False) -> GridIndex:
+        self.points(refresh=refresh)
+        return self._grid_index
+
+    def get_all_unique_points(self) -> List[Tuple[str]]:
+        return [(geometry,) for geometry in self.points().geometry]
+
+    def get_closest_point(self, location: WGS84Point) -> str:
+        return self.get_closest_points([location])[0]
+
+    def get_closest_points(
+        self, locations: Union[Sequence[WGS84Point], np.ndarray]
+    ) -> List[str]:
+        """
+        The nearest grid point of many locations at once, see ``PSQLInterface.get_closest_points``.
+        """
+        latitude, longitude = _coordinates(locations)
+        if len(latitude) == 0:
+            return []
+        points = self.points()
+        return points.geometry.to_numpy()[
+            self.grid_index().nearest(latitude, longitude)
+        ].tolist()
+
+    def _scope(
+        self, location: Optional[WGS84Point], radius: Optional[float], k: Optional[int]
+    ) -> pd.DataFrame:
+        """
+        The grid points a query is restricted to, see ``src.postgis_era5.queries.location_params``.
+        Unlike postgis, ``k`` is supported for every layout.
+        """
+        points = self.points()
+        if location is None:
+            if radius is not None or k is not None:
+                raise ValueError(
+                    "radius and k should only be given together with a location"
+                )
+            return points
+        if radius is not None and k is not None:
+            raise ValueError("give either a radius or k, not both")
+        if len(points) == 0:
+            return points
+        if radius is None:
+            k = 1 if k is None else k
+            if k < 1:
+                raise ValueError(f"k should be a positive number but found {k!r}")
+            distance = np.square(
+                points.latitude.to_numpy() - location.latitude
+            ) + np.square(points.longitude.to_numpy() - location.longitude)
+            return points.iloc[np.sort(np.argsort(distance, kind="stable")[:k])]
+        if radius < 0:
+            raise ValueError(f"radius should not be negative but found {radius!r}")
+        _, _, distance = WGS84.inv(
+            np.full(len(points), location.longitude),
+            np.full(len(points), location.latitude),
+            points.longitude.to_numpy(),
+            points.latitude.to_numpy(),
+        )
+        return points[distance <= radius]
+
+    def retrieve_monthly_norm(
+        self,
+        month: int,
+        year_range: Optional[int] = None,
+        location: Optional[WGS84Point] = None,
+        radius: Optional[float] = None,
+        k: Optional[int] = None,
+        columnar: bool = False,
+    ) -> Union[List[DailyWeatherNorm], pd.DataFrame]:
+        """
+        The average and standard deviation of the daily values of every day of a month, see
+        ``PSQLInterface.retrieve_monthly_norm``.
+        """
+        points = self._scope(location, radius, k)
+        years = self._years()
+        where, params = "daily.month = ?", [month]
+        if year_range is not None and years:
+            start, end = baseline_range(years[-1], year_range)
+            where += " AND daily.year >= ? AND daily.year < ? AND daily.time >= ? AND daily.time < ?"
+            params += [start.year, end.year, start, end]
+        if not years or len(points) == 0:
+            columns, res = list(DAILY_WEATHER_NORM_COLUMNS), []
+        else:
+            aggregates = ",\n".join(
+                f'AVG(daily."{column}") AS "{name}_avg",\n'
+                f'STDDEV_SAMP(daily."{column}") AS "{name}_stdev"'
+                for name, column in NORM_COLUMNS.items()
+            )
+            columns, res = self._execute(
+                f"""
+                SELECT
+                points.geometry AS "geometry",
+                CAST(EXTRACT(DAY FROM daily.time) AS INTEGER) AS "day",
+                CAST(daily.month AS INTEGER) AS "month",
+                {aggregates}
+                FROM {self._source()} AS daily
+                JOIN points ON points.latitude = daily.latitude AND points.longitude = daily.longitude
+                WHERE {where}
+                GROUP BY points.latitude, points.longitude, points.geometry, EXTRACT(DAY FROM daily.time), daily.month
+                ORDER BY points.latitude, points.longitude, "day";
+                """,
+                params,
+                points=points,
+            )
+        if columnar:
+            return daily_weather_norm_frame(res, columns=columns)
+        return parse_daily_weather_norm([dict(zip(columns, row)) for row in res])
+
+    def retrieve_monthly_historical_observations(
+        self,
+        month: int,
+        year: int,
+        location: Optional[WGS84Point] = None,
+        radius: Optional[float] = None,
+        k: Optional[int] = None,
+        columnar: bool = False,
+    ) -> Union[List[DailyWeather], pd.DataFrame]:
+        """
+        The daily values of a month, see ``PSQLInterface.retrieve_monthly_historical_observations``.
+        """
+        points = self._scope(location, radius, k)
+        start, end = month_range(month, year)
+        if year not in self._years() or len(points) == 0:
+            columns, res = HISTORICAL_COLUMNS + ["geometry"], []
+        else:
+            values = ",\n".join(
+                'CAST(daily.time AS TIMESTAMP) AS "time"'
+                if column == "time"
+                else f'daily."{column}"'
+                for column in HISTORICAL_COLUMNS
+            )
+            # the partitions of other months are pruned, the time range skips the row groups outside it
+            columns, res = self._execute(
+                f"""
+                SELECT
+                {values},
+                points.geometry AS "geometry"
+                FROM {self._source()} AS daily
+                JOIN points ON points.latitude = daily.latitude AND points.longitude = daily.longitude
+                WHERE daily.year = ? AND daily.month = ?
+                AND daily.time >= ? AND daily.time < ?
+                ORDER BY points.latitude, points.longitude, daily.time;
+                """,
+                [year, month, start, end],
+                points=points,
+            )
+        if columnar:
+            return daily_weather_frame(res, columns=columns)
+        return parse_daily_weather([dict(zip(columns, row)) for row in res])
@@ -1,7 +1,9 @@
 import dataclasses as dc
 import datetime
-from typing import List, Mapping
+from typing import List, Mapping, Sequence
 
+import numpy as np
+import pandas as pd
 from src.postgis_era5.types import WGS84Point
 
 
@@ -14,8 +16,76 @@ daily_mean wind
 gdd
 """
 
+# the query result column of every field of DailyWeather, in the order of the fields
+DAILY_WEATHER_COLUMNS = {
+    "time": "date",
+    "geometry": "location",
+    "t2m_min": "temperature_min",
+    "t2m_mean": "temperature_mean",
+    "t2m_max": "temperature_max",
+    "stl1_min": "soil_temperature_1m_min",
+    "stl1_mean": "soil_temperature_1m_mean",
+    "stl1_max": "soil_temperature_1m_max",
+    "d2m_min": "dewpoint_temperature_min",
+    "d2m_mean": "dewpoint_temperature_mean",
+    "d2m_max": "dewpoint_temperature_max",
+    "ws_2m_mean": "wind_mean",
+    "ws_2m_max": "wind_max",
+    "daily_pet_mean": "pet_mean",
+    "gdd": "gdd",
+    "nr": "net_radiation",
+    "ssr_max": "surface_net_solar_radiation",
+    "str_min": "surface_net_thermal_radiation",
+    "tp_sum": "total_precipitation_sum",
+}
+
+# the query result column of every field of DailyWeatherNorm, in the order of the fields
+DAILY_WEATHER_NORM_COLUMNS = {
+    "month": "month",
+    "day": "day",
+    "geometry": "location",
+    "t2m_min_avg": "temperature_min_avg",
+    "t2m_min_stdev": "temperature_min_stdev",
+    "t2m_mean_avg": "temperature_mean_avg",
+    "t2m_mean_stdev": "temperature_mean_stdev",
+    "t2m_max_avg": "temperature_max_avg",
+    "t2m_max_stdev": "temperature_max_stdev",
+    "stl1_min_avg": "soil_temperature_1m_min_avg",
+    "stl1_min_stdev": "soil_temperature_1m_min_stdev",
+    "stl1_mean_avg": "soil_temperature_1m_mean_avg",
+    "stl1_mean_stdev": "soil_temperature_1m_mean_stdev",
+    "stl1_max_avg": "soil_temperature_1m_max_avg",
+    "stl1_max_stdev": "soil_temperature_1m_max_stdev",
+    "d2m_min_avg": "dewpoint_temperature_min_avg",
+    "d2m_min_stdev": "dewpoint_temperature_min_stdev",
+    "d2m_mean_avg": "dewpoint_temperature_mean_avg",
+    "d2m_mean_stdev": "dewpoint_temperature_mean_stdev",
+    "d2m_max_avg": "dewpoint_temperature_max_avg",
+    "d2m_max_stdev": "dewpoint_temperature_max_stdev",
+    "ws_2m_mean_avg": "wind_mean_avg",
+    "ws_2m_mean_stdev": "wind_mean_stdev",
+    "ws_2m_max_avg": "wind_max_avg",
+    "ws_2m_max_stdev": "wind_max_stdev",
+    "daily_pet_mean_avg": "pet_mean_avg",
+    "daily_pet_mean_stdev": "pet_mean_stdev",
+    "gdd_avg": "gdd_avg",
+    "gdd_stdev": "gdd_stdev",
+    "nr_avg": "net_radiation_avg",
+    "nr_stdev": "net_radiation_stdev",
+    "ssr_avg": "surface_net_solar_radiation_avg",
+    "ssr_stdev": "surface_net_solar_radiation_stdev",
+    "str_avg": "surface_net_thermal_radiation_avg",
+    "str_stdev": "surface_net_thermal_radiation_stdev",
+    "tp_avg": "total_precipitation_sum_avg",
+    "tp_stdev": "total_precipitation_sum_stdev",
+}
+
+
 @dc.dataclass
 class DailyWeatherNorm:
+    # slots make the instances several times smaller, there is no dataclass(slots=True) before python 3.10
+    __slots__ = tuple(DAILY_WEATHER_NORM_COLUMNS.values())
+
     month: int
     day: int
     location: WGS84Point
@@ -57,6 +127,8 @@ class DailyWeatherNorm:
 
 @dc.dataclass
 class DailyWeather:
+    __slots__ = tuple(DAILY_WEATHER_COLUMNS.values())
+
     date: datetime.date
     location: WGS84Point
     temperature_min: float
@@ -150,3 +222,55 @@ def parse_daily_weather(rows: Mapping[str, object]) -> List[DailyWeather]:
         for row in rows
     ]
     return daily_weather
+
+
+def _frame(
+    rows: Sequence[Sequence[object]], columns: Sequence[str], fields: Mapping[str, str]
+) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(rows, columns=list(columns), coerce_float=True)
+    df = df.rename(columns=fields)[list(fields.values())]
+    values = [
+        column
+        for column in df.columns
+        if column not in ("date", "month", "day", "location")
+    ]
+    df[values] = df[values].astype(np.float64)
+    return df
+
+
+def daily_weather_frame(
+    rows: Sequence[Sequence[object]], columns: Sequence[str]
+) -> pd.DataFrame:
+    """
+    The columnar counterpart of ``parse_daily_weather``, with a column per field of ``DailyWeather``.
+
+    Building a dataframe from the rows of the cursor avoids creating a Python object per row, which
+    makes it several times faster and smaller for large results.
+
+    Parameters:
+        rows: the rows of a historical observations query
+        columns: the names of the columns of the rows
+    Returns:
+        the daily values with a row per grid point and day, ``date`` is a datetime64 column
+    """
+    df = _frame(rows, columns, DAILY_WEATHER_COLUMNS)
+    df["date"] = pd.to_datetime(df["date"]).dt.normalize()
+    return df
+
+
+def daily_weather_norm_frame(
+    rows: Sequence[Sequence[object]], columns: Sequence[str]
+) -> pd.DataFrame:
+    """
+    The columnar counterpart of ``parse_daily_weather_norm``, with a column per field of
+    ``DailyWeatherNorm``, see ``daily_weather_frame``.
+
+    Parameters:
+        rows: the rows of a norm query
+        columns: the names of the columns of the rows
+    Returns:
+        the norms with a row per grid point and day
+    """
+    df = _frame(rows, columns, DAILY_WEATHER_NORM_COLUMNS)
+    df[["month", "day"]] = df[["month", "day"]].astype(np.int64)
+    return df
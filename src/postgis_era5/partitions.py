@@ -0,0 +1,71 @@
+"""
+Yearly partitions of the daily table of a partitioned ``src.postgis_era5.table.Era5Layout``
+"""
+from typing import Iterable, List
+
+import sqlalchemy
+from sqlalchemy.sql import text
+from src.postgis_era5.cache import bump_dataset_version
+from src.postgis_era5.table import Era5Layout
+
+
+def partition_name(layout: Era5Layout, year: int) -> str:
+    return f"{layout.table}_{year}"
+
+
+def partition_sql(layout: Era5Layout, year: int) -> str:
+    """
+    The ``CREATE TABLE`` statement of the partition of a year, from January 1 up to January 1 of the next year.
+    """
+    return (
+        f'CREATE TABLE IF NOT EXISTS "{partition_name(layout, year)}" PARTITION OF "{layout.table}" '
+        f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01');"
+    )
+
+
+def ensure_partitions(
+    conn: sqlalchemy.engine.Connection, layout: Era5Layout, years: Iterable[int]
+) -> List[str]:
+    """
+    Create the yearly partitions that do not exist yet.
+
+    Creating a partition locks the daily table, so this should run in its own short transaction and
+    not in the transaction that loads the data. An advisory lock per partition keeps parallel
+    ingestions from creating the same partition at the same time.
+
+    Parameters:
+        conn: connection to the database
+        layout: a partitioned layout
+        years: the years that need a partition
+    Returns:
+        the names of the partitions
+    """
+    if not layout.partitioned:
+        raise ValueError(f"layout of {layout.table!r} is not partitioned")
+    names = []
+    for year in sorted(set(years)):
+        name = partition_name(layout, year)
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name));"), name=name)
+        conn.execute(text(partition_sql(layout, year)))
+        names.append(name)
+    return names
+
+
+def detach_partition(
+    conn: sqlalchemy.engine.Connection, layout: Era5Layout, year: int
+) -> str:
+    """
+    Detach the partition of a year from the daily table. The partition becomes a normal table that can
+    be archived, moved to another tablespace or dropped; queries on the daily table no longer see it.
+
+    Parameters:
+        conn: connection to the database
+        layout: a partitioned layout
+        year: the year of the partition
+    Returns:
+        the name of the detached table
+    """
+    name = partition_name(layout, year)
+    conn.execute(text(f'ALTER TABLE "{layout.table}" DETACH PARTITION "{name}";'))
+    bump_dataset_version(conn, layout)
+    return name
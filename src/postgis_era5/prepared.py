@@ -0,0 +1,68 @@
+"""
+Server side prepared statements for the queries of the PSQLInterface
+
+psycopg2 sends every statement as text, so postgres parses and plans it on every call. A statement
+that is prepared once per connection with ``PREPARE`` is parsed once, and after a few executions
+postgres can reuse a generic plan.
+"""
+import functools
+import hashlib
+import re
+from typing import Tuple
+
+import sqlalchemy
+from sqlalchemy.sql import text
+from sqlalchemy.sql.elements import TextClause
+
+# a :name parameter of a text query, but not a ::type cast
+PARAMETER = re.compile(r"(?<![:\w]):([A-Za-z_]\w*)")
+
+# the key of the names of the statements prepared on a connection, in the info of its pool record
+PREPARED_STATEMENTS = "postgis_era5_prepared_statements"
+
+
+@functools.lru_cache(maxsize=256)
+def prepare_statement(sql: str) -> Tuple[str, str, Tuple[str, ...]]:
+    """
+    Turn a text query into a ``PREPARE`` statement.
+
+    Parameters:
+        sql: the query with ``:name`` parameters
+    Returns:
+        the name of the statement, the ``PREPARE`` statement and the names of the parameters in the
+        order of their ``$n`` placeholders
+    """
+    names = []
+
+    def placeholder(match: "re.Match") -> str:
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return f"${names.index(match.group(1)) + 1}"
+
+    body = PARAMETER.sub(placeholder, sql.strip().rstrip(";"))
+    name = f"era5_{hashlib.sha1(sql.encode()).hexdigest()[:16]}"
+    return name, f"PREPARE {name} AS {body}", tuple(names)
+
+
+def execute_prepared(
+    conn: sqlalchemy.engine.Connection, query: TextClause, **params
+) -> sqlalchemy.engine.CursorResult:
+    """
+    Execute a text query as a prepared statement, it is prepared on the first execution per connection.
+
+    Parameters:
+        conn: connection to the database
+        query: the query
+        params: the values of the parameters of the query
+    Returns:
+        the result of the query
+    """
+    name, prepare, names = prepare_statement(query.text)
+    prepared = conn.connection.info.setdefault(PREPARED_STATEMENTS, set())
+    if name not in prepared:
+        conn.exec_driver_sql(prepare)
+        prepared.add(name)
+    arguments = (
+        f"({', '.join(f':{parameter}' for parameter in names)})" if names else ""
+    )
+    return conn.execute(text(f"EXECUTE {name}{arguments}"), **params)
@@ -1,23 +1,163 @@
-from typing import List
+import datetime
+import functools
+import inspect
+import time
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple, TypeVar, Union
 
+import numpy as np
+import pandas as pd
 import sqlalchemy
-from psycopg2 import sql
 from sqlalchemy.sql import text
+from sqlalchemy.sql.elements import TextClause
+from src.postgis_era5.cache import MISSING, QueryCache, dataset_version
+from src.postgis_era5.grid import GridIndex
+from src.postgis_era5.metrics import Metrics, QueryMetric, current_query, timed_query
+from src.postgis_era5.prepared import execute_prepared
 from src.postgis_era5.parsing import (
+    DAILY_WEATHER_NORM_COLUMNS,
     DailyWeather,
     DailyWeatherNorm,
+    daily_weather_frame,
+    daily_weather_norm_frame,
     parse_daily_weather,
     parse_daily_weather_norm,
 )
+from src.postgis_era5.queries import (
+    baseline_range,
+    climatology_norm_query,
+    closest_point_query,
+    closest_points_query,
+    grid_points_query,
+    historical_observations_query,
+    last_year_query,
+    location_params,
+    month_range,
+    monthly_norm_query,
+    unique_points_query,
+)
+from src.postgis_era5.table import Era5Layout
 from src.postgis_era5.types import WGS84Point
 
 
+def _coordinates(
+    locations: Union[Sequence[WGS84Point], np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray]:
+    if isinstance(locations, np.ndarray):
+        if locations.ndim != 2 or locations.shape[1] != 2:
+            raise ValueError(
+                f"locations should be an array of (latitude, longitude) rows but found shape {locations.shape}"
+            )
+        return locations[:, 0].astype(np.float64), locations[:, 1].astype(np.float64)
+    latitude = np.array([location.latitude for location in locations], dtype=np.float64)
+    longitude = np.array(
+        [location.longitude for location in locations], dtype=np.float64
+    )
+    return latitude, longitude
+
+
+F = TypeVar("F", bound=Callable)
+
+
+def _cached(method: F) -> F:
+    """
+    Serve the results of a method from the cache of the interface, keyed by the method and its arguments.
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self: "PSQLInterface", *args, **kwargs):
+        if self.cache is None:
+            return method(self, *args, **kwargs)
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        key = (self.layout, method.__name__, *list(bound.arguments.items())[1:])
+        version = self.dataset_version()
+        value = self.cache.get(version, key, namespace=self.layout.table)
+        if value is MISSING:
+            value = method(self, *args, **kwargs)
+            self.cache.put(version, key, value, namespace=self.layout.table)
+        return value
+
+    return wrapper
+
+
+def _result_rows(value: object) -> Optional[int]:
+    if isinstance(value, str):
+        return 1
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+def _instrumented(method: F) -> F:
+    """
+    Record the time and the number of rows of a method to the metrics of the interface, a cached
+    result is recorded like a result from the database.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self: "PSQLInterface", *args, **kwargs):
+        with timed_query(self.metrics, method.__name__) as metric:
+            value = method(self, *args, **kwargs)
+            if metric is not None:
+                metric.rows = _result_rows(value)
+        return value
+
+    return wrapper
+
+
 class PSQLInterface:
 
     engine: sqlalchemy.engine.base.Engine
+    layout: Era5Layout
+    cache: Optional[QueryCache]
+    version_ttl: float
+    prepared: bool
+    metrics: Optional[Metrics]
+    explain: bool
+    _version: Optional[Tuple[int, float]]
+    _grid_index: Optional[GridIndex]
+    _grid_labels: Optional[np.ndarray]
 
-    def __init__(self, engine: sqlalchemy.engine.base.Engine) -> None:
+    def __init__(
+        self,
+        engine: sqlalchemy.engine.base.Engine,
+        layout: Era5Layout = Era5Layout(),
+        cache: Optional[QueryCache] = None,
+        version_ttl: float = 60.0,
+        prepared: bool = False,
+        metrics: Optional[Metrics] = None,
+        explain: bool = False,
+    ) -> None:
+        """
+        Parameters:
+            engine: engine of the database
+            layout: layout of the tables
+            cache: cache of the query results, ``None`` sends every query to the database. Cached results
+                are shared between callers and should not be modified.
+            version_ttl: the number of seconds the dataset version is trusted before it is read again,
+                so results may be served up to this long after an ingestion finished
+            prepared: run the hot queries as server side prepared statements, see
+                ``src.postgis_era5.prepared``. Only turn this on with direct connections to postgres,
+                a connection pooler in transaction mode like pgbouncer can run the next query on a
+                server connection the statement was not prepared on.
+            metrics: records the time and the number of rows of every query, see
+                ``src.postgis_era5.metrics``
+            explain: also record the plans of ``EXPLAIN (ANALYZE, BUFFERS)``. The statements of a query
+                then run twice, first under EXPLAIN, so this is meant for diagnosis; the time of the
+                EXPLAIN is not part of the recorded time but the query itself finds a warm cache.
+        """
         self.engine = engine
+        self.layout = layout
+        self.cache = cache
+        self.version_ttl = version_ttl
+        self.prepared = prepared
+        self.metrics = metrics
+        self.explain = explain
+        self._version = None
+        self._grid_index = None
+        self._grid_labels = None
 
     def check_connection(self) -> None:
         with self.engine.connect() as conn:
@@ -31,129 +171,282 @@ class PSQLInterface:
                     f"unexpected value when running the health check, expected [(1,)] but found {repr(res)}, "
                 )
 
+    def dataset_version(self) -> int:
+        """
+        The version of the data, read from the database at most once per ``version_ttl`` seconds.
+
+        Returns:
+            the version, see ``src.postgis_era5.cache.bump_dataset_version``
+        """
+        now = time.monotonic()
+        if self._version is None or now - self._version[1] >= self.version_ttl:
+            with self.engine.connect() as conn:
+                self._version = (dataset_version(conn, self.layout), now)
+        return self._version[0]
+
+    def _explain(
+        self, conn: sqlalchemy.engine.Connection, query: TextClause, **params
+    ) -> None:
+        # the plan of a statement of the query that is recorded in this thread
+        metric = current_query()
+        if not self.explain or metric is None:
+            return
+        tic = time.perf_counter()
+        plan = conn.execute(
+            text(
+                f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query.text.strip().rstrip(';')}"
+            ),
+            **params,
+        ).scalar()
+        metric.plans.append(plan)
+        metric.explain_seconds += time.perf_counter() - tic
+
+    def _execute(
+        self, conn: sqlalchemy.engine.Connection, query: TextClause, **params
+    ) -> sqlalchemy.engine.CursorResult:
+        self._explain(conn, query, **params)
+        if self.prepared:
+            return execute_prepared(conn, query, **params)
+        return conn.execute(query, **params)
+
+    @_instrumented
+    @_cached
     def get_all_unique_points(self) -> List[str]:
         with self.engine.connect() as conn:
-            res = conn.execute(
-                """
-                SELECT ST_AsText(geometry)
-                FROM era5_ecuador
-                GROUP BY geometry;
-                """
-            ).fetchall()
+            self._explain(conn, unique_points_query(self.layout))
+            res = conn.execute(unique_points_query(self.layout)).fetchall()
         return res
 
+    @_instrumented
+    @_cached
     def get_closest_point(self, location: WGS84Point) -> str:
         # TODO(Jeffrey Tsang) this only works for point. Not yet tested for other types of geometry for behaviour. See also https://postgis.net/workshops/postgis-intro/knn.html
         wkt_text = f"SRID=4326;POINT({location.longitude} {location.latitude})"
-        query = text(
-            """
-            SELECT ST_AsText(geometry) FROM era5_ecuador
-            ORDER BY geometry::geometry <-> ST_GeomFromText(:wkt)::geometry
-            LIMIT 1;
-            """
-        )
         with self.engine.connect() as conn:
-            res = conn.execute(query, wkt=wkt_text).fetchall()
+            res = self._execute(
+                conn, closest_point_query(self.layout), wkt=wkt_text
+            ).fetchall()
         return res[0]["st_astext"]
 
+    @_instrumented
+    def grid_index(self, refresh: bool = False) -> GridIndex:
+        """
+        The in memory index of the grid points, loaded from the database on first use.
+
+        Parameters:
+            refresh: load the grid points again, for example after ingesting a new region
+        Returns:
+            the index
+        """
+        if self._grid_index is None or refresh:
+            with self.engine.connect() as conn:
+                self._explain(conn, grid_points_query(self.layout))
+                res = conn.execute(grid_points_query(self.layout)).fetchall()
+            self._grid_index = GridIndex(
+                latitude=np.array([row["latitude"] for row in res], dtype=np.float64),
+                longitude=np.array([row["longitude"] for row in res], dtype=np.float64),
+            )
+            self._grid_labels = np.array([row["geometry"] for row in res], dtype=object)
+        return self._grid_index
+
+    @_instrumented
+    def get_closest_points(
+        self,
+        locations: Union[Sequence[WGS84Point], np.ndarray],
+        in_memory: bool = False,
+    ) -> List[str]:
+        """
+        The nearest grid point of many locations at once, see ``get_closest_point``.
+
+        Parameters:
+            locations: the locations, or an array with a (latitude, longitude) row per location
+            in_memory: snap the locations to the grid in memory with ``grid_index`` instead of a KNN
+                search per location in the database, which is faster when the index is reused
+        Returns:
+            the WKT of the nearest grid point of every location, in the order of the locations
+        """
+        latitude, longitude = _coordinates(locations)
+        if len(latitude) == 0:
+            return []
+        if in_memory:
+            nearest = self.grid_index().nearest(latitude, longitude)
+            return self._grid_labels[nearest].tolist()
+        with self.engine.connect() as conn:
+            res = self._execute(
+                conn,
+                closest_points_query(self.layout),
+                latitudes=latitude.tolist(),
+                longitudes=longitude.tolist(),
+            ).fetchall()
+        return [row["geometry"] for row in res]
+
+    @_instrumented
+    @_cached
     def retrieve_monthly_norm(
-        self, month: int, year_range: int = 10
-    ) -> List[DailyWeatherNorm]:
-
-        # closest_point = self.get_closest_point(location=location)
-        # closest_point = f"SRID=4326;{closest_point}"
-        query = text(
-            """
-            SELECT 
-            ST_AsText(geometry) AS "geometry",
-            EXTRACT(DAY FROM time) AS "day",
-            EXTRACT(MONTH FROM time) AS "month",
-            AVG(t2m_min) AS "t2m_min_avg", 
-            STDDEV(t2m_min) AS "t2m_min_stdev", 
-            AVG(t2m_mean) AS "t2m_mean_avg",
-            STDDEV(t2m_mean) AS "t2m_mean_stdev", 
-            AVG(t2m_max) AS "t2m_max_avg",
-            STDDEV(t2m_max) AS "t2m_max_stdev", 
-            AVG(stl1_min) AS "stl1_min_avg", 
-            STDDEV(stl1_min) AS "stl1_min_stdev", 
-            AVG(stl1_mean) AS "stl1_mean_avg",
-            STDDEV(stl1_mean) AS "stl1_mean_stdev", 
-            AVG(stl1_max) AS "stl1_max_avg",
-            STDDEV(stl1_max) AS "stl1_max_stdev",
-            AVG(d2m_min) AS "d2m_min_avg", 
-            STDDEV(d2m_min) AS "d2m_min_stdev", 
-            AVG(d2m_mean) AS "d2m_mean_avg",
-            STDDEV(d2m_mean) AS "d2m_mean_stdev", 
-            AVG(d2m_max) AS "d2m_max_avg",
-            STDDEV(d2m_max) AS "d2m_max_stdev",
-            AVG(ws_2m_mean) AS "ws_2m_mean_avg",
-            STDDEV(ws_2m_mean) AS "ws_2m_mean_stdev", 
-            AVG(ws_2m_max) AS "ws_2m_max_avg",
-            STDDEV(ws_2m_max) AS "ws_2m_max_stdev",
-            AVG(daily_pet_mean) AS "daily_pet_mean_avg",
-            STDDEV(daily_pet_mean) AS "daily_pet_mean_stdev",
-            AVG(gdd) AS "gdd_avg",
-            STDDEV(gdd) AS "gdd_stdev",
-            AVG(nr) AS "nr_avg",
-            STDDEV(nr) AS "nr_stdev",
-            AVG(ssr_max) AS "ssr_avg",
-            STDDEV(ssr_max) AS "ssr_stdev",
-            AVG(str_min) AS "str_avg",
-            STDDEV(str_min) AS "str_stdev",
-            AVG(tp_sum) AS "tp_avg",
-            STDDEV(tp_sum) AS "tp_stdev"
-            FROM era5_ecuador 
-            WHERE EXTRACT(MONTH FROM time) = :month  
-            GROUP BY EXTRACT(DAY FROM time), EXTRACT(MONTH FROM time),  geometry;
-            """
-            # AND ST_DWithin(geometry, :closest_geo, 0)
-        )
+        self,
+        month: int,
+        year_range: Optional[int] = None,
+        location: Optional[WGS84Point] = None,
+        radius: Optional[float] = None,
+        k: Optional[int] = None,
+        columnar: bool = False,
+    ) -> Union[List[DailyWeatherNorm], pd.DataFrame]:
+        """
+        The average and standard deviation of the daily values of every day of a month.
+
+        Parameters:
+            month: the month
+            year_range: the number of years up to the last ingested year the norm is computed over,
+                ``None`` uses all years and is read from the climatology table when the layout has one
+            location: only return the grid points near this location, see ``radius`` and ``k``
+            radius: return the grid points within this many meters of ``location``
+            k: return the ``k`` grid points nearest to ``location``, the default when no radius is given
+                is the nearest grid point
+            columnar: return a dataframe with a column per field of ``DailyWeatherNorm`` instead of a
+                dataclass per row, which is much faster and smaller for large results
+        Returns:
+            the norms per grid point and day
+        """
+        scope, params = location_params(self.layout, location, radius=radius, k=k)
         with self.engine.connect() as conn:
-            res = conn.execute(query, month=month).fetchall()
+            if year_range is None and self.layout.climatology:
+                result = self._execute(
+                    conn,
+                    climatology_norm_query(self.layout, scope),
+                    month=month,
+                    **params,
+                )
+            elif year_range is None:
+                result = self._execute(
+                    conn,
+                    monthly_norm_query(self.layout, scope=scope),
+                    month=month,
+                    **params,
+                )
+            else:
+                self._explain(conn, last_year_query(self.layout))
+                last_year = conn.execute(last_year_query(self.layout)).scalar()
+                if last_year is None:
+                    if columnar:
+                        return daily_weather_norm_frame(
+                            [], columns=DAILY_WEATHER_NORM_COLUMNS
+                        )
+                    return []
+                start, end = baseline_range(last_year, year_range)
+                result = self._execute(
+                    conn,
+                    monthly_norm_query(self.layout, windowed=True, scope=scope),
+                    month=month,
+                    start=start,
+                    end=end,
+                    **params,
+                )
+            res = result.fetchall()
+        if columnar:
+            return daily_weather_norm_frame(res, columns=result.keys())
         return parse_daily_weather_norm(res)
 
+    @_instrumented
+    @_cached
     def retrieve_monthly_historical_observations(
         self,
         month: int,
         year: int,
-    ) -> List[DailyWeather]:
-        # closest_point = self.get_closest_point(location=location)
-        # closest_point = f"SRID=4326;{closest_point}"
-        query = text(
-            """
-            SELECT 
-            time,
-            d2m_min,
-            d2m_mean,
-            d2m_max,
-            t2m_min,
-            t2m_mean,
-            t2m_max,
-            stl1_min,
-            stl1_mean,
-            stl1_max,
-            ssr_max,
-            str_min,
-            sp_mean,
-            tp_sum,
-            ws_2m_mean,
-            ws_2m_max,
-            rh_min,
-            rh_mean,
-            rh_max,
-            "G_min",
-            "G_mean",
-            "G_max",
-            nr,
-            gdd,
-            daily_pet_mean,
-            ST_AsText(geometry) AS "geometry"
-            FROM era5_ecuador
-            WHERE EXTRACT(MONTH FROM time) = :y 
-            AND EXTRACT(YEAR FROM time) = :z;
-            """
-            # WHERE ST_DWithin(geometry, :closest_geo, 0)
-        )
+        location: Optional[WGS84Point] = None,
+        radius: Optional[float] = None,
+        k: Optional[int] = None,
+        columnar: bool = False,
+    ) -> Union[List[DailyWeather], pd.DataFrame]:
+        """
+        The daily values of a month.
+
+        Parameters:
+            month: the month
+            year: the year
+            location: only return the grid points near this location, see ``radius`` and ``k``
+            radius: return the grid points within this many meters of ``location``
+            k: return the ``k`` grid points nearest to ``location``, the default when no radius is given
+                is the nearest grid point
+            columnar: return a dataframe with a column per field of ``DailyWeather`` instead of a
+                dataclass per row, which is much faster and smaller for large results
+        Returns:
+            the daily values per grid point and day
+        """
+        scope, params = location_params(self.layout, location, radius=radius, k=k)
+        start, end = month_range(month, year)
         with self.engine.connect() as conn:
-            res = conn.execute(query, y=month, z=year).fetchall()
+            result = self._execute(
+                conn,
+                historical_observations_query(self.layout, scope),
+                start=start,
+                end=end,
+                **params,
+            )
+            res = result.fetchall()
+        if columnar:
+            return daily_weather_frame(res, columns=result.keys())
         return parse_daily_weather(res)
+
+    def stream_historical_observations(
+        self,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        location: Optional[WGS84Point] = None,
+        radius: Optional[float] = None,
+        k: Optional[int] = None,
+        batch_size: int = 10_000,
+        columnar: bool = False,
+    ) -> Iterator[Union[List[DailyWeather], pd.DataFrame]]:
+        """
+        The daily values of a period in batches, read with a server side cursor.
+
+        Unlike ``retrieve_monthly_historical_observations`` only a batch of rows is in memory at a time,
+        so a long period or a large region can be exported in constant memory. The connection stays
+        open until the generator is exhausted or closed. The recorded time of the query runs until then
+        too, and no plan is recorded for it.
+
+        Parameters:
+            start: the first moment of the period
+            end: the first moment after the period
+            location: only return the grid points near this location, see ``radius`` and ``k``
+            radius: return the grid points within this many meters of ``location``
+            k: return the ``k`` grid points nearest to ``location``, the default when no radius is given
+                is the nearest grid point
+            batch_size: the number of rows per batch
+            columnar: yield dataframes with a column per field of ``DailyWeather`` instead of lists of
+                dataclasses
+        Returns:
+            the daily values per grid point and day, in batches of at most ``batch_size`` rows
+        """
+        if batch_size < 1:
+            raise ValueError(
+                f"batch_size should be a positive number but found {batch_size!r}"
+            )
+        scope, params = location_params(self.layout, location, radius=radius, k=k)
+        # recorded without ``timed_query``, the context of a generator is the context of its consumer
+        metric = QueryMetric(query="stream_historical_observations", rows=0)
+        tic = time.perf_counter()
+        try:
+            with self.engine.connect() as conn:
+                result = conn.execution_options(
+                    stream_results=True, max_row_buffer=batch_size
+                ).execute(
+                    historical_observations_query(self.layout, scope),
+                    start=start,
+                    end=end,
+                    **params,
+                )
+                columns = result.keys()
+                for rows in result.partitions(batch_size):
+                    metric.rows += len(rows)
+                    if columnar:
+                        yield daily_weather_frame(rows, columns=columns)
+                    else:
+                        yield parse_daily_weather(rows)
+        except Exception as e:
+            metric.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            metric.seconds = time.perf_counter() - tic
+            if self.metrics is not None:
+                self.metrics.record(metric)
@@ -0,0 +1,414 @@
+"""
+The SQL of the PSQLInterface queries for the layouts of ``src.postgis_era5.table.Era5Layout``
+"""
+import datetime
+import math
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.sql import text
+from sqlalchemy.sql.elements import TextClause
+from src.postgis_era5.storage import decoded
+from src.postgis_era5.table import DAILY_VALUE_COLUMNS, NORM_COLUMNS, Era5Layout
+from src.postgis_era5.types import WGS84Point
+
+# the spatial restrictions of the queries, see ``location_params``
+NEAREST = "nearest"
+WITHIN = "within"
+
+# the length of a degree of latitude at the equator, the shortest on the WGS 84 ellipsoid
+METERS_PER_DEGREE = 110_574.0
+
+HISTORICAL_COLUMNS = [
+    "time",
+    "d2m_min",
+    "d2m_mean",
+    "d2m_max",
+    "t2m_min",
+    "t2m_mean",
+    "t2m_max",
+    "stl1_min",
+    "stl1_mean",
+    "stl1_max",
+    "ssr_max",
+    "str_min",
+    "sp_mean",
+    "tp_sum",
+    "ws_2m_mean",
+    "ws_2m_max",
+    "rh_min",
+    "rh_mean",
+    "rh_max",
+    "G_min",
+    "G_mean",
+    "G_max",
+    "nr",
+    "gdd",
+    "daily_pet_mean",
+]
+
+
+def _norm_aggregates(layout: Era5Layout) -> str:
+    return ",\n".join(
+        f'AVG({decoded(layout.storage, column)}) AS "{name}_avg",\n'
+        f'STDDEV({decoded(layout.storage, column)}) AS "{name}_stdev"'
+        for name, column in NORM_COLUMNS.items()
+    )
+
+
+def location_params(
+    layout: Era5Layout,
+    location: Optional[WGS84Point],
+    radius: Optional[float] = None,
+    k: Optional[int] = None,
+) -> Tuple[Optional[str], Dict[str, object]]:
+    """
+    The spatial restriction of a query and its parameters.
+
+    Without a radius the query is restricted to the ``k`` grid points nearest to the location, with a
+    radius to the grid points within ``radius`` meters of it. Both are answered with the GiST index on
+    the geometry.
+
+    Parameters:
+        layout: layout of the tables
+        location: the location, ``None`` does not restrict the query
+        radius: the radius around the location in meters
+        k: the number of nearest grid points, 1 when neither ``radius`` nor ``k`` is given
+    Returns:
+        ``NEAREST``, ``WITHIN`` or ``None`` and the parameters of the query
+    Raises:
+        ValueError: If the restriction is not valid or not supported by the layout.
+    """
+    if location is None:
+        if radius is not None or k is not None:
+            raise ValueError(
+                "radius and k should only be given together with a location"
+            )
+        return None, {}
+    if radius is not None and k is not None:
+        raise ValueError("give either a radius or k, not both")
+
+    params = {"wkt": f"SRID=4326;POINT({location.longitude} {location.latitude})"}
+    if radius is None:
+        k = 1 if k is None else k
+        if k < 1:
+            raise ValueError(f"k should be a positive number but found {k!r}")
+        if k > 1 and not layout.normalized:
+            # the daily table has a row per day for every grid point, only the grid table has a row per point
+            raise ValueError(
+                "the k nearest grid points can only be found in the normalized layout"
+            )
+        params["k"] = k
+        return NEAREST, params
+
+    if radius < 0:
+        raise ValueError(f"radius should not be negative but found {radius!r}")
+    # the bounding box in degrees that contains the circle, for the index scan before the exact distance
+    dlat = radius / METERS_PER_DEGREE
+    max_latitude = min(abs(location.latitude) + dlat, 90.0)
+    dlon = dlat / max(math.cos(math.radians(max_latitude)), 1e-9)
+    params.update(radius=radius, dlat=dlat, dlon=min(dlon, 360.0))
+    return WITHIN, params
+
+
+def _within(column: str) -> str:
+    return (
+        f"{column} && ST_Expand(ST_GeomFromText(:wkt), :dlon, :dlat) "
+        f"AND ST_DWithin({column}::geography, ST_GeomFromText(:wkt)::geography, :radius)"
+    )
+
+
+def _location_filter(
+    layout: Era5Layout, scope: Optional[str], column: str, table: str
+) -> str:
+    """
+    SQL condition for a spatial restriction.
+
+    Parameters:
+        layout: layout of the tables
+        scope: ``NEAREST``, ``WITHIN`` or ``None``
+        column: the (aliased) geometry column, or point id column in the normalized layout
+        table: the queried table, used to find the nearest point in the default layout
+    Returns:
+        the condition
+    """
+    if scope is None:
+        return "TRUE"
+    if layout.normalized:
+        if scope == NEAREST:
+            points = f'SELECT id FROM "{layout.grid_table}" WHERE is_land ORDER BY geometry <-> ST_GeomFromText(:wkt) LIMIT :k'
+        else:
+            points = f'SELECT id FROM "{layout.grid_table}" WHERE is_land AND {_within("geometry")}'
+        return f"{column} IN ({points})"
+    if scope == NEAREST:
+        closest = f'SELECT geometry FROM "{table}" ORDER BY geometry <-> ST_GeomFromText(:wkt) LIMIT 1'
+        return f"ST_DWithin({column}, ({closest}), 0)"
+    return _within(column)
+
+
+def unique_points_query(layout: Era5Layout) -> TextClause:
+    if layout.normalized:
+        return text(
+            f"""
+            SELECT ST_AsText(geometry)
+            FROM "{layout.grid_table}"
+            WHERE is_land;
+            """
+        )
+    return text(
+        f"""
+        SELECT ST_AsText(geometry)
+        FROM "{layout.table}"
+        GROUP BY geometry;
+        """
+    )
+
+
+def closest_point_query(layout: Era5Layout) -> TextClause:
+    if layout.normalized:
+        return text(
+            f"""
+            SELECT ST_AsText(geometry) FROM "{layout.grid_table}"
+            WHERE is_land
+            ORDER BY geometry::geometry <-> ST_GeomFromText(:wkt)::geometry
+            LIMIT 1;
+            """
+        )
+    return text(
+        f"""
+        SELECT ST_AsText(geometry) FROM "{layout.table}"
+        ORDER BY geometry::geometry <-> ST_GeomFromText(:wkt)::geometry
+        LIMIT 1;
+        """
+    )
+
+
+def closest_points_query(layout: Era5Layout) -> TextClause:
+    """
+    The nearest grid point of every location in the arrays ``:latitudes`` and ``:longitudes``, with a
+    KNN search per location in a single round trip. The rows are in the order of the locations.
+    """
+    table = layout.grid_table if layout.normalized else layout.table
+    land = "WHERE is_land" if layout.normalized else ""
+    return text(
+        f"""
+        SELECT ST_AsText(nearest.geometry) AS "geometry"
+        FROM unnest(CAST(:latitudes AS double precision[]), CAST(:longitudes AS double precision[]))
+            WITH ORDINALITY AS location(latitude, longitude, position)
+        CROSS JOIN LATERAL (
+            SELECT geometry FROM "{table}"
+            {land}
+            ORDER BY geometry <-> ST_SetSRID(ST_MakePoint(location.longitude, location.latitude), 4326)
+            LIMIT 1
+        ) AS nearest
+        ORDER BY location.position;
+        """
+    )
+
+
+def grid_points_query(layout: Era5Layout) -> TextClause:
+    """
+    The coordinates of all grid points with data, to build a ``src.postgis_era5.grid.GridIndex``.
+    """
+    if layout.normalized:
+        return text(
+            f"""
+            SELECT ST_AsText(geometry) AS "geometry", ST_Y(geometry) AS "latitude", ST_X(geometry) AS "longitude"
+            FROM "{layout.grid_table}"
+            WHERE is_land;
+            """
+        )
+    return text(
+        f"""
+        SELECT ST_AsText(geometry) AS "geometry", ST_Y(geometry) AS "latitude", ST_X(geometry) AS "longitude"
+        FROM "{layout.table}"
+        GROUP BY geometry;
+        """
+    )
+
+
+def monthly_norm_query(
+    layout: Era5Layout, windowed: bool = False, scope: Optional[str] = None
+) -> TextClause:
+    """
+    The norm of every day of ``:month`` computed from the daily table. When windowed, only the days
+    between ``:start`` and ``:end`` are used, see ``baseline_range``. The grid points are restricted
+    by ``scope``, see ``location_params``.
+    """
+    where = "EXTRACT(MONTH FROM time) = :month"
+    if windowed:
+        where = f"time >= :start AND time < :end AND {where}"
+    location = "point_id" if layout.normalized else "geometry"
+    where = f"{where} AND {_location_filter(layout, scope, location, layout.table)}"
+    if layout.normalized:
+        # aggregate on the integer point id and only join the grid table for the coordinates of the result
+        return text(
+            f"""
+            SELECT
+            ST_AsText(grid.geometry) AS "geometry",
+            norm.*
+            FROM (
+                SELECT
+                point_id,
+                EXTRACT(DAY FROM time) AS "day",
+                EXTRACT(MONTH FROM time) AS "month",
+                {_norm_aggregates(layout)}
+                FROM "{layout.table}"
+                WHERE {where}
+                GROUP BY EXTRACT(DAY FROM time), EXTRACT(MONTH FROM time), point_id
+            ) AS norm
+            JOIN "{layout.grid_table}" AS grid ON grid.id = norm.point_id;
+            """
+        )
+    return text(
+        f"""
+        SELECT
+        ST_AsText(geometry) AS "geometry",
+        EXTRACT(DAY FROM time) AS "day",
+        EXTRACT(MONTH FROM time) AS "month",
+        {_norm_aggregates(layout)}
+        FROM "{layout.table}"
+        WHERE {where}
+        GROUP BY EXTRACT(DAY FROM time), EXTRACT(MONTH FROM time), geometry;
+        """
+    )
+
+
+def _climatology_norms() -> str:
+    # STDDEV is the sample standard deviation, so it is only defined for more than one value
+    return ",\n".join(
+        f'"{name}_sum" / NULLIF("{name}_n", 0) AS "{name}_avg",\n'
+        f'CASE WHEN "{name}_n" > 1 THEN SQRT(GREATEST('
+        f'("{name}_sumsq" - "{name}_sum" * "{name}_sum" / "{name}_n") / ("{name}_n" - 1), 0'
+        f')) END AS "{name}_stdev"'
+        for name in NORM_COLUMNS
+    )
+
+
+def climatology_norm_query(
+    layout: Era5Layout, scope: Optional[str] = None
+) -> TextClause:
+    """
+    The norm of every day of ``:month`` over all years, read from the climatology table. The grid points
+    are restricted by ``scope``, see ``location_params``.
+    """
+    if layout.normalized:
+        location_filter = _location_filter(
+            layout, scope, "climatology.point_id", layout.climatology_table
+        )
+        return text(
+            f"""
+            SELECT
+            ST_AsText(grid.geometry) AS "geometry",
+            climatology.point_id,
+            climatology.day,
+            climatology.month,
+            {_climatology_norms()}
+            FROM "{layout.climatology_table}" AS climatology
+            JOIN "{layout.grid_table}" AS grid ON grid.id = climatology.point_id
+            WHERE climatology.month = :month AND {location_filter};
+            """
+        )
+    location_filter = _location_filter(
+        layout, scope, "geometry", layout.climatology_table
+    )
+    return text(
+        f"""
+        SELECT
+        ST_AsText(geometry) AS "geometry",
+        day,
+        month,
+        {_climatology_norms()}
+        FROM "{layout.climatology_table}"
+        WHERE month = :month AND {location_filter};
+        """
+    )
+
+
+def last_year_query(layout: Era5Layout) -> TextClause:
+    return text(
+        f"""
+        SELECT CAST(EXTRACT(YEAR FROM MAX(time)) AS integer) AS "year"
+        FROM "{layout.table}";
+        """
+    )
+
+
+def baseline_range(
+    last_year: int, year_range: int
+) -> Tuple[datetime.datetime, datetime.datetime]:
+    """
+    The start and the exclusive end of the ``year_range`` years up to and including ``last_year``.
+
+    Parameters:
+        last_year: the last year of the baseline
+        year_range: the number of years of the baseline
+    Returns:
+        the first moment of the baseline and the first moment after it
+    """
+    if year_range < 1:
+        raise ValueError(
+            f"year_range should be a positive number but found {year_range!r}"
+        )
+    return (
+        datetime.datetime(last_year - year_range + 1, 1, 1),
+        datetime.datetime(last_year + 1, 1, 1),
+    )
+
+
+def month_range(month: int, year: int) -> Tuple[datetime.datetime, datetime.datetime]:
+    """
+    The start and the exclusive end of a month.
+
+    Filtering with ``time >= :start AND time < :end`` instead of extracting the month and year from
+    ``time`` lets postgres use an index on time and prune the partitions of other years.
+
+    Parameters:
+        month: the month
+        year: the year
+    Returns:
+        the first moment of the month and of the month after it
+    """
+    start = datetime.datetime(year, month, 1)
+    end = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+    return start, end
+
+
+def historical_observations_query(
+    layout: Era5Layout, scope: Optional[str] = None
+) -> TextClause:
+    """
+    The daily values between ``:start`` and ``:end``, see ``month_range``. The grid points are
+    restricted by ``scope``, see ``location_params``.
+    """
+    columns = ",\n".join(
+        f'daily."{column}"'
+        if column not in DAILY_VALUE_COLUMNS
+        else f'{decoded(layout.storage, column, "daily.")} AS "{column}"'
+        for column in HISTORICAL_COLUMNS
+    )
+    if layout.normalized:
+        location_filter = _location_filter(
+            layout, scope, "daily.point_id", layout.table
+        )
+        return text(
+            f"""
+            SELECT
+            {columns},
+            ST_AsText(grid.geometry) AS "geometry"
+            FROM "{layout.table}" AS daily
+            JOIN "{layout.grid_table}" AS grid ON grid.id = daily.point_id
+            WHERE daily.time >= :start AND daily.time < :end
+            AND {location_filter};
+            """
+        )
+    location_filter = _location_filter(layout, scope, "daily.geometry", layout.table)
+    return text(
+        f"""
+        SELECT
+        {columns},
+        ST_AsText(daily.geometry) AS "geometry"
+        FROM "{layout.table}" AS daily
+        WHERE daily.time >= :start AND daily.time < :end
+        AND {location_filter};
+        """
+    )
@@ -0,0 +1,215 @@
+"""
+Storage profiles of the daily values, see ``src.postgis_era5.table.Era5Layout.storage``
+
+Like the packed variables of the ERA5-Land files, the scaled profile stores a value ``v`` as the integer
+``round((v - offset) / scale)``. The queries decode the values with ``decoded`` so the results are in the
+same units for every profile.
+"""
+import dataclasses as dc
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# every value as double precision, like GeoDataFrame.to_postgis
+STORAGE_DOUBLE = "double"
+# every value as a 4 byte real, about 7 significant digits
+STORAGE_REAL = "real"
+# every value as a scaled smallint or integer, see SCALED_COLUMNS
+STORAGE_SCALED = "scaled"
+STORAGES = (STORAGE_DOUBLE, STORAGE_REAL, STORAGE_SCALED)
+
+SMALLINT = "smallint"
+INTEGER = "integer"
+INTEGER_RANGES = {
+    SMALLINT: (np.iinfo(np.int16).min, np.iinfo(np.int16).max),
+    INTEGER: (np.iinfo(np.int32).min, np.iinfo(np.int32).max),
+}
+
+
+@dc.dataclass(frozen=True)
+class ColumnStorage:
+    """
+    How the values of a column are stored.
+
+    Parameters:
+        type: the postgres type of the column
+        scale: the value of one unit of a scaled integer column
+        offset: the value of zero of a scaled integer column
+    """
+
+    type: str
+    scale: float = 1.0
+    offset: float = 0.0
+
+    @property
+    def scaled(self) -> bool:
+        return self.type in INTEGER_RANGES
+
+
+def _scaled(type: str, scale: float) -> ColumnStorage:
+    return ColumnStorage(type=type, scale=scale)
+
+
+# the resolution is well below the precision of ERA5-Land, the ranges hold any value on earth
+SCALED_COLUMNS: Dict[str, ColumnStorage] = {
+    # Celcius, 0.01 degree up to +-327 degrees
+    **{
+        f"{variable}_{aggregation}": _scaled(SMALLINT, 0.01)
+        for variable in ("d2m", "t2m", "stl1")
+        for aggregation in ("min", "mean", "max")
+    },
+    # J m-2
+    "ssr_max": _scaled(INTEGER, 1.0),
+    "str_min": _scaled(INTEGER, 1.0),
+    # Pa
+    "sp_mean": _scaled(INTEGER, 0.1),
+    # mm
+    "tp_sum": _scaled(INTEGER, 0.001),
+    # m s-1
+    "ws_2m_mean": _scaled(SMALLINT, 0.01),
+    "ws_2m_max": _scaled(SMALLINT, 0.01),
+    # %
+    "rh_min": _scaled(SMALLINT, 0.01),
+    "rh_mean": _scaled(SMALLINT, 0.01),
+    "rh_max": _scaled(SMALLINT, 0.01),
+    # J m-2
+    "G_min": _scaled(INTEGER, 1.0),
+    "G_mean": _scaled(INTEGER, 1.0),
+    "G_max": _scaled(INTEGER, 1.0),
+    "nr": _scaled(INTEGER, 1.0),
+    # degree days
+    "gdd": _scaled(SMALLINT, 0.01),
+    # mm day-1
+    "daily_pet_mean": _scaled(SMALLINT, 0.01),
+}
+
+
+def column_storage(storage: str, column: str) -> ColumnStorage:
+    """
+    How a daily value column is stored in a storage profile.
+
+    Parameters:
+        storage: ``STORAGE_DOUBLE``, ``STORAGE_REAL`` or ``STORAGE_SCALED``
+        column: name of the column
+    Returns:
+        the type, scale and offset of the column
+    Raises:
+        ValueError: If the profile is unknown.
+    """
+    if storage == STORAGE_DOUBLE:
+        return ColumnStorage(type="double precision")
+    if storage == STORAGE_REAL:
+        return ColumnStorage(type="real")
+    if storage == STORAGE_SCALED:
+        return SCALED_COLUMNS[column]
+    raise ValueError(f"storage should be one of {STORAGES} but found {storage!r}")
+
+
+def _decimal_inverse(scale: float) -> Optional[int]:
+    # dividing by 100 gives the double nearest to the decimal value, multiplying by 0.01 does not
+    inverse = round(1 / scale)
+    if inverse > 1 and abs(inverse * scale - 1) < 1e-12:
+        return inverse
+    return None
+
+
+def decoded(storage: str, column: str, qualifier: str = "") -> str:
+    """
+    SQL expression for the double precision value of a daily value column.
+
+    Parameters:
+        storage: the storage profile
+        column: name of the column
+        qualifier: table alias including the dot, e.g. ``"daily."``
+    Returns:
+        the expression
+    """
+    expression = f'{qualifier}"{column}"'
+    if storage == STORAGE_DOUBLE:
+        return expression
+    stored = column_storage(storage, column)
+    expression = f"CAST({expression} AS double precision)"
+    inverse = _decimal_inverse(stored.scale)
+    if inverse is not None:
+        expression = f"{expression} / {inverse}"
+    elif stored.scale != 1.0:
+        expression = f"{expression} * {stored.scale!r}"
+    if stored.offset != 0.0:
+        expression = f"({expression} + {stored.offset!r})"
+    return expression
+
+
+def encode(values: np.ndarray, stored: ColumnStorage, column: str = "") -> np.ndarray:
+    """
+    Encode the values of a scaled integer column, NaN is encoded as 0 and should be written as NULL.
+
+    Parameters:
+        values: the values
+        stored: the storage of the column
+        column: name of the column for the error message
+    Returns:
+        the integers
+    Raises:
+        ValueError: If a value does not fit in the type of the column.
+    """
+    encoded = np.rint(
+        (np.asarray(values, dtype=np.float64) - stored.offset) / stored.scale
+    )
+    valid = ~np.isnan(encoded)
+    low, high = INTEGER_RANGES[stored.type]
+    if ((encoded[valid] < low) | (encoded[valid] > high)).any():
+        raise ValueError(
+            f"column {column!r} has values outside of the range of {stored.type} with scale {stored.scale}"
+        )
+    encoded[~valid] = 0
+    return encoded.astype(np.int16 if stored.type == SMALLINT else np.int32)
+
+
+def stored_values(values: np.ndarray, storage: str, column: str) -> np.ndarray:
+    """
+    The values of a daily value column as the queries read them back with ``decoded``, after the
+    rounding of their storage.
+
+    Parameters:
+        values: the values
+        storage: the storage profile
+        column: name of the column
+    Returns:
+        the values as doubles, NaN for NULL
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if storage == STORAGE_DOUBLE:
+        return values
+    stored = column_storage(storage, column)
+    if not stored.scaled:
+        return values.astype(np.float32).astype(np.float64)
+    decoded_values = encode(values, stored, column).astype(np.float64)
+    inverse = _decimal_inverse(stored.scale)
+    if inverse is not None:
+        decoded_values = decoded_values / inverse
+    elif stored.scale != 1.0:
+        decoded_values = decoded_values * stored.scale
+    if stored.offset != 0.0:
+        decoded_values = decoded_values + stored.offset
+    decoded_values[np.isnan(values)] = np.nan
+    return decoded_values
+
+
+def column_storage_rows(table: str, storage: str, columns: List[str]) -> List[dict]:
+    """
+    The rows of the column storage metadata table of a daily table, see
+    ``src.postgis_era5.table.column_storage_table``.
+    """
+    rows = []
+    for column in columns:
+        stored = column_storage(storage, column)
+        rows.append(
+            dict(
+                table_name=table,
+                column_name=column,
+                type=stored.type,
+                scale=stored.scale,
+                offset=stored.offset,
+            )
+        )
+    return rows
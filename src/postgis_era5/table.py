@@ -1,5 +1,23 @@
+import dataclasses as dc
+from typing import List
+
 from geoalchemy2 import Geometry
-from sqlalchemy import Column, DateTime, Float, MetaData, Table
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    DateTime,
+    Float,
+    Integer,
+    MetaData,
+    REAL,
+    Sequence,
+    SmallInteger,
+    Table,
+    Text,
+    func,
+)
+from src.postgis_era5.storage import STORAGE_DOUBLE, STORAGES, column_storage
 
 era5_table = Table(
     "era5",
@@ -43,3 +61,260 @@ era5_table = Table(
     Column("tp_mean", Float),
     Column("geometry", Geometry("POINT")),
 )
+
+# the daily values as written by scripts/era5_to_postgis.py, in the order of the ingested GeoDataFrame
+DAILY_VALUE_COLUMNS = [
+    "d2m_min",
+    "d2m_mean",
+    "d2m_max",
+    "t2m_min",
+    "t2m_mean",
+    "t2m_max",
+    "stl1_min",
+    "stl1_mean",
+    "stl1_max",
+    "ssr_max",
+    "str_min",
+    "sp_mean",
+    "tp_sum",
+    "ws_2m_mean",
+    "ws_2m_max",
+    "rh_min",
+    "rh_mean",
+    "rh_max",
+    "G_min",
+    "G_mean",
+    "G_max",
+    "nr",
+    "gdd",
+    "daily_pet_mean",
+]
+
+
+# the name of a daily norm -> the column of the daily table it is computed from
+NORM_COLUMNS = {
+    "t2m_min": "t2m_min",
+    "t2m_mean": "t2m_mean",
+    "t2m_max": "t2m_max",
+    "stl1_min": "stl1_min",
+    "stl1_mean": "stl1_mean",
+    "stl1_max": "stl1_max",
+    "d2m_min": "d2m_min",
+    "d2m_mean": "d2m_mean",
+    "d2m_max": "d2m_max",
+    "ws_2m_mean": "ws_2m_mean",
+    "ws_2m_max": "ws_2m_max",
+    "daily_pet_mean": "daily_pet_mean",
+    "gdd": "gdd",
+    "nr": "nr",
+    "ssr": "ssr_max",
+    "str": "str_min",
+    "tp": "tp_sum",
+}
+
+
+@dc.dataclass(frozen=True)
+class Era5Layout:
+    """
+    How the daily ERA5-Land values are stored in postgis.
+
+    In the default layout every row of the daily table has its own point geometry, like the tables
+    written by ``GeoDataFrame.to_postgis``. In the normalized layout the grid points are stored once in
+    the grid table and the daily table refers to them by their integer id, see
+    ``src.postgis_era5.grid.grid_point_ids``.
+
+    When partitioned, the daily table is range partitioned on time with a partition per year, see
+    ``src.postgis_era5.partitions``. With a climatology the ingestion maintains the running sums of the
+    daily norms in ``<table>_climatology``, see ``src.ingestion.climatology``.
+
+    The storage profile sets the types of the daily values, see ``src.postgis_era5.storage``. Storing
+    them as scaled integers makes the daily table about half the size, so more of it fits in memory.
+
+    Parameters:
+        table: name of the table with the daily values
+        normalized: whether the daily table refers to the grid table instead of storing geometries
+        grid_table: name of the table with the grid points of the normalized layout
+        partitioned: whether the daily table is partitioned by year
+        climatology: whether the climatology table is maintained
+        storage: how the daily values are stored, ``"double"``, ``"real"`` or ``"scaled"``
+    """
+
+    table: str = "era5_ecuador"
+    normalized: bool = False
+    grid_table: str = "grid_point"
+    partitioned: bool = False
+    climatology: bool = False
+    storage: str = STORAGE_DOUBLE
+
+    def __post_init__(self) -> None:
+        if self.storage not in STORAGES:
+            raise ValueError(
+                f"storage should be one of {STORAGES} but found {self.storage!r}"
+            )
+
+    @property
+    def climatology_table(self) -> str:
+        return f"{self.table}_climatology"
+
+
+# the SQLAlchemy type of the postgres types of the storage profiles
+STORAGE_TYPES = {
+    "double precision": Float(precision=53),
+    "real": REAL,
+    "smallint": SmallInteger,
+    "integer": Integer,
+}
+
+
+# the size of the postgres types of the storage profiles in bytes
+STORAGE_TYPE_SIZES = {"double precision": 8, "real": 4, "smallint": 2, "integer": 4}
+
+
+def _storage_order(storage: str) -> List[str]:
+    # wider columns first, so postgres does not need to pad the rows to align the columns
+    if storage == STORAGE_DOUBLE:
+        return DAILY_VALUE_COLUMNS
+    return sorted(
+        DAILY_VALUE_COLUMNS,
+        key=lambda column: -STORAGE_TYPE_SIZES[column_storage(storage, column).type],
+    )
+
+
+def daily_table(
+    name: str = "era5_ecuador",
+    normalized: bool = False,
+    partitioned: bool = False,
+    storage: str = STORAGE_DOUBLE,
+) -> Table:
+    """
+    The table with the daily ERA5-Land values per grid point.
+
+    The column types are the same as the ones ``GeoDataFrame.to_postgis`` creates for the ingested
+    GeoDataFrame, so tables created by either of them can be appended to by both.
+
+    Parameters:
+        name: name of the table
+        normalized: whether the grid point is referred to by ``point_id`` instead of a geometry column
+        partitioned: whether the table is range partitioned on time, the partitions are not created
+        storage: the storage profile of the daily values, see ``src.postgis_era5.storage``
+    Returns:
+        the table definition
+    """
+    if normalized:
+        location = Column("point_id", Integer, nullable=False)
+    else:
+        location = Column("geometry", Geometry("POINT", srid=4326))
+    return Table(
+        name,
+        MetaData(),
+        Column("time", DateTime),
+        *[
+            Column(column, STORAGE_TYPES[column_storage(storage, column).type])
+            for column in _storage_order(storage)
+        ],
+        location,
+        # the ingested file of the row, see ``src.ingestion.manifest.source_filter``
+        Column("source_id", Integer),
+        **({"postgresql_partition_by": "RANGE (time)"} if partitioned else {}),
+    )
+
+
+def grid_table(name: str = "grid_point") -> Table:
+    """
+    The table with the grid points of the normalized layout.
+
+    Parameters:
+        name: name of the table
+    Returns:
+        the table definition
+    """
+    return Table(
+        name,
+        MetaData(),
+        Column("id", Integer, primary_key=True, autoincrement=False),
+        Column("latitude", Float(precision=53), nullable=False),
+        Column("longitude", Float(precision=53), nullable=False),
+        Column("geometry", Geometry("POINT", srid=4326), nullable=False),
+        # whether ERA5-Land has values for the grid point, it has none for the sea
+        Column("is_land", Boolean, nullable=False),
+    )
+
+
+def climatology_table(layout: Era5Layout) -> Table:
+    """
+    The table with the count, sum and sum of squares of every daily norm per grid point and day of the year.
+
+    These running sums can be updated for new days without reading the old ones, and the average and
+    standard deviation follow from them directly.
+
+    Parameters:
+        layout: layout of the daily table
+    Returns:
+        the table definition
+    """
+    if layout.normalized:
+        location = Column("point_id", Integer, primary_key=True, autoincrement=False)
+    else:
+        location = Column("geometry", Geometry("POINT", srid=4326), primary_key=True)
+    sums = []
+    for name in NORM_COLUMNS:
+        sums += [
+            Column(f"{name}_n", BigInteger, nullable=False),
+            Column(f"{name}_sum", Float(precision=53), nullable=False),
+            Column(f"{name}_sumsq", Float(precision=53), nullable=False),
+        ]
+    return Table(
+        layout.climatology_table,
+        MetaData(),
+        location,
+        Column("month", SmallInteger, primary_key=True, autoincrement=False),
+        Column("day", SmallInteger, primary_key=True, autoincrement=False),
+        *sums,
+    )
+
+
+# one row per ingested .nc file, see src/ingestion/manifest.py
+manifest_table = Table(
+    "ingestion_manifest",
+    MetaData(),
+    Column("path", Text, primary_key=True),
+    Column("size", BigInteger, nullable=False),
+    Column("checksum", Text, nullable=False),
+    Column("pipeline_version", Text, nullable=False),
+    Column("table_name", Text, nullable=False),
+    Column("rows", BigInteger, nullable=False),
+    # the id the rows of the file are written with, None for files ingested before it was recorded
+    Column("source_id", Integer, unique=True),
+    # the extent of the rows that were written, its time range narrows the removal of the rows
+    Column("time_start", DateTime),
+    Column("time_end", DateTime),
+    Column("min_latitude", Float(precision=53)),
+    Column("max_latitude", Float(precision=53)),
+    Column("min_longitude", Float(precision=53)),
+    Column("max_longitude", Float(precision=53)),
+    Column("loaded_at", DateTime, nullable=False, server_default=func.now()),
+)
+
+# the source ids of the ingested files
+source_id_sequence = Sequence("ingestion_source_id_seq", metadata=MetaData())
+
+# a version per daily table that every ingestion increments, so cached query results of older versions
+# can be recognized, see ``src.postgis_era5.cache``
+dataset_version_table = Table(
+    "dataset_version",
+    MetaData(),
+    Column("table_name", Text, primary_key=True),
+    Column("version", BigInteger, nullable=False),
+    Column("updated_at", DateTime, nullable=False, server_default=func.now()),
+)
+
+# the storage of the daily value columns of every daily table, to decode them without this package
+column_storage_table = Table(
+    "column_storage",
+    MetaData(),
+    Column("table_name", Text, primary_key=True),
+    Column("column_name", Text, primary_key=True),
+    Column("type", Text, nullable=False),
+    Column("scale", Float(precision=53), nullable=False),
+    Column("offset", Float(precision=53), nullable=False),
+)
@@ -0,0 +1,93 @@
+import asyncio
+import datetime
+
+import pytest
+from src.postgis_era5.async_psql import AsyncPSQLInterface
+from src.postgis_era5.types import WGS84Point
+from tests.test_stream import COLUMNS, make_row
+
+
+class AsyncResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar_one(self):
+        return self.value
+
+    def keys(self):
+        return COLUMNS
+
+    def all(self):
+        return self.value
+
+
+class AsyncConnection:
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def __aenter__(self):
+        self.engine.active += 1
+        self.engine.max_active = max(self.engine.max_active, self.engine.active)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.engine.active -= 1
+
+    async def execute(self, query, params=None):
+        params = params or {}
+        if "wkt" in params:
+            # the later queries finish first
+            longitude = float(params["wkt"].split("(")[1].split()[0])
+            await asyncio.sleep(0.001 * (10 - longitude))
+            return AsyncResult(params["wkt"])
+        await asyncio.sleep(0.001 * (13 - params["start"].month))
+        return AsyncResult([make_row(params["start"], params["start"].month)])
+
+
+class FakeAsyncEngine:
+    """
+    Stands in for an ``AsyncEngine``, it counts the connections that are checked out at the same time.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+
+    def connect(self):
+        return AsyncConnection(self)
+
+
+def test_gather_bounds_the_concurrency_and_keeps_the_order():
+    engine = FakeAsyncEngine()
+    db = AsyncPSQLInterface(engine, max_concurrency=3)
+    locations = [WGS84Point(latitude=0.0, longitude=float(i)) for i in range(10)]
+
+    points = asyncio.run(
+        db.gather(db.get_closest_point(location) for location in locations)
+    )
+
+    assert points == [f"SRID=4326;POINT({float(i)} 0.0)" for i in range(10)]
+    assert engine.max_active == 3
+    assert engine.active == 0
+
+
+def test_gather_monthly_historical_observations():
+    engine = FakeAsyncEngine()
+    db = AsyncPSQLInterface(engine, max_concurrency=2)
+    months = [(month, 2018) for month in range(1, 13)]
+
+    observations = asyncio.run(db.gather_monthly_historical_observations(months))
+    frames = asyncio.run(
+        db.gather_monthly_historical_observations(months[:3], columnar=True)
+    )
+
+    assert [weather[0].date for weather in observations] == [
+        datetime.date(2018, month, 1) for month in range(1, 13)
+    ]
+    assert [frame.temperature_mean[0] for frame in frames] == [1.0, 2.0, 3.0]
+    assert engine.max_active == 2
+
+
+def test_max_concurrency_should_be_positive():
+    with pytest.raises(ValueError):
+        AsyncPSQLInterface(FakeAsyncEngine(), max_concurrency=0)
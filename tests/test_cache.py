@@ -0,0 +1,68 @@
+from src.postgis_era5.cache import MISSING, QueryCache
+from src.postgis_era5.parsing import DailyWeather
+from src.postgis_era5.types import WGS84Point
+
+
+def test_query_cache_lru():
+    cache = QueryCache(maxsize=2)
+    cache.put(1, "a", 1)
+    cache.put(1, "b", 2)
+    assert cache.get(1, "a") == 1
+    cache.put(1, "c", 3)
+    # b was used least recently
+    assert cache.get(1, "b") is MISSING
+    assert cache.get(1, "a") == 1 and cache.get(1, "c") == 3
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.evictions) == (3, 1, 1)
+
+
+def test_query_cache_version():
+    cache = QueryCache()
+    cache.put(1, "a", 1)
+    assert cache.get(2, "a") is MISSING
+    assert len(cache) == 0
+
+
+def test_query_cache_disk(tmp_path):
+    key = (
+        "retrieve_monthly_historical_observations",
+        ("location", WGS84Point(-0.2, -78.5)),
+    )
+    value = [DailyWeather(*range(19))]
+    QueryCache(directory=str(tmp_path)).put(1, key, value)
+
+    cache = QueryCache(directory=str(tmp_path))
+    assert cache.get(1, key) == value
+    assert cache.stats.disk_hits == 1
+    assert cache.get(1, key) == value
+    assert cache.stats.disk_hits == 1
+
+    assert cache.get(2, key) is MISSING
+    assert [path.name for path in (tmp_path / "default").iterdir()] == []
+
+
+def test_query_cache_shared_directory(tmp_path):
+    # a process that still has the old version does not remove the results of the newer one
+    old, new = QueryCache(directory=str(tmp_path)), QueryCache(directory=str(tmp_path))
+    old.put(1, "a", "old")
+    new.put(2, "a", "new")
+    old.put(1, "b", "old")
+    assert old.get(1, "b") == "old"
+    assert QueryCache(directory=str(tmp_path)).get(2, "a") == "new"
+    assert sorted(path.name for path in (tmp_path / "default").iterdir()) == ["2"]
+
+    # the versions of another table are kept
+    new.put(7, "a", "other", namespace="era5_peru")
+    assert QueryCache(directory=str(tmp_path)).get(2, "a") == "new"
+    assert new.get(7, "a", namespace="era5_peru") == "other"
+
+    # an older version is not served from memory or disk once a newer one was seen
+    assert new.get(1, "b") is MISSING
+
+
+def test_query_cache_disk_errors(tmp_path):
+    # a directory that can not be created only loses the disk tier
+    blocked = tmp_path / "file"
+    blocked.write_text("")
+    cache = QueryCache(directory=str(blocked))
+    cache.put(1, "a", 1)
+    assert cache.get(1, "a") == 1
@@ -0,0 +1,198 @@
+import datetime
+import re
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from src.ingestion.climatology import (
+    add_climatology,
+    frame_sums,
+    rebuild_climatology,
+    update_climatology,
+)
+from src.ingestion.manifest import Extent
+from src.postgis_era5.queries import _climatology_norms
+from src.postgis_era5.storage import STORAGE_SCALED, column_storage, encode
+from src.postgis_era5.table import NORM_COLUMNS, Era5Layout
+
+duckdb = pytest.importorskip("duckdb")
+
+LAYOUT = Era5Layout(table="daily", normalized=True, climatology=True)
+EXTENT = Extent(
+    time_start=datetime.datetime(2000, 1, 1),
+    time_end=datetime.datetime(2030, 1, 1),
+    min_latitude=0.0,
+    max_latitude=0.0,
+    min_longitude=0.0,
+    max_longitude=0.0,
+)
+
+
+class DuckDBConnection:
+    """
+    Runs the SQL of the climatology with DuckDB, which understands the upsert and the arithmetic of postgres.
+    """
+
+    def __init__(self):
+        self.db = duckdb.connect()
+        columns = sorted(set(NORM_COLUMNS.values()))
+        self.db.execute(
+            "CREATE TABLE daily (time TIMESTAMP, point_id INTEGER, source_id INTEGER, "
+            + ", ".join(f'"{column}" DOUBLE' for column in columns)
+            + ")"
+        )
+        sums = ", ".join(
+            f'"{name}_n" BIGINT NOT NULL, "{name}_sum" DOUBLE NOT NULL, "{name}_sumsq" DOUBLE NOT NULL'
+            for name in NORM_COLUMNS
+        )
+        self.db.execute(
+            f"CREATE TABLE daily_climatology (point_id INTEGER, month SMALLINT, day SMALLINT, {sums}, "
+            "PRIMARY KEY (point_id, month, day))"
+        )
+
+    def execute(self, statement, **params):
+        sql = re.sub(r":(\w+)", r"$\1", str(statement))
+        return self.db.execute(
+            sql, {name: value for name, value in params.items() if f"${name}" in sql}
+        )
+
+    def insert(self, df: pd.DataFrame) -> None:
+        self.db.register("frame", df)
+        self.db.execute("INSERT INTO daily BY NAME SELECT * FROM frame")
+        self.db.unregister("frame")
+
+    def sums(self, name: str) -> list:
+        return self.db.execute(
+            f'SELECT point_id, month, day, "{name}_n", "{name}_sum", "{name}_sumsq" '
+            "FROM daily_climatology ORDER BY point_id, month, day"
+        ).fetchall()
+
+
+def daily(source_id: int, years, values, point_id: int = 1) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "time": pd.to_datetime([f"{year}-03-14" for year in years]),
+            "point_id": point_id,
+            "source_id": source_id,
+            "t2m_mean": values,
+        }
+    )
+
+
+def test_update_climatology_adds_and_removes_a_file():
+    conn = DuckDBConnection()
+    conn.insert(daily(7, [2018, 2019], [1.0, 2.0]))
+    conn.insert(daily(8, [2020], [4.0]))
+    # a file of another source in the same period and area is not counted twice
+    update_climatology(conn, LAYOUT, EXTENT, 7)
+    update_climatology(conn, LAYOUT, EXTENT, 8)
+    assert conn.sums("t2m_mean") == [(1, 3, 14, 3, 7.0, 21.0)]
+
+    update_climatology(conn, LAYOUT, EXTENT, 8, sign=-1)
+    assert conn.sums("t2m_mean") == [(1, 3, 14, 2, 3.0, 5.0)]
+    with pytest.raises(ValueError):
+        update_climatology(conn, LAYOUT, EXTENT, 8, sign=2)
+
+
+def test_reingest_matches_a_rebuild():
+    conn = DuckDBConnection()
+    conn.insert(daily(7, [2018, 2019], [1.0, 2.0]))
+    conn.insert(daily(8, [2020, 2021], [4.0, 8.0]))
+    conn.insert(daily(9, [2020], [5.0], point_id=2))
+    for source_id in (7, 8, 9):
+        update_climatology(conn, LAYOUT, EXTENT, source_id)
+
+    # a changed file is removed from the climatology, its rows replaced and added again
+    update_climatology(conn, LAYOUT, EXTENT, 8, sign=-1)
+    conn.execute("DELETE FROM daily WHERE source_id = 8")
+    conn.insert(daily(8, [2020, 2021], [4.5, -3.0]))
+    update_climatology(conn, LAYOUT, EXTENT, 8)
+    incremental = conn.sums("t2m_mean")
+
+    rebuild_climatology(conn, LAYOUT)
+    assert conn.sums("t2m_mean") == pytest.approx(incremental)
+    assert incremental[0][3:5] == (4, 4.5)
+
+
+def test_norm_is_the_sample_standard_deviation():
+    rng = np.random.default_rng(7)
+    values = rng.normal(20, 3, size=30)
+    conn = DuckDBConnection()
+    conn.insert(daily(1, range(1990, 2020), values))
+    conn.insert(daily(2, [2020], [11.0], point_id=2))
+    rebuild_climatology(conn, LAYOUT)
+
+    norms = conn.db.execute(
+        f"SELECT point_id, {_climatology_norms()} FROM daily_climatology ORDER BY point_id"
+    ).fetchdf()
+    assert norms.t2m_mean_avg[0] == pytest.approx(np.mean(values))
+    assert norms.t2m_mean_stdev[0] == pytest.approx(np.std(values, ddof=1))
+    # the sample standard deviation of one value is not defined
+    assert norms.t2m_mean_avg[1] == 11.0
+    assert pd.isna(norms.t2m_mean_stdev[1])
+    # columns without values have no norm
+    assert pd.isna(norms.t2m_min_avg[0])
+
+
+@pytest.mark.parametrize("storage", ["double", "real", STORAGE_SCALED])
+def test_add_climatology_matches_the_stored_rows(storage):
+    layout = Era5Layout(
+        table="daily", normalized=True, climatology=True, storage=storage
+    )
+    rng = np.random.default_rng(3)
+    frame = pd.concat(
+        [
+            daily(5, range(2000, 2010), rng.normal(20, 5, size=10), point_id=point_id)
+            for point_id in (1, 2)
+        ],
+        ignore_index=True,
+    )
+    frame.loc[frame.index[3], "t2m_mean"] = np.nan
+    stored = frame.copy()
+    if storage == "real":
+        stored["t2m_mean"] = frame.t2m_mean.astype(np.float32).astype(float)
+    if storage == STORAGE_SCALED:
+        stored["t2m_mean"] = encode(
+            frame.t2m_mean, column_storage(storage, "t2m_mean")
+        ).astype(float)
+        stored.loc[stored.index[3], "t2m_mean"] = np.nan
+
+    from_table = DuckDBConnection()
+    from_table.insert(stored)
+    update_climatology(from_table, layout, EXTENT, 5)
+    from_memory = DuckDBConnection()
+    # the sums of a band are added to those of the bands before it
+    add_climatology(from_memory, layout, frame.iloc[:7])
+    add_climatology(from_memory, layout, frame.iloc[7:])
+
+    expected = from_table.sums("t2m_mean")
+    result = from_memory.sums("t2m_mean")
+    assert [row[:4] for row in result] == [row[:4] for row in expected]
+    for row, expected_row in zip(result, expected):
+        assert row[4:] == pytest.approx(expected_row[4:], rel=1e-12)
+    assert [row[3] for row in expected] == [9, 10]
+
+
+def test_frame_sums_of_the_default_layout():
+    layout = Era5Layout(table="daily", climatology=True)
+    gdf = gpd.GeoDataFrame(
+        {
+            "time": pd.to_datetime(["2018-03-14", "2019-03-14", "2019-03-15"]),
+            "t2m_mean": [1.0, 3.0, 5.0],
+        },
+        geometry=gpd.points_from_xy([-78.5, -78.5, -78.5], [-0.2, -0.2, -0.2]),
+        crs="EPSG:4326",
+    )
+
+    sums = frame_sums(gdf, layout)
+    assert sums[["latitude", "longitude", "month", "day"]].values.tolist() == [
+        [-0.2, -78.5, 3, 14],
+        [-0.2, -78.5, 3, 15],
+    ]
+    assert sums[["t2m_mean_n", "t2m_mean_sum", "t2m_mean_sumsq"]].values.tolist() == [
+        [2, 4.0, 10.0],
+        [1, 5.0, 25.0],
+    ]
+    # columns that are not in the frame are counted as missing
+    assert sums.t2m_min_n.tolist() == [0, 0]
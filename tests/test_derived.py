@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.ingestion.conversions import (
+    actual_vapour_pressure,
+    calculate_pet,
+    daily_gdd,
+    relative_humidity,
+    saturated_vapour_pressure,
+    wind_speed_10m_2m,
+    wind_speed_from_u_v,
+)
+from src.ingestion.derived import DAILY, HOURLY, Derived, DerivedGraph
+
+
+def test_hourly_matches_conversions():
+    rng = np.random.default_rng(42)
+    n = 1000
+    inputs = {
+        "u10": rng.uniform(-5, 5, n),
+        "v10": rng.uniform(-5, 5, n),
+        "d2m": rng.uniform(280, 295, n),
+        "t2m": rng.uniform(285, 305, n),
+        "tp": rng.uniform(0, 0.01, n),
+        "ssr": rng.uniform(0, 2e7, n),
+        "str": rng.uniform(-6e6, 0, n),
+        "hour": np.arange(n) % 24,
+    }
+    values = HOURLY.evaluate(inputs, ["ws_2m", "rh", "G"])
+
+    ws_2m = wind_speed_10m_2m(
+        wind_speed_from_u_v(pd.Series(inputs["u10"]), pd.Series(inputs["v10"]))
+    )
+    rh = relative_humidity(
+        actual_vapour_pressure(pd.Series(inputs["d2m"]) - 273.15),
+        saturated_vapour_pressure(pd.Series(inputs["t2m"]) - 273.15),
+    )
+    nr = inputs["ssr"] + inputs["str"]
+    np.testing.assert_array_equal(values["ws_2m"], ws_2m)
+    np.testing.assert_array_equal(values["rh"], rh)
+    np.testing.assert_array_equal(
+        values["G"],
+        np.where((inputs["hour"] >= 6) & (inputs["hour"] <= 18), nr * 0.1, nr * 0.5),
+    )
+
+
+def test_daily_matches_conversions():
+    rng = np.random.default_rng(42)
+    n = 1000
+    df = pd.DataFrame(
+        {
+            "ssr_max": rng.uniform(0, 2e7, n),
+            "str_min": rng.uniform(-6e6, 0, n),
+            "t2m_min": rng.uniform(10, 20, n),
+            "t2m_mean": rng.uniform(15, 25, n),
+            "t2m_max": rng.uniform(20, 30, n),
+            "d2m_mean": rng.uniform(5, 15, n),
+            "ws_2m_mean": rng.uniform(0, 5, n),
+            "sp_mean": rng.uniform(8e4, 1e5, n),
+            "G_mean": rng.uniform(-1e5, 1e6, n),
+        }
+    )
+    values = DAILY.evaluate(
+        {column: df[column].to_numpy() for column in df}, ["gdd", "daily_pet_mean"]
+    )
+
+    np.testing.assert_array_equal(values["gdd"], daily_gdd(df.t2m_max, df.t2m_min))
+    pet = calculate_pet(
+        surface_pressure_KPa=df.sp_mean / 1000,
+        temperature2m_C=df.t2m_mean,
+        dewpoint2m_C=df.d2m_mean,
+        windspeed2m_m_s=df.ws_2m_mean,
+        net_radiation_MJ_m2=(df.ssr_max + df.str_min) / 1000000,
+        soil_hf=df.G_mean / 1000000,
+        pet_time="daily",
+    )
+    np.testing.assert_array_equal(values["daily_pet_mean"], pet)
+
+
+def test_graph_errors():
+    def kernel(out, scratch, value):
+        out[:] = value
+
+    graph = DerivedGraph([Derived("a", ("b",), kernel), Derived("b", ("a",), kernel)])
+    with pytest.raises(ValueError):
+        graph.plan(["a"])
+    with pytest.raises(ValueError):
+        HOURLY.evaluate({"u10": np.zeros(3)}, ["ws_10m"])
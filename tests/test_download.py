@@ -0,0 +1,177 @@
+import json
+import threading
+import time
+
+import xarray as xr
+from src.ingestion.constants import VARIABLES
+from src.ingestion.download import (
+    CHUNK_VARIABLE,
+    DATASET,
+    DownloadManager,
+    chunk_requests,
+)
+from src.ingestion.implementation import CdsAPI
+from tests.test_transform import make_dataset
+
+
+class FakeClient:
+    """
+    Writes the request to the target, the first ``failures[month]`` requests of a month fail.
+    """
+
+    def __init__(self, failures=None):
+        self.failures = dict(failures or {})
+        self.requests = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def retrieve(self, name, request, target):
+        with self.lock:
+            self.requests.append(request)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            failures = self.failures.get(request["month"], 0)
+            self.failures[request["month"]] = failures - 1
+        try:
+            time.sleep(0.01)
+            if failures > 0:
+                raise ConnectionError("the request was rejected")
+            with open(target, "w") as f:
+                f.write(json.dumps([name, request]))
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+def chunks():
+    return chunk_requests(-5.0, 2.0, -81.0, -75.0, 2018, "ecuador")
+
+
+def test_download_concurrently(tmp_path):
+    client = FakeClient()
+    results = DownloadManager(client, str(tmp_path), max_concurrency=3).download(
+        chunks()
+    )
+
+    assert [result.path for result in results] == [
+        str(tmp_path / f"era5_ecuador_2018_{month:02d}.nc") for month in range(1, 13)
+    ]
+    assert all(result.ok and result.attempts == 1 for result in results)
+    assert 1 <= client.max_running <= 3
+    with open(results[1].path) as f:
+        name, request = json.load(f)
+    assert name == DATASET
+    assert request["month"] == "02" and request["area"] == [-5.0, -81.0, 2.0, -75.0]
+    assert not any(path.name.endswith(".part") for path in tmp_path.iterdir())
+
+
+def test_retry_with_backoff(tmp_path):
+    sleeps = []
+    manager = DownloadManager(
+        FakeClient(failures={"03": 2, "04": 5}),
+        str(tmp_path),
+        retries=3,
+        backoff=1.0,
+        sleep=sleeps.append,
+    )
+    results = {result.path[-5:-3]: result for result in manager.download(chunks())}
+
+    assert results["03"].ok and results["03"].attempts == 3
+    assert not results["04"].ok and results["04"].attempts == 4
+    assert "ConnectionError" in results["04"].error
+    assert sorted(sleeps) == [1.0, 1.0, 2.0, 2.0, 4.0]
+    assert not (tmp_path / "era5_ecuador_2018_04.nc").exists()
+    assert not any(path.name.endswith(".part") for path in tmp_path.iterdir())
+
+
+def test_resume_skips_verified_chunks(tmp_path):
+    DownloadManager(FakeClient(), str(tmp_path)).download(chunks())
+    # a file that was changed after it was downloaded
+    with open(tmp_path / "era5_ecuador_2018_05.nc", "r+") as f:
+        f.write("X")
+
+    client = FakeClient()
+    results = DownloadManager(client, str(tmp_path)).download(chunks())
+
+    assert [request["month"] for request in client.requests] == ["05"]
+    assert sum(result.skipped for result in results) == 11
+
+
+class NetCDFClient:
+    """
+    Writes the variable of a request of a single variable as a NetCDF file.
+    """
+
+    def __init__(self, fail_variable=None):
+        self.fail_variable = fail_variable
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def retrieve(self, name, request, target):
+        with self.lock:
+            self.requests.append(request)
+        (variable,) = request["variable"]
+        if variable == self.fail_variable:
+            raise ConnectionError("the request was rejected")
+        ds = make_dataset(days=2)
+        # the netCDF library is not thread safe, cdsapi writes the bytes of the response instead
+        with self.lock:
+            ds[[list(ds.data_vars)[VARIABLES.index(variable)]]].to_netcdf(target)
+
+
+def test_variable_chunks_are_merged_per_month(tmp_path):
+    client = NetCDFClient()
+    api = CdsAPI(client)
+    results = api.download_era5_land(
+        -5.0, 2.0, -81.0, -75.0, 2018, "ecuador", str(tmp_path), chunk=CHUNK_VARIABLE
+    )
+
+    assert len(client.requests) == 12 * 9
+    assert all(len(request["variable"]) == 1 for request in client.requests)
+    assert [result.path for result in results] == [
+        str(tmp_path / f"era5_ecuador_2018_{month:02d}.nc") for month in range(1, 13)
+    ]
+    assert all(result.ok and result.attempts == 9 for result in results)
+    with xr.open_dataset(results[0].path) as ds:
+        xr.testing.assert_identical(ds, make_dataset(days=2))
+    # the files of the variables are removed
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        name
+        for month in range(1, 13)
+        for name in (
+            f"era5_ecuador_2018_{month:02d}.nc",
+            f"era5_ecuador_2018_{month:02d}.nc.sha256",
+        )
+    )
+
+    # the variables of a merged month are not requested again
+    client = NetCDFClient()
+    results = DownloadManager(client, str(tmp_path)).download(
+        chunk_requests(-5.0, 2.0, -81.0, -75.0, 2018, "ecuador", chunk=CHUNK_VARIABLE)
+    )
+    assert client.requests == []
+    assert all(result.skipped for result in results)
+
+
+def test_month_is_not_merged_when_a_variable_fails(tmp_path):
+    manager = DownloadManager(
+        NetCDFClient(fail_variable="surface_pressure"), str(tmp_path), retries=0
+    )
+    results = manager.download(
+        chunk_requests(
+            -5.0,
+            2.0,
+            -81.0,
+            -75.0,
+            2018,
+            "ecuador",
+            chunk=CHUNK_VARIABLE,
+            months=["01"],
+        )
+    )
+
+    assert len(results) == 1 and "ConnectionError" in results[0].error
+    assert not (tmp_path / "era5_ecuador_2018_01.nc").exists()
+    # the downloaded variables are kept for the next attempt
+    assert (tmp_path / "era5_ecuador_2018_01_2m_temperature.nc").exists()
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from src.postgis_era5.grid import GRID_COLUMNS, GridIndex, grid_point_ids
+
+
+def test_grid_point_ids():
+    ids = grid_point_ids(
+        np.array([90.0, 90.0, -0.2, -90.0], dtype=np.float32),
+        np.array([-180.0, 180.0, -78.5, 179.9], dtype=np.float32),
+    )
+    # 180 east is the same grid point as 180 west
+    assert ids.tolist() == [0, 0, 902 * GRID_COLUMNS + 1015, 1800 * GRID_COLUMNS + 3599]
+
+
+def test_grid_point_ids_off_grid():
+    with pytest.raises(ValueError):
+        grid_point_ids(np.array([-0.25]), np.array([-78.5]))
+
+
+def test_grid_index_nearest():
+    latitude, longitude = np.meshgrid(
+        np.arange(-5, 16) / 10, np.arange(-790, -770) / 10
+    )
+    # the points of the western half are not land, so they are not in the index
+    land = longitude > -78.05
+    index = GridIndex(latitude[land], longitude[land])
+
+    rng = np.random.default_rng(42)
+    locations = rng.uniform([-0.6, -79.1], [1.6, -76.9], size=(1000, 2))
+    nearest = index.nearest(locations[:, 0], locations[:, 1])
+
+    distance = np.square(locations[:, :1] - index.latitude) + np.square(
+        locations[:, 1:] - index.longitude
+    )
+    np.testing.assert_allclose(
+        distance[np.arange(len(locations)), nearest], distance.min(axis=1)
+    )
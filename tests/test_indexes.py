@@ -0,0 +1,99 @@
+from src.ingestion.ingest import estimated_rows
+from src.postgis_era5.indexes import IndexSpec, drop_indexes, managed_indexes
+from src.postgis_era5.table import Era5Layout
+from tests.test_transform import make_dataset
+
+
+def test_managed_indexes():
+    default = managed_indexes(Era5Layout(table="era5_ecuador"))
+    assert [(index.name, index.method, index.columns) for index in default] == [
+        ("era5_ecuador_time_brin", "brin", ("time",)),
+        ("era5_ecuador_geometry_gist", "gist", ("geometry",)),
+    ]
+    normalized = managed_indexes(Era5Layout(table="era5_ecuador", normalized=True))
+    assert [(index.name, index.columns) for index in normalized] == [
+        ("era5_ecuador_time_brin", ("time",)),
+        ("era5_ecuador_point_id_time_btree", ("point_id", "time")),
+        ("grid_point_geometry_gist", ("geometry",)),
+    ]
+
+
+class Result:
+    def scalars(self):
+        return self
+
+    def all(self):
+        # no partitions
+        return []
+
+
+class AutocommitConnection:
+    def __init__(self, statements):
+        self.statements = statements
+
+    def execution_options(self, **options):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, statement, **params):
+        self.statements.append(" ".join(str(statement).split()))
+        return Result()
+
+
+class RecordingEngine:
+    def __init__(self):
+        self.statements = []
+
+    def connect(self):
+        return AutocommitConnection(self.statements)
+
+
+def test_drop_indexes_keeps_the_brin_index():
+    engine = RecordingEngine()
+    assert drop_indexes(engine, Era5Layout(table="era5_ecuador")) == [
+        "era5_ecuador_geometry_gist"
+    ]
+    assert (
+        engine.statements[-1]
+        == 'DROP INDEX CONCURRENTLY IF EXISTS "era5_ecuador_geometry_gist";'
+    )
+
+    engine = RecordingEngine()
+    # the index of the grid table is kept too
+    assert drop_indexes(engine, Era5Layout(table="era5_ecuador", normalized=True)) == [
+        "era5_ecuador_point_id_time_btree"
+    ]
+    assert not any("time_brin" in statement for statement in engine.statements)
+
+
+def test_create_sql():
+    index = IndexSpec(
+        "point_id_time_btree", "era5_ecuador", "btree", ("point_id", "time")
+    )
+
+    assert index.create_sql(concurrently=True) == (
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS "era5_ecuador_point_id_time_btree" '
+        'ON "era5_ecuador" USING btree ("point_id", "time");'
+    )
+    # the index of a partitioned table and the index of a partition that is attached to it
+    assert index.create_sql(only=True) == (
+        'CREATE INDEX IF NOT EXISTS "era5_ecuador_point_id_time_btree" '
+        'ON ONLY "era5_ecuador" USING btree ("point_id", "time");'
+    )
+    assert index.create_sql(table="era5_ecuador_2018", concurrently=True).startswith(
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS "era5_ecuador_2018_point_id_time_btree" '
+        'ON "era5_ecuador_2018"'
+    )
+
+
+def test_estimated_rows(tmp_path):
+    path = str(tmp_path / "era5.nc")
+    make_dataset(days=3).to_netcdf(path)
+
+    # the sea cells are counted
+    assert estimated_rows([path, path]) == 2 * 3 * 12
@@ -0,0 +1,60 @@
+import struct
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely.wkb
+from src.ingestion.loader import PGCOPY_HEADER, PGCOPY_TRAILER, encode_copy_binary
+
+
+def make_gdf() -> gpd.GeoDataFrame:
+    df = pd.DataFrame(
+        {
+            "time": pd.to_datetime(["2000-01-02", "2018-05-01"]),
+            "t2m_mean": [21.5, np.nan],
+        }
+    )
+    return gpd.GeoDataFrame(
+        df, geometry=gpd.points_from_xy([-78.5, -78.4], [-0.2, -0.1]), crs="EPSG:4326"
+    )
+
+
+def read_rows(stream: bytes):
+    assert stream.startswith(PGCOPY_HEADER)
+    assert stream.endswith(PGCOPY_TRAILER)
+    body = stream[len(PGCOPY_HEADER) : -len(PGCOPY_TRAILER)]
+    rows, offset = [], 0
+    while offset < len(body):
+        (field_count,) = struct.unpack_from("!h", body, offset)
+        offset += 2
+        fields = []
+        for _ in range(field_count):
+            (size,) = struct.unpack_from("!i", body, offset)
+            offset += 4
+            if size == -1:
+                fields.append(None)
+            else:
+                fields.append(body[offset : offset + size])
+                offset += size
+        rows.append(fields)
+    return rows
+
+
+def test_encode_copy_binary():
+    rows = read_rows(encode_copy_binary(make_gdf()))
+
+    assert len(rows) == 2
+    time, t2m_mean, geometry = rows[0]
+    # one day after the postgres epoch in microseconds
+    assert struct.unpack("!q", time) == (86_400_000_000,)
+    assert struct.unpack("!d", t2m_mean) == (21.5,)
+    point = shapely.wkb.loads(geometry)
+    assert (point.x, point.y) == (-78.5, -0.2)
+    assert shapely.wkb.dumps(point, include_srid=True) == geometry
+
+
+def test_nan_is_written_as_null():
+    rows = read_rows(encode_copy_binary(make_gdf()))
+
+    assert rows[1][1] is None
+    assert shapely.wkb.loads(rows[1][2]).y == -0.1
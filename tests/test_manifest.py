@@ -0,0 +1,53 @@
+from src.ingestion.manifest import (
+    Extent,
+    ManifestEntry,
+    file_checksum,
+    is_loaded,
+    pipeline_version,
+    source_filter,
+)
+from src.postgis_era5.table import Era5Layout
+
+
+def make_entry(path: str, **kwargs) -> ManifestEntry:
+    values = dict(
+        path=path,
+        size=5,
+        checksum=file_checksum(path),
+        pipeline_version=pipeline_version(),
+        table_name="era5_ecuador",
+        rows=1,
+        extent=Extent(),
+    )
+    values.update(kwargs)
+    return ManifestEntry(**values)
+
+
+def test_is_loaded(tmp_path):
+    path = tmp_path / "era5_ecuador_2018.nc"
+    path.write_bytes(b"12345")
+    path = str(path)
+
+    assert not is_loaded(None, path, pipeline_version())
+    assert is_loaded(make_entry(path), path, pipeline_version())
+    assert not is_loaded(make_entry(path, size=6), path, pipeline_version())
+    assert not is_loaded(make_entry(path, checksum="0"), path, pipeline_version())
+    assert not is_loaded(
+        make_entry(path, pipeline_version="0"), path, pipeline_version()
+    )
+
+
+def test_source_filter():
+    layout = Era5Layout()
+
+    # the rows of other files in the same period and area are not matched
+    assert (
+        source_filter(layout, 3)
+        == "source_id = :source_id AND time >= :time_start AND time <= :time_end"
+    )
+    # files ingested before the source was recorded
+    legacy = source_filter(layout, None)
+    assert legacy.startswith(
+        "time >= :time_start AND time <= :time_end AND geometry && ST_MakeEnvelope("
+    )
+    assert legacy.endswith("AND source_id IS NULL")
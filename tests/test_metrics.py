@@ -0,0 +1,128 @@
+import json
+
+import pytest
+from src.ingestion.transform import transform_band
+from src.postgis_era5.metrics import (
+    JsonLinesExporter,
+    MemoryExporter,
+    Metrics,
+    PrometheusExporter,
+    StageMetric,
+    file_stages,
+    stage,
+    timed_query,
+)
+from src.postgis_era5.psql import _instrumented
+from tests.test_transform import make_dataset
+
+
+def test_stages_are_summed_per_file():
+    memory = MemoryExporter()
+    with file_stages(Metrics([memory]), "a.nc"):
+        for band in range(3):
+            with stage("copy", rows_in=10) as run:
+                run.rows_out = 10
+        with stage("climatology"):
+            pass
+    # outside of a file the stages are only logged
+    with stage("copy", rows_in=10):
+        pass
+
+    assert [(metric.file, metric.stage) for metric in memory.records] == [
+        ("a.nc", "copy"),
+        ("a.nc", "climatology"),
+    ]
+    copy = memory.records[0]
+    assert copy.rows_in == copy.rows_out == 30
+    assert copy.seconds > 0 and copy.rows_per_second > 0
+    assert copy.process_peak_rss_bytes > 0
+
+
+def test_failed_stage_is_recorded():
+    memory = MemoryExporter()
+    with pytest.raises(ValueError):
+        with file_stages(Metrics([memory]), "a.nc"):
+            with stage("aggregate"):
+                raise ValueError("corrupt band")
+
+    assert memory.records[0].error == "ValueError: corrupt band"
+
+
+def test_transform_stages():
+    memory = MemoryExporter()
+    ds = make_dataset(days=2)
+    with file_stages(Metrics([memory]), "a.nc"):
+        gdf = transform_band(ds)
+
+    stages = {metric.stage: metric for metric in memory.records}
+    assert list(stages) == ["aggregate", "derived", "geodataframe"]
+    assert stages["aggregate"].rows_in == 48 * 4 * 3
+    # the ocean cell has no rows
+    assert (
+        stages["aggregate"].rows_out
+        == stages["geodataframe"].rows_out
+        == len(gdf)
+        == 2 * 11
+    )
+
+
+class Interface:
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    @_instrumented
+    def points(self):
+        return ["POINT(0 0)", "POINT(1 0)"]
+
+    @_instrumented
+    def closest_point(self):
+        # a query that uses another one is recorded once
+        return self.points()[0]
+
+
+def test_queries_are_recorded_once():
+    memory = MemoryExporter()
+    interface = Interface(Metrics([memory]))
+    interface.closest_point()
+    interface.points()
+    Interface(None).points()
+
+    assert [(metric.query, metric.rows) for metric in memory.records] == [
+        ("closest_point", 1),
+        ("points", 2),
+    ]
+    with timed_query(None, "points") as metric:
+        assert metric is None
+
+
+def test_exporters(tmp_path):
+    jsonl = JsonLinesExporter(str(tmp_path / "metrics.jsonl"))
+    prometheus = PrometheusExporter(str(tmp_path / "era5.prom"), interval=3600)
+    metrics = Metrics([jsonl, prometheus])
+    for seconds in (1.0, 3.0):
+        metrics.record(
+            StageMetric(
+                file="a.nc",
+                stage="copy",
+                seconds=seconds,
+                rows_in=10,
+                rows_out=10,
+                process_peak_rss_bytes=5,
+            )
+        )
+    with timed_query(metrics, 'say "hi"') as metric:
+        metric.rows = 4
+    metrics.close()
+
+    with open(tmp_path / "metrics.jsonl") as f:
+        lines = [json.loads(line) for line in f]
+    assert [line["kind"] for line in lines] == ["stage", "stage", "query"]
+    assert lines[1]["rows_per_second"] == pytest.approx(10 / 3)
+
+    text = (tmp_path / "era5.prom").read_text()
+    assert "# TYPE era5_ingest_stage_seconds_total counter" in text
+    assert 'era5_ingest_stage_seconds_total{stage="copy"} 4.0' in text
+    assert 'era5_ingest_stage_rows_out_total{stage="copy"} 20.0' in text
+    assert "era5_process_peak_rss_bytes 5" in text
+    assert 'era5_query_rows_total{query="say \\"hi\\""} 4.0' in text
+    assert not [path for path in tmp_path.iterdir() if path.suffix == ".tmp"]
@@ -0,0 +1,43 @@
+import contextlib
+
+from src.ingestion import parallel
+from src.postgis_era5.metrics import MemoryExporter, Metrics, file_stages, stage
+
+
+def test_a_failed_file_does_not_stop_the_others(monkeypatch):
+    def ingest_file(path, engine, options, metrics):
+        with file_stages(metrics, path), stage("copy", rows_in=10) as run:
+            if path == "b.nc":
+                raise ValueError("corrupt band")
+            run.rows_out = 10
+        return None if path == "c.nc" else 10
+
+    # the database is only needed by the steps around the files
+    monkeypatch.setattr(parallel, "create_tables", lambda engine, options, paths: None)
+    monkeypatch.setattr(
+        parallel, "bulk_load", lambda *args: contextlib.nullcontext(False)
+    )
+    monkeypatch.setattr(parallel, "ingest_file", ingest_file)
+    memory = MemoryExporter()
+
+    results = parallel.ingest_files(
+        ["a.nc", "b.nc", "c.nc", "d.nc"],
+        "postgresql://localhost/era5",
+        workers=1,
+        metrics=Metrics([memory]),
+        rebuild_indexes=False,
+    )
+
+    assert [
+        (result.path, result.ok, result.skipped, result.rows) for result in results
+    ] == [
+        ("a.nc", True, False, 10),
+        ("b.nc", False, False, 0),
+        ("c.nc", True, True, 0),
+        ("d.nc", True, False, 10),
+    ]
+    assert results[1].error == "ValueError: corrupt band"
+    # the stages of the failed file are reported too
+    assert [
+        (metric.file, metric.error) for metric in memory.records if metric.error
+    ] == [("b.nc", "ValueError: corrupt band")]
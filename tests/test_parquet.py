@@ -0,0 +1,95 @@
+import os
+
+import pandas as pd
+import pytest
+import xarray as xr
+from src.ingestion.parquet import (
+    _source_name,
+    parquet_files,
+    read_daily_parquet,
+    transform_to_parquet,
+    with_parquet,
+)
+from src.ingestion.transform import transform_dataset
+from tests.test_transform import make_dataset
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def nc_file(tmp_path):
+    # the last days of January and the first of February
+    ds = make_dataset(days=4)
+    ds = ds.assign_coords(time=ds.time + pd.Timedelta(days=29))
+    path = str(tmp_path / "era5_ecuador_2018.nc")
+    ds.to_netcdf(path)
+    return path
+
+
+def test_parquet_round_trip(nc_file, tmp_path):
+    root = str(tmp_path / "parquet")
+    rows = transform_to_parquet(nc_file, root, "ecuador", latitude_chunk=2)
+
+    paths = parquet_files(root)
+    assert [os.path.relpath(path, root) for path in paths] == [
+        os.path.join(
+            "region=ecuador",
+            "year=2018",
+            f"month={month}",
+            f"{_source_name(nc_file)}.{band}.parquet",
+        )
+        for month in ("01", "02")
+        for band in ("000", "001")
+    ]
+    with xr.open_dataset(nc_file) as ds:
+        expected = pd.concat(list(transform_dataset(ds, latitude_chunk=2)))
+    result = pd.concat([read_daily_parquet(path) for path in paths])
+
+    assert len(result) == rows
+    pd.testing.assert_frame_equal(
+        result.sort_values("time", kind="stable").reset_index(drop=True),
+        expected.sort_values("time", kind="stable").reset_index(drop=True),
+        check_exact=True,
+    )
+
+
+def test_rewrite_replaces_the_bands_of_a_file(nc_file, tmp_path):
+    root = str(tmp_path / "parquet")
+    transform_to_parquet(nc_file, root, "ecuador", latitude_chunk=1)
+    transform_to_parquet(nc_file, root, "ecuador")
+
+    assert len(parquet_files(root)) == 2
+    assert parquet_files(root, region="peru") == []
+    assert parquet_files(root, years=[2019]) == []
+
+
+def test_files_with_the_same_name_do_not_collide(nc_file, tmp_path):
+    root = str(tmp_path / "parquet")
+    other = tmp_path / "other"
+    other.mkdir()
+    other_file = str(other / os.path.basename(nc_file))
+    with xr.open_dataset(nc_file) as ds:
+        ds.to_netcdf(other_file)
+
+    transform_to_parquet(nc_file, root, "ecuador")
+    transform_to_parquet(other_file, root, "ecuador")
+
+    assert _source_name(nc_file) != _source_name(other_file)
+    assert len(parquet_files(root)) == 4
+
+
+def test_failed_rewrite_keeps_the_previous_files(nc_file, tmp_path):
+    root = str(tmp_path / "parquet")
+    transform_to_parquet(nc_file, root, "ecuador", latitude_chunk=1)
+    before = parquet_files(root)
+
+    def failing():
+        with xr.open_dataset(nc_file) as ds:
+            yield next(iter(transform_dataset(ds)))
+        raise RuntimeError("broken band")
+
+    with pytest.raises(RuntimeError, match="broken band"):
+        for _ in with_parquet(failing(), root, "ecuador", nc_file):
+            pass
+
+    assert parquet_files(root) == before
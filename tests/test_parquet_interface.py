@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from src.ingestion.parquet import transform_to_parquet
+from src.ingestion.transform import transform_dataset
+from src.postgis_era5.types import WGS84Point
+from tests.test_transform import make_dataset
+
+pytest.importorskip("pyarrow")
+pytest.importorskip("duckdb")
+
+from src.postgis_era5.parquet_interface import ParquetInterface, point_wkt  # noqa: E402
+
+
+@pytest.fixture
+def root(tmp_path):
+    """
+    The Parquet dataset of the last days of January and the first of February of 2018 and 2019.
+    """
+    root = str(tmp_path / "parquet")
+    for year in (2018, 2019):
+        ds = make_dataset(days=4)
+        ds = ds.assign_coords(
+            time=ds.time + (pd.Timestamp(f"{year}-01-30") - pd.Timestamp("2018-01-01"))
+        )
+        path = str(tmp_path / f"era5_ecuador_{year}.nc")
+        ds.to_netcdf(path)
+        transform_to_parquet(path, root, "ecuador")
+    return root
+
+
+def expected_daily(root):
+    with xr.open_dataset(root.replace("parquet", "era5_ecuador_2018.nc")) as ds:
+        gdf = pd.concat(list(transform_dataset(ds)))
+    return pd.DataFrame(gdf).assign(
+        geometry=[point_wkt(point.y, point.x) for point in gdf.geometry]
+    )
+
+
+def test_point_wkt():
+    assert point_wkt(-0.1, -78.0) == "POINT(-78 -0.1)"
+    assert point_wkt(-0.0, 0.30000000000000004) == "POINT(0.30000000000000004 0)"
+    assert point_wkt(1e-05, -77.9) == "POINT(-77.9 0.00001)"
+
+
+def test_points(root):
+    interface = ParquetInterface(root)
+    interface.check_connection()
+
+    # 4 x 3 grid points without the ocean cell
+    assert len(interface.get_all_unique_points()) == 11
+    assert (
+        interface.get_closest_point(WGS84Point(latitude=-0.12, longitude=-77.91))
+        == "POINT(-77.9 -0.1)"
+    )
+    assert interface.get_closest_points(np.array([[0.0, -78.0]])) == ["POINT(-77.9 0)"]
+
+
+def test_historical_observations(root):
+    interface = ParquetInterface(root, region="ecuador")
+    expected = expected_daily(root)
+    expected = expected[pd.DatetimeIndex(expected.time).month == 2]
+
+    result = interface.retrieve_monthly_historical_observations(2, 2018, columnar=True)
+    assert len(result) == len(expected) == 11 * 2
+    merged = result.merge(
+        expected,
+        left_on=["location", "date"],
+        right_on=["geometry", "time"],
+        validate="1:1",
+    )
+    np.testing.assert_array_equal(merged.temperature_max, merged.t2m_max)
+    np.testing.assert_array_equal(merged.total_precipitation_sum, merged.tp_sum)
+
+    rows = interface.retrieve_monthly_historical_observations(
+        2, 2018, location=WGS84Point(latitude=-0.1, longitude=-77.9), k=3
+    )
+    assert len({row.location for row in rows}) == 3 and len(rows) == 6
+    assert interface.retrieve_monthly_historical_observations(3, 2018) == []
+    assert (
+        ParquetInterface(root, region="peru").retrieve_monthly_historical_observations(
+            2, 2018
+        )
+        == []
+    )
+
+
+def test_radius(root):
+    interface = ParquetInterface(root)
+    location = WGS84Point(latitude=-0.1, longitude=-77.9)
+    # the grid points 0.1 degree away are about 11.1 km away, the diagonal ones about 15.7 km
+    counts = [
+        len(
+            interface.retrieve_monthly_historical_observations(
+                2, 2018, location=location, radius=radius
+            )
+        )
+        // 2
+        for radius in (1000.0, 12000.0, 16000.0)
+    ]
+    assert counts == [1, 5, 8]
+    with pytest.raises(ValueError):
+        interface.retrieve_monthly_norm(1, location=location, radius=1000.0, k=2)
+
+
+def test_monthly_norm(root):
+    interface = ParquetInterface(root)
+    daily = pd.concat(
+        interface.retrieve_monthly_historical_observations(1, year, columnar=True)
+        for year in (2018, 2019)
+    )
+    daily["day"] = daily.date.dt.day
+    grouped = daily.groupby(["location", "day"]).temperature_min
+    expected = pd.DataFrame(
+        {"avg": grouped.mean(), "stdev": grouped.std(ddof=1)}
+    ).reset_index()
+
+    result = interface.retrieve_monthly_norm(1, columnar=True)
+    assert len(result) == len(expected) == 11 * 2
+    assert set(result.month) == {1}
+    merged = result.merge(expected, on=["location", "day"], validate="1:1")
+    np.testing.assert_allclose(merged.temperature_min_avg, merged.avg, rtol=1e-12)
+    np.testing.assert_allclose(merged.temperature_min_stdev, merged.stdev, rtol=1e-12)
+
+    # the last year only, a single value per day has no standard deviation
+    norms = interface.retrieve_monthly_norm(1, year_range=1)
+    assert len(norms) == 11 * 2
+    assert all(norm.temperature_min_stdev is None for norm in norms)
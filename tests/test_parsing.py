@@ -0,0 +1,60 @@
+import dataclasses as dc
+import datetime
+import sys
+
+from src.postgis_era5.parsing import (
+    DAILY_WEATHER_COLUMNS,
+    DAILY_WEATHER_NORM_COLUMNS,
+    DailyWeather,
+    DailyWeatherNorm,
+    daily_weather_frame,
+    daily_weather_norm_frame,
+    parse_daily_weather,
+    parse_daily_weather_norm,
+)
+
+
+def _rows(columns, n):
+    rows = []
+    for i in range(n):
+        row = {column: float(i) for column in columns}
+        row.update(geometry="POINT(-78.5 -0.2)", month=5, day=i + 1)
+        row["time"] = datetime.datetime(2018, 5, i + 1)
+        rows.append(row)
+    return rows
+
+
+def test_daily_weather_frame():
+    columns = list(DAILY_WEATHER_COLUMNS)
+    rows = _rows(columns, 3)
+    df = daily_weather_frame(
+        [tuple(row.values()) for row in rows], columns=list(rows[0])
+    )
+
+    assert list(df.columns) == [field.name for field in dc.fields(DailyWeather)]
+    for record, weather in zip(df.to_dict("records"), parse_daily_weather(rows)):
+        assert record["date"].date() == weather.date
+        assert {k: v for k, v in record.items() if k != "date"} == {
+            k: v for k, v in dc.asdict(weather).items() if k != "date"
+        }
+
+
+def test_daily_weather_norm_frame():
+    # the climatology query of the normalized layout has an extra point_id column
+    columns = ["point_id", *DAILY_WEATHER_NORM_COLUMNS]
+    rows = _rows(columns, 3)
+    df = daily_weather_norm_frame(
+        [tuple(row.values()) for row in rows], columns=list(rows[0])
+    )
+
+    assert list(df.columns) == [field.name for field in dc.fields(DailyWeatherNorm)]
+    assert df.to_dict("records") == [
+        dc.asdict(norm) for norm in parse_daily_weather_norm(rows)
+    ]
+    assert daily_weather_norm_frame([], columns=DAILY_WEATHER_NORM_COLUMNS).empty
+
+
+def test_slots():
+    weather = parse_daily_weather(_rows(DAILY_WEATHER_COLUMNS, 1))[0]
+    assert not hasattr(weather, "__dict__")
+    assert sys.getsizeof(weather) < 8 * len(DAILY_WEATHER_COLUMNS) + 64
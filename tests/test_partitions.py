@@ -0,0 +1,69 @@
+import pytest
+from src.postgis_era5.partitions import (
+    detach_partition,
+    ensure_partitions,
+    partition_sql,
+)
+from src.postgis_era5.table import Era5Layout
+
+LAYOUT = Era5Layout(table="era5_ecuador", partitioned=True)
+
+
+class Result:
+    def scalar(self):
+        return 1
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement, **params):
+        self.statements.append((" ".join(str(statement).split()), params))
+        return Result()
+
+
+def test_partition_sql():
+    assert partition_sql(LAYOUT, 2018) == (
+        'CREATE TABLE IF NOT EXISTS "era5_ecuador_2018" PARTITION OF "era5_ecuador" '
+        "FOR VALUES FROM ('2018-01-01') TO ('2019-01-01');"
+    )
+    # the upper bound is exclusive, the last day of December belongs to its year
+    assert "FROM ('2019-01-01') TO ('2020-01-01')" in partition_sql(LAYOUT, 2019)
+
+
+def test_ensure_partitions():
+    conn = RecordingConnection()
+
+    assert ensure_partitions(conn, LAYOUT, [2019, 2018, 2019]) == [
+        "era5_ecuador_2018",
+        "era5_ecuador_2019",
+    ]
+    # every partition is created under its own advisory lock
+    assert conn.statements == [
+        (
+            "SELECT pg_advisory_xact_lock(hashtext(:name));",
+            {"name": "era5_ecuador_2018"},
+        ),
+        (partition_sql(LAYOUT, 2018), {}),
+        (
+            "SELECT pg_advisory_xact_lock(hashtext(:name));",
+            {"name": "era5_ecuador_2019"},
+        ),
+        (partition_sql(LAYOUT, 2019), {}),
+    ]
+    with pytest.raises(ValueError):
+        ensure_partitions(conn, Era5Layout(), [2018])
+
+
+def test_detach_partition_bumps_the_version():
+    conn = RecordingConnection()
+
+    assert detach_partition(conn, LAYOUT, 2018) == "era5_ecuador_2018"
+    assert conn.statements[0] == (
+        'ALTER TABLE "era5_ecuador" DETACH PARTITION "era5_ecuador_2018";',
+        {},
+    )
+    statement, params = conn.statements[1]
+    assert statement.startswith('INSERT INTO "dataset_version"')
+    assert params == {"table_name": "era5_ecuador"}
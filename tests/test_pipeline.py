@@ -0,0 +1,189 @@
+import logging
+import os
+import threading
+import time
+
+import pytest
+
+from src.ingestion import pipeline
+from src.ingestion.ingest import BandStream
+from src.ingestion.pipeline import Stage, download_and_ingest, run_pipeline
+from tests.test_download import FakeClient
+
+
+def sleeping(seconds, function=lambda value: value):
+    def stage(value):
+        time.sleep(seconds)
+        return function(value)
+
+    return stage
+
+
+def test_stages_overlap():
+    stages = [Stage(name, sleeping(0.05)) for name in ("download", "transform", "load")]
+
+    tic = time.perf_counter()
+    results = run_pipeline(range(6), stages)
+    seconds = time.perf_counter() - tic
+
+    assert [result.value for result in results] == list(range(6))
+    assert all(result.ok and result.stage == "load" for result in results)
+    # 18 steps of 0.05 seconds in sequence, 6 + 2 when the stages overlap
+    assert seconds < 0.7
+
+
+def test_backpressure():
+    produced, consumed = [], []
+    waiting = []
+    lock = threading.Lock()
+
+    def produce(value):
+        with lock:
+            produced.append(value)
+            waiting.append(len(produced) - len(consumed))
+        return value
+
+    def consume(value):
+        time.sleep(0.01)
+        with lock:
+            consumed.append(value)
+        return value
+
+    run_pipeline(
+        range(20),
+        [Stage("fast", produce, workers=2), Stage("slow", consume, queue_size=3)],
+    )
+
+    # the queue of 3, the item of the slow stage and the items of the 2 fast workers
+    assert max(waiting) <= 3 + 1 + 2
+    assert sorted(consumed) == list(range(20))
+
+
+def test_failed_and_finished_items_skip_the_next_stages():
+    def check(value):
+        if value == 2:
+            raise ValueError("corrupt file")
+        return None if value == 3 else value
+
+    loaded = []
+    results = run_pipeline(
+        range(5), [Stage("transform", check, workers=2), Stage("load", loaded.append)]
+    )
+
+    assert sorted(loaded) == [0, 1, 4]
+    assert results[2].stage == "transform" and "corrupt file" in results[2].error
+    assert (
+        results[3].ok and results[3].stage == "transform" and results[3].value is None
+    )
+    assert set(results[0].seconds) == {"transform", "load"}
+
+
+def test_band_stream_stays_ahead_by_at_most_ahead_bands():
+    produced = []
+
+    def bands():
+        for band in range(6):
+            produced.append(band)
+            yield band
+
+    stream = BandStream(bands, ahead=2)
+    consumed = []
+    for band in stream:
+        time.sleep(0.02)
+        # the band being produced, the bands waiting in the queue and the band being consumed
+        assert len(produced) - len(consumed) <= 2 + 2
+        consumed.append(band)
+    stream.close()
+
+    assert consumed == list(range(6))
+
+
+def test_band_stream_raises_the_error_of_the_transformation():
+    def bands():
+        yield 0
+        raise ValueError("broken band")
+
+    stream = BandStream(bands)
+    consumed = []
+    with pytest.raises(ValueError, match="broken band"):
+        for band in stream:
+            consumed.append(band)
+    stream.close()
+
+    assert consumed == [0]
+
+
+def test_band_stream_close_stops_the_transformation():
+    produced = []
+
+    def bands():
+        for band in range(100):
+            produced.append(band)
+            yield band
+
+    stream = BandStream(bands, ahead=1)
+    assert next(iter(stream)) == 0
+    stream.close()
+
+    assert not stream._thread.is_alive()
+    assert len(produced) < 5
+
+
+def test_band_streams_share_the_slots():
+    slots = threading.BoundedSemaphore(1)
+    running, most = [0], [0]
+    lock = threading.Lock()
+
+    def bands():
+        for band in range(3):
+            with lock:
+                running[0] += 1
+                most[0] = max(most[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            yield band
+
+    streams = [BandStream(bands, ahead=1, slots=slots) for _ in range(3)]
+    # the streams that wait for their consumer hold no slot, so the last one can be consumed first
+    assert [list(stream) for stream in reversed(streams)] == [[0, 1, 2]] * 3
+    for stream in streams:
+        stream.close()
+
+    assert most[0] == 1
+
+
+def test_download_and_ingest_a_new_region_year(monkeypatch, tmp_path, caplog):
+    engine = object()
+    monkeypatch.setattr(pipeline, "create_era5_engine", lambda url, **kwargs: engine)
+    monkeypatch.setattr(pipeline, "create_tables", lambda engine, options: None)
+    monkeypatch.setattr(
+        pipeline, "transform_file", lambda path, engine, options, *args: path
+    )
+
+    def load_file(path, engine, options, metrics):
+        # March was ingested by another process in the meantime
+        return None if path.endswith("_03.nc") else 10
+
+    monkeypatch.setattr(pipeline, "load_file", load_file)
+    # the directory of a new region-year does not exist yet
+    directory = str(tmp_path / "ecuador" / "2018")
+
+    with caplog.at_level(logging.INFO, logger=pipeline.__name__):
+        results = download_and_ingest(
+            FakeClient(),
+            directory,
+            "postgresql://",
+            -5.0,
+            2.0,
+            -81.0,
+            -75.0,
+            2018,
+            "ecuador",
+        )
+
+    assert all(result.ok and result.stage == "load" for result in results)
+    assert [result.value for result in results].count(None) == 1
+    assert len(os.listdir(directory)) == 2 * 12
+    assert "11/12 months of ecuador 2018 ingested, 1 skipped" in caplog.text
+    assert "110 rows" in caplog.text
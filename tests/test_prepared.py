@@ -0,0 +1,80 @@
+from sqlalchemy.sql import text
+from src.postgis_era5.prepared import execute_prepared, prepare_statement
+from src.postgis_era5.psql import PSQLInterface
+
+
+def test_prepare_statement():
+    name, prepare, names = prepare_statement(
+        "SELECT geometry::geometry FROM t WHERE time >= :start AND time < :end ORDER BY geometry <-> :wkt LIMIT :k OFFSET :k;"
+    )
+    assert prepare == (
+        f"PREPARE {name} AS SELECT geometry::geometry FROM t WHERE time >= $1 AND time < $2 "
+        "ORDER BY geometry <-> $3 LIMIT $4 OFFSET $4"
+    )
+    assert names == ("start", "end", "wkt", "k")
+
+
+class DBAPIConnection:
+    def __init__(self):
+        self.info = {}
+
+
+class RecordingConnection:
+    """
+    A connection of the pool, the statements prepared on it are remembered in the info of its DBAPI
+    connection like the pool does.
+    """
+
+    def __init__(self, dbapi_connection):
+        self.connection = dbapi_connection
+        self.statements = []
+
+    def exec_driver_sql(self, sql):
+        self.statements.append(sql)
+
+    def execute(self, query, **params):
+        self.statements.append(str(query))
+        return params
+
+
+QUERY = text("SELECT * FROM t WHERE time >= :start AND time < :end;")
+
+
+def test_statement_is_prepared_once_per_connection():
+    dbapi_connection = DBAPIConnection()
+    name, prepare, _ = prepare_statement(QUERY.text)
+
+    conn = RecordingConnection(dbapi_connection)
+    assert execute_prepared(conn, QUERY, start=1, end=2) == {"start": 1, "end": 2}
+    execute_prepared(conn, QUERY, start=2, end=3)
+    # a later checkout of the same connection reuses the statement too
+    again = RecordingConnection(dbapi_connection)
+    execute_prepared(again, QUERY, start=3, end=4)
+
+    assert conn.statements == [
+        prepare,
+        f"EXECUTE {name}(:start, :end)",
+        f"EXECUTE {name}(:start, :end)",
+    ]
+    assert again.statements == [f"EXECUTE {name}(:start, :end)"]
+
+
+def test_statement_is_prepared_again_on_a_new_connection():
+    name, prepare, _ = prepare_statement(QUERY.text)
+    first, second = RecordingConnection(DBAPIConnection()), RecordingConnection(
+        DBAPIConnection()
+    )
+
+    execute_prepared(first, QUERY, start=1, end=2)
+    execute_prepared(second, QUERY, start=1, end=2)
+
+    assert (
+        first.statements
+        == second.statements
+        == [prepare, f"EXECUTE {name}(:start, :end)"]
+    )
+
+
+def test_prepared_statements_are_off_by_default():
+    # a pooler in transaction mode may not run the EXECUTE on the connection that has the statement
+    assert PSQLInterface(engine=None).prepared is False
@@ -0,0 +1,36 @@
+import datetime
+
+import pytest
+from src.postgis_era5.queries import NEAREST, WITHIN, location_params, month_range
+from src.postgis_era5.table import Era5Layout
+from src.postgis_era5.types import WGS84Point
+
+LOCATION = WGS84Point(latitude=-0.2, longitude=-78.5)
+
+
+def test_month_range():
+    assert month_range(12, 2018) == (
+        datetime.datetime(2018, 12, 1),
+        datetime.datetime(2019, 1, 1),
+    )
+
+
+def test_location_params():
+    assert location_params(Era5Layout(), None) == (None, {})
+    assert location_params(Era5Layout(), LOCATION)[0] == NEAREST
+    assert location_params(Era5Layout(normalized=True), LOCATION, k=4)[1]["k"] == 4
+
+    scope, params = location_params(Era5Layout(), LOCATION, radius=11_057.4)
+    assert scope == WITHIN
+    assert params["dlat"] == pytest.approx(0.1)
+    assert params["dlon"] >= params["dlat"]
+
+
+def test_location_params_invalid():
+    with pytest.raises(ValueError):
+        location_params(Era5Layout(), None, k=1)
+    with pytest.raises(ValueError):
+        location_params(Era5Layout(), LOCATION, radius=1000, k=1)
+    with pytest.raises(ValueError):
+        # the default layout has no table with one row per grid point
+        location_params(Era5Layout(), LOCATION, k=2)
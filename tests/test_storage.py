@@ -0,0 +1,48 @@
+import struct
+
+import numpy as np
+import pandas as pd
+import pytest
+from src.ingestion.loader import encode_copy_binary
+from src.postgis_era5.storage import (
+    SCALED_COLUMNS,
+    STORAGE_SCALED,
+    ColumnStorage,
+    decoded,
+    encode,
+)
+from tests.test_loader import read_rows
+
+
+def test_encode_round_trip():
+    stored = SCALED_COLUMNS["t2m_mean"]
+    values = np.array([21.57, -3.14, np.nan, 0.005])
+    encoded = encode(values, stored, "t2m_mean")
+
+    assert encoded.dtype == np.int16
+    assert encoded.tolist() == [2157, -314, 0, 0]
+    # decoded like the SQL of ``decoded``
+    assert (encoded[:2] / 100).tolist() == [21.57, -3.14]
+    assert (
+        decoded(STORAGE_SCALED, "t2m_mean", "daily.")
+        == 'CAST(daily."t2m_mean" AS double precision) / 100'
+    )
+
+
+def test_encode_out_of_range():
+    with pytest.raises(ValueError):
+        encode(
+            np.array([400.0]), ColumnStorage(type="smallint", scale=0.01), "t2m_mean"
+        )
+
+
+def test_encode_copy_binary_scaled():
+    df = pd.DataFrame(
+        {"t2m_mean": [21.57, np.nan], "nr": [1234567.4, 1.0], "point_id": [7, 8]}
+    )
+    rows = read_rows(encode_copy_binary(df, storage=STORAGE_SCALED))
+
+    assert struct.unpack("!h", rows[0][0]) == (2157,)
+    assert struct.unpack("!i", rows[0][1]) == (1234567,)
+    assert rows[1][0] is None
+    assert struct.unpack("!i", rows[1][2]) == (8,)
@@ -0,0 +1,155 @@
+import datetime
+
+import pandas as pd
+import pytest
+from src.postgis_era5.metrics import MemoryExporter, Metrics
+from src.postgis_era5.parsing import DAILY_WEATHER_COLUMNS, DailyWeather
+from src.postgis_era5.psql import PSQLInterface
+from src.postgis_era5.table import Era5Layout
+
+COLUMNS = ["time", *[column for column in DAILY_WEATHER_COLUMNS if column != "time"]]
+
+
+class Row(tuple):
+    """
+    A row of the cursor, by position like ``daily_weather_frame`` reads it and by name like
+    ``parse_daily_weather`` does.
+    """
+
+    @property
+    def _mapping(self):
+        return dict(zip(COLUMNS, self))
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return super().__getitem__(COLUMNS.index(key))
+        return super().__getitem__(key)
+
+
+def make_row(day: datetime.datetime, i: int) -> Row:
+    values = {column: float(i) for column in COLUMNS}
+    values.update(time=day, geometry="POINT(-78.5 -0.2)")
+    return Row(values[column] for column in COLUMNS)
+
+
+class StreamedResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def keys(self):
+        return COLUMNS
+
+    def partitions(self, size):
+        for start in range(0, len(self.rows), size):
+            yield self.rows[start : start + size]
+
+
+class StreamingConnection:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.engine.closed = True
+
+    def execution_options(self, **options):
+        self.engine.options = options
+        return self
+
+    def execute(self, query, **params):
+        self.engine.statements.append((str(query), params))
+        if self.engine.error is not None:
+            raise self.engine.error
+        return StreamedResult(self.engine.rows)
+
+
+class StreamingEngine:
+    def __init__(self, rows, error=None):
+        self.rows = rows
+        self.error = error
+        self.statements = []
+        self.options = None
+        self.closed = False
+
+    def connect(self):
+        return StreamingConnection(self)
+
+
+def new_year_rows():
+    # the last days of 2018 and the first days of 2019, which are in different partitions
+    days = pd.date_range("2018-12-29", "2019-01-03").to_pydatetime()
+    return [make_row(day, i) for i, day in enumerate(days)]
+
+
+def test_stream_in_batches_across_years():
+    rows = new_year_rows()
+    engine = StreamingEngine(rows)
+    memory = MemoryExporter()
+    interface = PSQLInterface(
+        engine, Era5Layout(partitioned=True), metrics=Metrics([memory])
+    )
+
+    start, end = datetime.datetime(2018, 12, 29), datetime.datetime(2019, 1, 4)
+    batches = list(interface.stream_historical_observations(start, end, batch_size=4))
+
+    assert [len(batch) for batch in batches] == [4, 2]
+    weather = [value for batch in batches for value in batch]
+    assert all(isinstance(value, DailyWeather) for value in weather)
+    assert [value.date for value in weather] == [row[0].date() for row in rows]
+    # one range on time, which postgres prunes to the partitions of both years
+    query, params = engine.statements[0]
+    assert "daily.time >= :start AND daily.time < :end" in query
+    assert "EXTRACT" not in query
+    assert (params["start"], params["end"]) == (start, end)
+    assert engine.options == {"stream_results": True, "max_row_buffer": 4}
+    assert engine.closed
+    assert [(metric.query, metric.rows) for metric in memory.records] == [
+        ("stream_historical_observations", 6)
+    ]
+
+
+def test_stream_columnar():
+    rows = new_year_rows()
+    interface = PSQLInterface(StreamingEngine(rows))
+
+    batches = list(
+        interface.stream_historical_observations(
+            datetime.datetime(2018, 12, 29),
+            datetime.datetime(2019, 1, 4),
+            batch_size=5,
+            columnar=True,
+        )
+    )
+
+    assert [len(batch) for batch in batches] == [5, 1]
+    df = pd.concat(batches, ignore_index=True)
+    assert list(df.columns) == [field for field in DailyWeather.__slots__]
+    assert df.date.dt.year.tolist() == [2018, 2018, 2018, 2019, 2019, 2019]
+    assert df.temperature_mean.tolist() == [float(i) for i in range(6)]
+
+
+def test_stream_closes_the_connection_early():
+    engine = StreamingEngine(new_year_rows())
+    stream = PSQLInterface(engine).stream_historical_observations(
+        datetime.datetime(2018, 12, 29), datetime.datetime(2019, 1, 4), batch_size=2
+    )
+
+    assert len(next(stream)) == 2
+    stream.close()
+    assert engine.closed
+
+
+def test_stream_errors():
+    memory = MemoryExporter()
+    interface = PSQLInterface(
+        StreamingEngine([], error=RuntimeError("gone")), metrics=Metrics([memory])
+    )
+    start, end = datetime.datetime(2018, 1, 1), datetime.datetime(2019, 1, 1)
+
+    with pytest.raises(RuntimeError):
+        list(interface.stream_historical_observations(start, end))
+    assert memory.records[0].error == "RuntimeError: gone"
+    with pytest.raises(ValueError):
+        next(interface.stream_historical_observations(start, end, batch_size=0))
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+from benchmarks.synthetic import (
+    SHORT_NAMES,
+    _accumulated,
+    synthetic_era5_land,
+    write_netcdf,
+)
+from src.ingestion.constants import VARIABLES
+from src.ingestion.transform import transform_dataset
+
+
+def test_accumulated_from_midnight():
+    hours = np.array([22, 23, 0, 1, 2, 3, 0, 1])
+    accumulated = _accumulated(np.ones((8, 1, 1)), hours)
+
+    assert accumulated.ravel().tolist() == [1, 2, 3, 1, 2, 3, 4, 1]
+
+
+def test_synthetic_file(tmp_path):
+    ds = synthetic_era5_land(latitudes=5, longitudes=10, days=2, sea_fraction=0.2)
+    path = str(tmp_path / "era5_synthetic.nc")
+    write_netcdf(ds, path)
+
+    assert list(ds.data_vars) == [SHORT_NAMES[variable] for variable in VARIABLES]
+    assert ds.latitude.values[0] > ds.latitude.values[-1]
+    with xr.open_dataset(path) as packed:
+        # 16 bit integers keep about 5 significant digits
+        for name in ds.data_vars:
+            np.testing.assert_allclose(
+                packed[name], ds[name], rtol=0, atol=2e-5 * float(abs(ds[name]).max())
+            )
+        gdf = pd.concat(list(transform_dataset(packed)))
+
+    # the two western longitudes are sea
+    assert len(gdf) == 5 * 8 * 2
+    assert gdf.t2m_mean.between(10, 30).all()
+    assert (gdf.ssr_max > 0).all() and (gdf.tp_sum >= 0).all()
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from src.ingestion.land_mask import cached_land_mask, grid_key
+from src.ingestion.transform import (
+    transform_band,
+    transform_dataframe,
+    transform_dataset,
+)
+
+
+def make_dataset(days: int = 3, latitudes: int = 4, longitudes: int = 3) -> xr.Dataset:
+    rng = np.random.default_rng(42)
+    time = pd.date_range("2018-01-01", periods=days * 24, freq=pd.Timedelta(hours=1))
+    # ERA5 stores the latitudes in descending order
+    latitude = np.round(np.linspace(0.0, -0.1 * (latitudes - 1), latitudes), 1)
+    longitude = np.round(
+        np.linspace(-78.0, -78.0 + 0.1 * (longitudes - 1), longitudes), 1
+    )
+    shape = (len(time), len(latitude), len(longitude))
+
+    def field(low: float, high: float) -> np.ndarray:
+        return rng.uniform(low, high, shape)
+
+    data = {
+        "u10": field(-5, 5),
+        "v10": field(-5, 5),
+        "d2m": field(280, 295),
+        "t2m": field(285, 305),
+        "stl1": field(285, 305),
+        "ssr": field(0, 2e7),
+        "str": field(-6e6, 0),
+        "sp": field(8e4, 1e5),
+        "tp": field(0, 0.01),
+    }
+    # an ocean cell
+    for values in data.values():
+        values[:, 0, 0] = np.nan
+    return xr.Dataset(
+        {
+            name: (("time", "latitude", "longitude"), values)
+            for name, values in data.items()
+        },
+        coords={"time": time, "latitude": latitude, "longitude": longitude},
+    )
+
+
+def test_latitude_bands_give_identical_output():
+    ds = make_dataset()
+    expected = transform_dataframe(ds.to_dataframe())
+
+    for latitude_chunk in (1, 3, 10):
+        result = pd.concat(list(transform_dataset(ds, latitude_chunk=latitude_chunk)))
+        pd.testing.assert_frame_equal(result.reset_index(drop=True), expected)
+
+
+def test_ocean_cells_are_dropped():
+    gdf = pd.concat(list(transform_dataset(make_dataset(), latitude_chunk=1)))
+    assert len(gdf) == 3 * (4 * 3 - 1)
+    assert not gdf.drop(columns="geometry").isna().any().any()
+
+
+@pytest.mark.parametrize("dtype", ["float64", "float32"])
+def test_array_aggregation_is_identical_to_the_dataframe(dtype):
+    ds = make_dataset(days=4).astype(dtype)
+    # a missing hour in one variable, a missing day of a grid point and an incomplete last day
+    ds["t2m"][5, 1, 1] = np.nan
+    ds["tp"][24:48, 2, 2] = np.nan
+    ds = ds.isel(time=slice(0, 4 * 24 - 7))
+
+    expected = transform_dataframe(ds.to_dataframe())
+    result = transform_band(ds)
+
+    pd.testing.assert_frame_equal(result, expected, check_exact=True)
+    assert len(result) == 4 * (4 * 3 - 1) - 1
+
+
+def test_land_mask_gives_identical_output(tmp_path):
+    ds = make_dataset()
+    # a latitude of sea only, it is not read at all
+    for values in ds.data_vars.values():
+        values[:, 3, :] = np.nan
+    expected = pd.concat(list(transform_dataset(ds, latitude_chunk=1)))
+
+    land = cached_land_mask(ds, str(tmp_path))
+    assert land.sum() == 4 * 3 - 1 - 3
+    assert [path.name for path in tmp_path.iterdir()] == [
+        f"land_mask_{grid_key(ds)}.npy"
+    ]
+
+    result = pd.concat(
+        list(
+            transform_dataset(
+                ds, latitude_chunk=1, land=cached_land_mask(ds, str(tmp_path))
+            )
+        )
+    )
+    pd.testing.assert_frame_equal(result, expected, check_exact=True)